@@ -0,0 +1,94 @@
+import os
+import dataclasses
+from dataclasses import dataclass
+import pandas as pd
+from config import RunConfig
+from delta_log_formation import EventLogSplitter
+from process import ProcessManager
+
+# Files the in-memory API can still write when asked to
+ARTIFACTS = ("delta_logs", "delta_stats", "cases_output", "evaluation", "confusion_matrix", "case_db", "case_index")
+
+
+@dataclass
+class ClassificationResult:
+    """Results of `classify_events`, as in-memory tables."""
+    cases: pd.DataFrame       # One row per case, typed as `case_export.CASE_DTYPES`
+    deltas: pd.DataFrame      # One delta report per row, indexed by delta position
+    evaluation: pd.DataFrame  # Confusion counts and metrics per delta, as written by `evaluation.evaluate`
+    metrics: dict             # Weighted accuracy, precision, recall and F1-score
+    validation: pd.DataFrame  # Rows and rejects per delta of the validation stage
+    quarantine: pd.DataFrame  # Rejected event rows with their reason codes (empty if written to disk)
+
+
+def as_read_from_csv(events: pd.DataFrame) -> pd.DataFrame:
+    """Give the completion times the type `process_logs` gets from a delta log (Python datetimes)."""
+    times = pd.Series(events["completeTime"].to_numpy(dtype="datetime64[us]").astype(object), index=events.index,
+                      dtype=object)
+    return events.assign(completeTime=times)
+
+
+def run_config_for(config: RunConfig, artifacts) -> RunConfig:
+    """The run configuration with every disk artifact that was not asked for turned off."""
+    artifacts = set(artifacts)
+    unknown = artifacts - set(ARTIFACTS)
+    if unknown:
+        raise ValueError(f"Unknown artifacts {sorted(unknown)}; choose from {ARTIFACTS}.")
+    if config.late_event_watermark is not None:
+        raise ValueError("The late-event mode reads events back from the delta logs; use ProcessManager.run for it.")
+    if "case_index" in artifacts and "delta_logs" not in artifacts:
+        raise ValueError("The case index points into the delta logs; add the delta_logs artifact.")
+    if "case_db" in artifacts and config.case_db_path is None:
+        raise ValueError("The case_db artifact needs case_db_path in the configuration.")
+
+    return dataclasses.replace(
+        config,
+        saved_outputs=[name for name in ("delta_stats", "cases_output", "evaluation") if name in artifacts],
+        confusion_matrix_path=config.confusion_matrix_path if "confusion_matrix" in artifacts else None,
+        case_db_path=config.case_db_path if "case_db" in artifacts else None,
+        case_index="case_index" in artifacts,
+        # The review sample reads its events back from the event log file
+        sample_output_dir=None,
+    )
+
+
+def classify_events(events, config: RunConfig = None, artifacts=(), progress=False) -> ClassificationResult:
+    """
+    Classify the cases of an event log held in memory and return the results as tables.
+
+    The events are validated and split into the initial log and delta logs in memory, and each
+    delta is handed to `ProcessManager` without a CSV round trip. Nothing is written to disk
+    unless it is listed in `artifacts`.
+
+    :param events: DataFrame of raw event rows (the columns of the event log CSV), or an iterable of
+                   such DataFrames arriving over time, in roughly chronological order (see
+                   `EventLogSplitter.iter_split_batches`).
+    :param config: Run parameters (frequency, initial months, max days, ...); defaults to `config.py`.
+    :param artifacts: Files to write anyway, from `ARTIFACTS`, to the paths of `config`.
+    :param progress: Show the progress bars and messages of `ProcessManager`; off, so callers only get the results.
+    """
+    config = run_config_for(config or RunConfig(), artifacts)
+    log_dir = config.delta_log_dir if "delta_logs" in artifacts else None
+    splitter = EventLogSplitter.from_config(config)
+    if isinstance(events, pd.DataFrame):
+        split_logs = splitter.iter_split_logs(events, log_dir)
+    else:
+        split_logs = splitter.iter_split_batches(events, log_dir)
+
+    process_manager = ProcessManager(config=config)
+    process_manager.keep_results = True
+    process_manager.progress = progress
+    for delta_name, delta_events in split_logs:
+        if log_dir is not None:
+            file_name = "initial_log.csv" if delta_name == "initial_log" else delta_name
+            delta_events.to_csv(os.path.join(log_dir, file_name), index=False)
+        process_manager.process_events(as_read_from_csv(delta_events), delta_name)
+    if log_dir is not None:
+        splitter.validator.save_report()
+
+    evaluation, metrics = process_manager.finalise()
+    reports = process_manager.delta_reports
+    deltas = pd.DataFrame([reports[position] for position in sorted(reports)])
+    return ClassificationResult(cases=process_manager.case_table, deltas=deltas.set_index("delta_index"),
+                                evaluation=evaluation, metrics=metrics, validation=splitter.validator.report(),
+                                quarantine=splitter.validator.quarantine())
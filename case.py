@@ -1,17 +1,29 @@
 from datetime import timedelta, datetime
 import pandas as pd
 
-from delta import Delta
+from delta import Delta, delta_label
+from variant_trie import VariantTrie
 from config import attributes_for_miss_check
 
 
 class Case:
-    def __init__(self, event, delta_name: str, delta: Delta):
-        self.initialize_case_attributes(event, delta_name, delta)
+    def __init__(self, event, delta_name: str, delta: Delta, variants: VariantTrie):
+        self.initialize_case_attributes(event, delta_name, delta, variants)
         self.initialize_timestamps(event)
         self.register_new_case(delta, event)
 
-    def initialize_case_attributes(self, event, delta_name: str, delta: Delta):
+    def __getstate__(self):
+        """Leave the shared variant trie out when the case is pickled (e.g. spilled to disk)."""
+        state = self.__dict__.copy()
+        del state["variants"]
+        return state
+
+    @property
+    def trace(self):
+        """Full list of event names, rebuilt from the shared variant trie."""
+        return self.variants.trace(self.trace_node)
+
+    def initialize_case_attributes(self, event, delta_name: str, delta: Delta, variants: VariantTrie):
         """Initialize the primary attributes of the Case."""
         self.critical_events = {"BILLED", "FIN", "RELEASE", "CODE OK"}
         self.rejected_events = {"STORNO", "REJECT", "SET STATUS"}
@@ -25,9 +37,9 @@ class Case:
         self.last_event = event.get("event")
         self.unique_events = {self.last_event}
         self.missing_events = {"BILLED", "FIN", "RELEASE", "CODE OK"}
-        self.trace = [self.last_event]
-        self.length = len(self.trace)
-
+        self.variants = variants
+        self.trace_node = variants.advance(VariantTrie.ROOT, self.last_event)
+        self.length = variants.depth(self.trace_node)
 
         self.cancelled = self.check_cancelled(event)
         self.complete = False
@@ -39,15 +51,21 @@ class Case:
 
         self.short = True
         self.t_since_last_event = 0
-        self.event_gaps = [self.t_since_last_event]
+        # Running aggregates of the waiting times; count and sum start with the zero gap of the first event
+        # (as used by avg_wait_time), the extremes only cover real gaps and stay None until the first update
+        self.wait_count = 1
+        self.wait_sum = 0.0
+        self.wait_min = None
+        self.wait_max = None
         self.avg_wait_time = None
 
         self.sleep = False
         self.ongoing = True
 
         self.first_delta = delta_name
-        self.last_delta_update = delta_name[:8]
+        self.last_delta_update = delta_label(delta_name)
         self.delta_counts_array = [0]
+        self.last_update_position = delta.position
 
         self.missing_attributes = {}
         self.n_events_w_missing_attr = 0
@@ -64,25 +82,26 @@ class Case:
 
     def register_new_case(self, delta: Delta, event):
         """Register the case as a new case in the Delta object."""
-        delta.initialised_cases.add(self.case_id)
+        delta.add_initialised(self.case_id)
         delta.process_event(event)
 
 
-    def update(self, event, delta:Delta, delta_counts:pd.DataFrame):
+    def update(self, event, delta:Delta):
         """Update the case attributes based on a new event."""
         self.update_event_attributes(event)
         self.update_case_status(event, delta)
         self.update_time_gap(event)
+        delta.process_wait_time(self.last_event, self.t_since_last_event.total_seconds(), self.case_id)
         self.run_function_and_update_status(delta.delta_file_name, self.final_status, self.check_completeness())
-        self.append_delta(delta, delta_counts)
+        self.append_delta(delta)
         delta.process_event(event)
     def update_event_attributes(self, event):
         """Update attributes related to the event."""
         self.last_event = event.get('event')
         self.last_state = event.get('state')
         self.unique_events.add(self.last_event)
-        self.trace.append(self.last_event)
-        self.length = len(self.trace)
+        self.trace_node = self.variants.advance(self.trace_node, self.last_event)
+        self.length = self.variants.depth(self.trace_node)
 
     def update_case_status(self, event, delta: Delta):
         """Update the case status attributes."""
@@ -101,8 +120,7 @@ class Case:
                                                            self.check_ongoing())
 
 
-        if self.case_id not in delta.initialised_cases:
-            delta.ongoing_cases_count.add(self.case_id)
+        delta.add_updated(self.case_id)
 
 
     def update_time_gap(self, event):
@@ -112,13 +130,19 @@ class Case:
                         if isinstance(complete_time, str) else complete_time)
 
         self.t_since_last_event = current_time - self.last_event_time
-        self.event_gaps.append(self.t_since_last_event.total_seconds())
-        self.avg_wait_time = sum(self.event_gaps) / len(self.event_gaps)
+        gap = self.t_since_last_event.total_seconds()
+        self.wait_count += 1
+        self.wait_sum += gap
+        self.wait_min = gap if self.wait_min is None else min(self.wait_min, gap)
+        self.wait_max = gap if self.wait_max is None else max(self.wait_max, gap)
+        self.avg_wait_time = self.wait_sum / self.wait_count
         self.last_event_time = current_time
 
 
-    def append_delta(self,delta: Delta, delta_counts: pd.DataFrame):
-        self.delta_counts_array.append(delta_counts.loc[self.case_id, "count"])
+    def append_delta(self, delta: Delta):
+        """Record the number of deltas since the previous update of the case."""
+        self.delta_counts_array.append(delta.position - self.last_update_position)
+        self.last_update_position = delta.position
         self.last_delta_update = delta.delta_file_name
 
 
@@ -0,0 +1,215 @@
+import os
+import json
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deltas (
+    delta_index INTEGER PRIMARY KEY,
+    delta_file_name TEXT NOT NULL,
+    total_events INTEGER,
+    ongoing_count INTEGER,
+    cancelled_count INTEGER,
+    complete_count INTEGER,
+    incomplete_count INTEGER,
+    initialised_count INTEGER,
+    updated_count INTEGER,
+    cases_processed INTEGER,
+    event_counts TEXT
+);
+CREATE TABLE IF NOT EXISTS delta_members (
+    delta_index INTEGER NOT NULL REFERENCES deltas (delta_index),
+    delta_file_name TEXT NOT NULL,
+    case_id TEXT NOT NULL,
+    membership TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cases (
+    case_id TEXT PRIMARY KEY,
+    final_status TEXT NOT NULL,
+    cancelled INTEGER,
+    complete INTEGER,
+    incomplete INTEGER,
+    ongoing INTEGER,
+    sleep INTEGER,
+    isBilled INTEGER,
+    isUnbillable INTEGER,
+    have_crit_events INTEGER,
+    issues TEXT,
+    missing_events TEXT,
+    last_state TEXT,
+    last_event TEXT,
+    length INTEGER,
+    transition_count INTEGER,
+    first_transition_to TEXT,
+    first_delta TEXT,
+    last_delta_update TEXT,
+    first_event_time TEXT,
+    last_event_time TEXT,
+    completion_seconds REAL,
+    avg_wait_time REAL
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    case_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    previous TEXT,
+    new TEXT,
+    delta_name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_deltas_name ON deltas (delta_file_name);
+CREATE INDEX IF NOT EXISTS idx_members_case ON delta_members (case_id);
+CREATE INDEX IF NOT EXISTS idx_members_delta ON delta_members (delta_file_name, membership);
+CREATE INDEX IF NOT EXISTS idx_cases_status ON cases (final_status, last_state);
+CREATE INDEX IF NOT EXISTS idx_transitions_case ON transitions (case_id, seq);
+CREATE INDEX IF NOT EXISTS idx_transitions_delta ON transitions (delta_name);
+"""
+
+# Report keys holding case id sets and the membership they are stored under
+MEMBERSHIPS = {
+    "initialised_cases": "initialised",
+    "updated_cases": "updated",
+    "complete_cases": "complete",
+    "incomplete_cases": "incomplete",
+    "cancelled_cases": "cancelled",
+    "ongoing_cases": "ongoing",
+}
+
+DELTA_COLUMNS = ["total_events", "ongoing_count", "cancelled_count", "complete_count", "incomplete_count",
+                 "initialised_count", "updated_count", "cases_processed"]
+
+CASE_COLUMNS = ["final_status", "cancelled", "complete", "incomplete", "ongoing", "sleep", "isBilled",
+                "isUnbillable", "have_crit_events", "issues", "last_state", "last_event", "length",
+                "transition_count", "first_transition_to", "first_delta", "last_delta_update", "avg_wait_time"]
+
+
+class CaseDatabase:
+    """
+    Local SQLite store of the case and delta outputs with a small query API.
+
+    `ProcessManager` writes each delta report (and the case memberships it lists) as soon as the
+    delta is processed, and the final case states and status transitions at the end of the run.
+    """
+
+    def __init__(self, path, reset=False):
+        """
+        :param path: SQLite database file.
+        :param reset: Drop the results of a previous run stored in the same file.
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        if reset:
+            for table in ("delta_members", "deltas", "transitions", "cases"):
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # ===================== Writing ===================== #
+    def write_delta(self, report: dict):
+        """
+        Store one `Delta.generate_report` dictionary and its case memberships.
+
+        A report with the `delta_index` of a stored delta (a revision after late events) replaces it.
+        """
+        with self.connection:
+            delta_index = report.get("delta_index")
+            if delta_index is not None:
+                self.connection.execute("DELETE FROM delta_members WHERE delta_index = ?", (delta_index,))
+            cursor = self.connection.execute(
+                f"INSERT OR REPLACE INTO deltas (delta_index, delta_file_name, {', '.join(DELTA_COLUMNS)}, event_counts) "
+                f"VALUES (?, ?, {', '.join('?' * len(DELTA_COLUMNS))}, ?)",
+                [delta_index, report["delta_file_name"]] + [report[column] for column in DELTA_COLUMNS]
+                + [json.dumps(report["event_counts"], default=str)]
+            )
+            delta_index = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO delta_members (delta_index, delta_file_name, case_id, membership) VALUES (?, ?, ?, ?)",
+                ((delta_index, report["delta_file_name"], str(case_id), membership)
+                 for key, membership in MEMBERSHIPS.items() for case_id in report.get(key) or ())
+            )
+        return delta_index
+
+    def write_cases(self, cases, batch_size=10_000):
+        """
+        Store the final state and status transitions of every case.
+
+        :param cases: Iterable of (case_id, Case) pairs, e.g. `ProcessManager.cases.items()`.
+        """
+        insert_case = (f"INSERT OR REPLACE INTO cases (case_id, {', '.join(CASE_COLUMNS)}, missing_events, "
+                       f"first_event_time, last_event_time, completion_seconds) "
+                       f"VALUES ({', '.join('?' * (len(CASE_COLUMNS) + 5))})")
+        insert_transition = "INSERT INTO transitions (case_id, seq, previous, new, delta_name) VALUES (?, ?, ?, ?, ?)"
+
+        with self.connection:
+            self.connection.execute("DELETE FROM transitions")
+            case_rows, transition_rows = [], []
+            for case_id, case in cases:
+                case_rows.append(
+                    [str(case_id)] + [self.to_sql(getattr(case, column)) for column in CASE_COLUMNS]
+                    + [json.dumps(sorted(case.missing_events, key=str), default=str),
+                       str(case.first_event_time), str(case.last_event_time),
+                       (case.last_event_time - case.first_event_time).total_seconds()]
+                )
+                transition_rows.extend((str(case_id), seq, transition["previous"], transition["new"],
+                                        transition["delta_name"])
+                                       for seq, transition in enumerate(case.status_transitions))
+                if len(case_rows) >= batch_size:
+                    self.connection.executemany(insert_case, case_rows)
+                    self.connection.executemany(insert_transition, transition_rows)
+                    case_rows, transition_rows = [], []
+            self.connection.executemany(insert_case, case_rows)
+            self.connection.executemany(insert_transition, transition_rows)
+
+    @staticmethod
+    def to_sql(value):
+        """Convert NumPy scalars and other non-SQLite values of a case attribute."""
+        if value is None or isinstance(value, (str, int, float)):
+            return value
+        if hasattr(value, "item"):
+            return value.item()
+        return str(value)
+
+    # ===================== Queries ===================== #
+    def query(self, sql, parameters=()):
+        """Run an arbitrary query and return the rows as dictionaries."""
+        cursor = self.connection.execute(sql, parameters)
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def case(self, case_id):
+        """Final state of one case, or None if it is unknown."""
+        rows = self.query("SELECT * FROM cases WHERE case_id = ?", (case_id,))
+        return rows[0] if rows else None
+
+    def status_history(self, case_id):
+        """Status transitions of one case in the order they happened."""
+        return self.query("SELECT previous, new, delta_name FROM transitions WHERE case_id = ? ORDER BY seq",
+                          (case_id,))
+
+    def delta_history(self, case_id):
+        """Every delta that listed the case, with the membership (initialised, complete, ...) it had there."""
+        return self.query("SELECT delta_index, delta_file_name, membership FROM delta_members "
+                          "WHERE case_id = ? ORDER BY delta_index", (case_id,))
+
+    def cases_with_status(self, final_status, last_state=None, limit=None):
+        """Cases with a final status, optionally restricted to a last state (e.g. INCOMPLETE and 'Released')."""
+        sql = "SELECT * FROM cases WHERE final_status = ?"
+        parameters = [final_status]
+        if last_state is not None:
+            sql += " AND last_state = ?"
+            parameters.append(last_state)
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return self.query(sql, parameters)
+
+    def delta_members(self, delta_file_name, membership):
+        """Case ids a delta reported under a membership, e.g. ('2013_w46', 'incomplete')."""
+        rows = self.connection.execute(
+            "SELECT case_id FROM delta_members WHERE delta_file_name = ? AND membership = ?",
+            (delta_file_name, membership))
+        return [case_id for (case_id,) in rows]
+
+    def status_counts(self):
+        """Number of cases per final status."""
+        return dict(self.connection.execute("SELECT final_status, COUNT(*) FROM cases GROUP BY final_status"))
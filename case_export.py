@@ -0,0 +1,126 @@
+import os
+from operator import attrgetter
+from collections import Counter
+import pandas as pd
+
+# Columns of the case output, in the order of earlier versions of the file. The internal `trace_node`
+# (a node of the run's variant trie) is left out; the `trace` column holds the full trace
+DEFAULT_COLUMNS = [
+    "case_id", "final_status", "status_transitions", "transition_count", "first_transition_to", "last_state",
+    "last_event", "unique_events", "missing_events", "length", "cancelled", "complete", "incomplete",
+    "isBilled", "isUnbillable", "have_crit_events", "issues", "short", "wait_count", "wait_sum", "wait_min",
+    "wait_max", "avg_wait_time", "sleep", "ongoing", "first_delta", "last_delta_update", "delta_counts_array",
+    "missing_attributes", "n_events_w_missing_attr", "status_trace", "first_event_time", "last_event_time",
+    "trace", "completion_time",
+]
+# Columns that are not attributes of `Case`
+COMPUTED_COLUMNS = {"trace", "completion_time"}
+# Types of the in-memory case table; the other columns (sets, lists, dicts) stay Python objects
+CASE_DTYPES = {
+    "case_id": "string", "final_status": "category", "first_transition_to": "category", "last_state": "category",
+    "last_event": "category", "issues": "category", "first_delta": "category", "last_delta_update": "category",
+    "transition_count": "Int64", "trace_node": "Int64", "length": "Int64", "wait_count": "Int64",
+    "n_events_w_missing_attr": "Int64", "cancelled": "boolean", "complete": "boolean", "incomplete": "boolean",
+    "isBilled": "boolean", "isUnbillable": "boolean", "have_crit_events": "boolean", "short": "boolean",
+    "sleep": "boolean", "ongoing": "boolean", "wait_sum": "float64", "wait_min": "float64", "wait_max": "float64",
+    "avg_wait_time": "float64", "first_event_time": "datetime64[ns]", "last_event_time": "datetime64[ns]",
+    "completion_time": "timedelta64[ns]",
+}
+
+
+def typed_case_table(frame: pd.DataFrame) -> pd.DataFrame:
+    """Cast the columns of a case table to `CASE_DTYPES`."""
+    return frame.astype({column: dtype for column, dtype in CASE_DTYPES.items() if column in frame.columns})
+
+
+class CaseExporter:
+    """
+    Writes the case output CSV in column batches read straight from the case attributes.
+
+    Only the selected columns are read, `batch_size` cases at a time, so no per-case dictionary
+    or full DataFrame of the cases is built. The summary counts are taken in the same pass.
+    Without a path, or with `keep_frame`, the batches are also kept and joined into a typed table (`frame`).
+    """
+
+    def __init__(self, path, columns=None, variants=None, batch_size=50_000, keep_frame=False):
+        """
+        :param path: CSV file to write; None keeps the cases in memory.
+        :param columns: Columns to export (default: `DEFAULT_COLUMNS`). `evaluation.py` needs
+                        `case_id` and `final_status`; the plots of `visualize.py` need the defaults.
+        :param variants: `VariantTrie` of the run, needed for the `trace` column.
+        :param batch_size: Number of cases converted and written at once.
+        :param keep_frame: Keep the table in memory even when it is written.
+        """
+        self.path = path
+        self.columns = list(columns or DEFAULT_COLUMNS)
+        self.variants = variants
+        self.batch_size = batch_size
+        self.keep_frame = keep_frame or path is None
+        if "trace" in self.columns and variants is None:
+            raise ValueError("The trace column needs the VariantTrie of the run.")
+
+        # Every plain column of a case is read with a single attrgetter call
+        self.attributes = [column for column in self.columns if column not in COMPUTED_COLUMNS]
+        for column in ("final_status", "cancelled"):
+            if column not in self.attributes:
+                self.attributes.append(column)
+        self.get_attributes = attrgetter(*self.attributes)
+        self.summary = None
+        self.frame = None
+
+    def batch_frame(self, case_ids, batch):
+        rows = map(self.get_attributes, batch)
+        values = dict(zip(self.attributes, zip(*rows) if batch else [()] * len(self.attributes)))
+        if "trace" in self.columns:
+            values["trace"] = [self.variants.trace(case.trace_node) for case in batch]
+        if "completion_time" in self.columns:
+            values["completion_time"] = [case.last_event_time - case.first_event_time for case in batch]
+        return pd.DataFrame({column: values[column] for column in self.columns}, index=case_ids), values
+
+    def export(self, cases):
+        """
+        Write the cases and count them by status.
+
+        :param cases: Iterable of (case_id, Case) pairs, e.g. `ProcessManager.cases.items()`.
+        :return: DataFrame with the `case_id` and `final_status` of every case, as used by `evaluate`.
+        """
+        if self.path is not None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        status_counts = Counter()
+        cancelled = 0
+        case_id_column, status_column = [], []
+        frames = []
+
+        def write(case_ids, batch, first):
+            nonlocal cancelled
+            frame, values = self.batch_frame(case_ids, batch)
+            if self.keep_frame:
+                frames.append(frame)
+            if self.path is not None:
+                frame.to_csv(self.path, mode="w" if first else "a", header=first, index=True)
+            status_counts.update(values["final_status"])
+            cancelled += sum(map(bool, values["cancelled"]))
+            case_id_column.extend(case_ids)
+            status_column.extend(values["final_status"])
+
+        case_ids, batch = [], []
+        first = True
+        for case_id, case in cases:
+            case_ids.append(case_id)
+            batch.append(case)
+            if len(batch) >= self.batch_size:
+                write(case_ids, batch, first)
+                case_ids, batch, first = [], [], False
+        if batch or first:
+            write(case_ids, batch, first)
+        if self.keep_frame:
+            self.frame = typed_case_table(pd.concat(frames))
+
+        self.summary = {
+            "processed": len(case_id_column),
+            "cancelled": cancelled,
+            "complete": status_counts["COMPLETE"],
+            "ongoing": status_counts["ONGOING"],
+            "incomplete": status_counts["INCOMPLETE"],
+        }
+        return pd.DataFrame({"case_id": case_id_column, "final_status": status_column})
@@ -0,0 +1,203 @@
+import os
+import csv
+import sqlite3
+import pandas as pd
+from delta_log_formation import list_delta_logs
+
+INDEX_NAME = "case_index.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    delta_name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modified INTEGER NOT NULL,
+    header TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    case_id TEXT NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files (file_id),
+    row INTEGER NOT NULL,
+    byte_offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS status_changes (
+    case_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    previous TEXT,
+    new TEXT,
+    delta_name TEXT
+);
+CREATE TABLE IF NOT EXISTS run (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_case ON events (case_id);
+CREATE INDEX IF NOT EXISTS idx_status_changes_case ON status_changes (case_id, seq);
+"""
+
+
+def file_version(path):
+    """Size and modification time of a file, which change whenever the splitter writes it."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class CaseIndex:
+    """
+    Inverted index from case ids to their rows in the delta logs and their status changes.
+
+    The event part is built from the split logs: for every row, the case id, delta log, row number
+    and byte offset. Looking up a case then seeks straight to its rows instead of scanning the log.
+    The status changes are written by `ProcessManager` at the end of a run and describe that run.
+    The index is stored as `case_index.sqlite` in the delta log directory.
+    """
+
+    def __init__(self, delta_log_dir, path=None):
+        self.delta_log_dir = delta_log_dir
+        self.path = path or os.path.join(delta_log_dir, INDEX_NAME)
+        self.connection = sqlite3.connect(self.path)
+        # Indexes written before files kept their modification time are rebuilt
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(files)")]
+        if columns and "modified" not in columns:
+            self.connection.executescript("DROP TABLE events; DROP TABLE files;")
+        self.connection.executescript(SCHEMA)
+        self.pending_changes = []
+
+    def close(self):
+        self.connection.close()
+
+    def log_files(self):
+        """(path, delta name) of the initial log and the delta logs, in processing order."""
+        initial_log_path, delta_logs = list_delta_logs(self.delta_log_dir)
+        return [(initial_log_path, "initial_log")] + delta_logs
+
+    # ===================== Building ===================== #
+    def build(self):
+        """Index every row of the initial log and the delta logs of the directory."""
+        with self.connection:
+            self.connection.execute("DELETE FROM events")
+            self.connection.execute("DELETE FROM files")
+            for file_id, (path, delta_name) in enumerate(self.log_files()):
+                self.index_file(file_id, path, delta_name)
+        print(f"Case index saved to: {self.path}")
+
+    def refresh(self):
+        """
+        Bring the index up to date with the delta logs, reindexing only the files that were rewritten.
+
+        After an incremental split the changed files are the ones the appended events went to. The
+        file ids are the processing order, so if a new file falls before an indexed one the whole
+        index is built again.
+        """
+        log_files = self.log_files()
+        current = [os.path.relpath(path, self.delta_log_dir) for path, _ in log_files]
+        positions = {path: file_id for file_id, path in enumerate(current)}
+        stored = {path: (file_id, (size, modified)) for file_id, path, size, modified in
+                  self.connection.execute("SELECT file_id, path, size, modified FROM files")}
+        if not stored or any(positions.get(path) != file_id for path, (file_id, _) in stored.items()):
+            self.build()
+            return
+
+        changed = [file_id for file_id, (path, _) in enumerate(log_files)
+                   if current[file_id] not in stored or stored[current[file_id]][1] != file_version(path)]
+        if not changed:
+            return
+        with self.connection:
+            for file_id in changed:
+                self.connection.execute("DELETE FROM events WHERE file_id = ?", (file_id,))
+                self.connection.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+                self.index_file(file_id, *log_files[file_id])
+        print(f"Case index updated for {len(changed)} delta logs: {self.path}")
+
+    def index_file(self, file_id, path, delta_name):
+        with open(path, "rb") as file:
+            header = file.readline()
+            columns = next(csv.reader([header.decode()]))
+            case_column = columns.index("case")
+            offset = len(header)
+            rows = []
+            for row, line in enumerate(file):
+                text = line.decode()
+                # Unquoted leading case ids are cut out directly; other lines go through the CSV parser
+                if case_column == 0 and not text.startswith('"'):
+                    case_id = text.split(",", 1)[0]
+                else:
+                    case_id = next(csv.reader([text]))[case_column]
+                rows.append((case_id, file_id, row, offset))
+                offset += len(line)
+        self.connection.execute(
+            "INSERT INTO files (file_id, delta_name, path, size, modified, header) VALUES (?, ?, ?, ?, ?, ?)",
+            (file_id, delta_name, os.path.relpath(path, self.delta_log_dir), *file_version(path), header.decode()))
+        self.connection.executemany("INSERT INTO events (case_id, file_id, row, byte_offset) VALUES (?, ?, ?, ?)",
+                                    rows)
+
+    def add_status_changes(self, case_id, case):
+        """Queue the status transitions of a case; written by `save_status_changes`."""
+        for seq, transition in enumerate(case.status_transitions):
+            self.pending_changes.append((str(case_id), seq, transition["previous"], transition["new"],
+                                         transition["delta_name"]))
+
+    def save_status_changes(self, run_description: dict):
+        """Replace the status changes of the previous run with the queued ones."""
+        with self.connection:
+            self.connection.execute("DELETE FROM status_changes")
+            self.connection.execute("DELETE FROM run")
+            self.connection.executemany(
+                "INSERT INTO status_changes (case_id, seq, previous, new, delta_name) VALUES (?, ?, ?, ?, ?)",
+                self.pending_changes)
+            self.connection.executemany("INSERT INTO run (key, value) VALUES (?, ?)",
+                                        [(key, str(value)) for key, value in run_description.items()])
+        self.pending_changes = []
+
+    # ===================== Lookups ===================== #
+    def deltas(self, case_id):
+        """Delta logs containing events of the case, with the number of its events in each."""
+        return self.connection.execute(
+            "SELECT files.delta_name, COUNT(*) FROM events JOIN files USING (file_id) "
+            "WHERE case_id = ? GROUP BY file_id ORDER BY file_id", (str(case_id),)).fetchall()
+
+    def columns(self):
+        """Columns of the indexed delta logs, from the header of the initial log."""
+        header = self.connection.execute("SELECT header FROM files ORDER BY file_id LIMIT 1").fetchone()
+        return next(csv.reader([header[0]])) if header else []
+
+    def events(self, case_id) -> pd.DataFrame:
+        """Raw event rows of the case, read from the delta logs by byte offset, with their delta log and row."""
+        return self.events_of([case_id])
+
+    def events_of(self, case_ids, batch_size=500) -> pd.DataFrame:
+        """Raw event rows of several cases, in delta log order, each file opened once and read by byte offset."""
+        case_ids = [str(case_id) for case_id in case_ids]
+        locations = []
+        for start in range(0, len(case_ids), batch_size):
+            batch = case_ids[start:start + batch_size]
+            locations += self.connection.execute(
+                "SELECT file_id, files.delta_name, files.path, files.header, row, byte_offset "
+                "FROM events JOIN files USING (file_id) "
+                f"WHERE case_id IN ({', '.join('?' * len(batch))})", batch).fetchall()
+        locations.sort(key=lambda location: (location[0], location[4]))
+
+        records = []
+        open_files = {}
+        try:
+            for _, delta_name, path, header, row, byte_offset in locations:
+                if path not in open_files:
+                    open_files[path] = (open(os.path.join(self.delta_log_dir, path), "rb"), next(csv.reader([header])))
+                file, columns = open_files[path]
+                file.seek(byte_offset)
+                values = next(csv.reader([file.readline().decode()]))
+                records.append(dict(zip(columns, values), delta_name=delta_name, row=row))
+        finally:
+            for file, _ in open_files.values():
+                file.close()
+        return pd.DataFrame(records)
+
+    def status_history(self, case_id):
+        """Status changes of the case in the last run, with the delta where each happened."""
+        rows = self.connection.execute(
+            "SELECT previous, new, delta_name FROM status_changes WHERE case_id = ? ORDER BY seq", (str(case_id),))
+        return [{"previous": previous, "new": new, "delta_name": delta_name} for previous, new, delta_name in rows]
+
+    def run_description(self):
+        return dict(self.connection.execute("SELECT key, value FROM run"))
@@ -0,0 +1,144 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+
+
+class CaseTable:
+    """
+    Mapping of case id to `Case` with an optional memory budget.
+
+    Without a budget it behaves like the plain dictionary `ProcessManager.cases` used to be.
+    With a budget, finalised cases (complete, cancelled or incomplete) are spilled in batches
+    to a local SQLite file once more than `memory_budget` cases are resident, and are
+    transparently reloaded when a new event arrives for them.
+    """
+
+    def __init__(self, variants, memory_budget=None, store_path=None, batch_size=1000):
+        """
+        :param variants: The shared `VariantTrie`, re-attached to cases loaded from disk.
+        :param memory_budget: Maximum number of resident cases, or None to keep every case in memory.
+        :param store_path: SQLite file for spilled cases; a temporary file is used when omitted.
+        :param batch_size: Minimum number of cases written per spill.
+        """
+        self.variants = variants
+        self.memory_budget = memory_budget
+        self.batch_size = batch_size
+        self.hot = {}
+        self.n_spilled = 0
+        self.store_path = store_path
+        self.connection = None
+        self.temporary = False
+
+    # ===================== Store ===================== #
+    def open_store(self):
+        if self.connection is None:
+            if self.store_path is None:
+                handle, self.store_path = tempfile.mkstemp(suffix=".sqlite", prefix="cases_")
+                os.close(handle)
+                self.temporary = True
+            self.connection = sqlite3.connect(self.store_path)
+            self.connection.execute("DROP TABLE IF EXISTS cases")
+            self.connection.execute("CREATE TABLE cases (case_id TEXT PRIMARY KEY, data BLOB)")
+        return self.connection
+
+    def load(self, case_id):
+        """Move a spilled case back into memory; returns None if it was never spilled."""
+        if not self.n_spilled:
+            return None
+        row = self.connection.execute("SELECT data FROM cases WHERE case_id = ?", (case_id,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute("DELETE FROM cases WHERE case_id = ?", (case_id,))
+        self.n_spilled -= 1
+        case = self.unpickle(row[0])
+        self.hot[case_id] = case
+        return case
+
+    def unpickle(self, data):
+        case = pickle.loads(data)
+        case.variants = self.variants
+        return case
+
+    def spill(self):
+        """
+        Write finalised cases to disk while more cases than the budget are resident.
+
+        :return: Number of cases spilled.
+        """
+        if self.memory_budget is None or len(self.hot) <= self.memory_budget:
+            return 0
+
+        n_target = max(len(self.hot) - self.memory_budget, self.batch_size)
+        evicted = []
+        for case_id, case in self.hot.items():
+            if case.complete or case.cancelled or case.incomplete:
+                evicted.append(case_id)
+                if len(evicted) >= n_target:
+                    break
+
+        connection = self.open_store()
+        connection.executemany(
+            "INSERT OR REPLACE INTO cases (case_id, data) VALUES (?, ?)",
+            ((case_id, pickle.dumps(self.hot.pop(case_id), protocol=pickle.HIGHEST_PROTOCOL)) for case_id in evicted)
+        )
+        connection.commit()
+        self.n_spilled += len(evicted)
+        return len(evicted)
+
+    def close(self):
+        """Close the store and delete it if it was a temporary file."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            if self.temporary:
+                os.remove(self.store_path)
+
+    # ===================== Mapping Interface ===================== #
+    def get(self, case_id, default=None):
+        case = self.hot.get(case_id)
+        if case is None:
+            case = self.load(case_id)
+        return default if case is None else case
+
+    def get_resident(self, case_id):
+        """Return the case only if it is in memory, without touching the store."""
+        return self.hot.get(case_id)
+
+    def __getitem__(self, case_id):
+        case = self.get(case_id)
+        if case is None:
+            raise KeyError(case_id)
+        return case
+
+    def __setitem__(self, case_id, case):
+        self.hot[case_id] = case
+
+    def __contains__(self, case_id):
+        if case_id in self.hot:
+            return True
+        return bool(self.n_spilled) and self.connection.execute(
+            "SELECT 1 FROM cases WHERE case_id = ?", (case_id,)).fetchone() is not None
+
+    def __len__(self):
+        return len(self.hot) + self.n_spilled
+
+    def items(self):
+        """Iterate over resident cases first, then stream the spilled ones from disk."""
+        yield from self.hot.items()
+        if self.n_spilled:
+            for case_id, data in self.connection.execute("SELECT case_id, data FROM cases"):
+                yield case_id, self.unpickle(data)
+
+    def keys(self):
+        yield from self.hot.keys()
+        if self.n_spilled:
+            for (case_id,) in self.connection.execute("SELECT case_id FROM cases"):
+                yield case_id
+
+    def values(self):
+        for _, case in self.items():
+            yield case
+
+    def __iter__(self):
+        return self.keys()
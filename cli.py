@@ -0,0 +1,332 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+from config import RunConfig, focus_deltas, startup_target_seconds, report_dir, __RANDOM_SEED__
+
+# Heavy modules (pandas, plotting libraries) are imported inside the commands that need them,
+# so that e.g. `run` never loads matplotlib or plotly before its first event is processed.
+
+STARTUP_MARKER = "[STARTUP] First event processed at"
+
+
+def build_config(args) -> RunConfig:
+    """Create the run configuration from the command line, falling back on config.py."""
+    overrides = {
+        "event_log_path": args.event_log,
+        "initial_months": args.initial_months,
+        "frequency": args.frequency,
+        "max_delta_events": args.max_delta_events,
+        "max_days": args.max_days,
+        "output_dir": args.output_dir,
+        "case_memory_budget": args.memory_budget,
+        "case_db_path": args.database,
+        "late_event_watermark": args.watermark,
+        "approximate_delta_stats": args.approximate,
+    }
+    config = RunConfig(**{field: value for field, value in overrides.items() if value is not None})
+    if getattr(args, "no_plot", False):
+        config.confusion_matrix_path = None
+    return config
+
+
+def config_arguments(config: RunConfig) -> list:
+    """Command line arguments reproducing a configuration in a child process."""
+    arguments = ["--event-log", config.event_log_path, "--frequency", config.frequency,
+                 "--initial-months", str(config.initial_months), "--max-days", str(config.max_days),
+                 "--output-dir", config.output_dir]
+    if config.max_delta_events is not None:
+        arguments += ["--max-delta-events", str(config.max_delta_events)]
+    if config.case_memory_budget is not None:
+        arguments += ["--memory-budget", str(config.case_memory_budget)]
+    if config.case_db_path is not None:
+        arguments += ["--database", config.case_db_path]
+    if config.late_event_watermark is not None:
+        arguments += ["--watermark", str(config.late_event_watermark)]
+    arguments += ["--approximate" if config.approximate_delta_stats else "--no-approximate"]
+    return arguments
+
+
+# ===================== Commands ===================== #
+def split(args):
+    from delta_log_formation import EventLogSplitter
+
+    config = build_config(args)
+    EventLogSplitter.from_config(config).update(full=args.full)
+
+
+def run(args):
+    from process import ProcessManager
+
+    process_manager = ProcessManager(config=build_config(args))
+    if args.report_startup:
+        process_manager.on_first_event = lambda timestamp: print(f"{STARTUP_MARKER} {timestamp:.6f}", flush=True)
+    process_manager.run()
+
+
+def evaluate(args):
+    from evaluation import evaluate_saved_outputs
+
+    config = build_config(args)
+    evaluate_saved_outputs(config.delta_output_path, config.cases_output_path, config.confusion_matrix_path,
+                           n_resamples=args.bootstrap)
+
+
+def compare(args):
+    from evaluation import load_evaluation, compare_evaluations
+
+    start_time = time.time()
+    comparison = compare_evaluations(load_evaluation(args.baseline), load_evaluation(args.candidate),
+                                     args.resamples, args.confidence, args.resampling,
+                                     __RANDOM_SEED__ if args.seed is None else args.seed)
+    print(f"Candidate - baseline with {args.confidence:.0%} bootstrap confidence intervals "
+          f"({args.resamples} resamples of {args.resampling}, {time.time() - start_time:.2f} seconds):")
+    print(comparison.to_string(float_format=lambda value: f"{value:.4f}"))
+
+
+def visualize(args):
+    from visualize import VisualizationManager
+
+    config = build_config(args)
+    VisualizationManager(config.delta_output_path, config.cases_output_path, focus_deltas if args.focus is None else args.focus).plot_all()
+
+
+def report(args):
+    from report import render_reports, sweep_configs
+
+    config = build_config(args)
+    configs = sweep_configs(config, [config.initial_months] if args.months is None else args.months,
+                           [config.frequency] if args.frequencies is None else args.frequencies)
+    render_reports(configs, args.report_dir, args.formats, args.workers, focus_deltas if args.focus is None else args.focus, args.force)
+
+
+def sample(args):
+    from sampler import StratifiedSampler, sample_case_output, export_sample
+
+    config = build_config(args)
+    sampler = StratifiedSampler(config.sample_size if args.size is None else args.size,
+                                config.random_seed if args.seed is None else args.seed)
+    output_dir = args.sample_dir or config.sample_output_dir or os.path.join(config.output_dir, "samples")
+    export_sample(sample_case_output(config.cases_output_path, sampler), config.event_log_path, output_dir,
+                  os.path.basename(os.path.normpath(config.delta_log_dir)), delta_log_dir=config.delta_log_dir)
+
+
+def multi(args):
+    from scheduler import MultiLogScheduler
+
+    MultiLogScheduler(args.event_logs, build_config(args), args.output_root, args.workers).run()
+
+
+def query(args):
+    from case_db import CaseDatabase
+
+    config = build_config(args)
+    if config.case_db_path is None or not os.path.exists(config.case_db_path):
+        sys.exit("No case database found; run with --database (or set case_db_path in config.py) first.")
+
+    database = CaseDatabase(config.case_db_path)
+    if args.case is not None:
+        print(database.case(args.case))
+        for transition in database.status_history(args.case):
+            print(f"{transition['delta_name']}: {transition['previous']} -> {transition['new']}")
+        for membership in database.delta_history(args.case):
+            print(f"{membership['delta_file_name']}: {membership['membership']}")
+    else:
+        cases = database.cases_with_status(args.status, args.last_state, args.limit)
+        for case in cases:
+            print(f"{case['case_id']}: last state {case['last_state']}, last event {case['last_event']}, "
+                  f"issues: {case['issues']}")
+        print(f"{len(cases)} {args.status} cases" + (f" with last state {args.last_state}" if args.last_state else ""))
+    database.close()
+
+
+def history(args):
+    from case_index import CaseIndex
+
+    config = build_config(args)
+    if not os.path.isdir(config.delta_log_dir):
+        sys.exit(f"No delta logs in {config.delta_log_dir}; run `split` or `run` first.")
+
+    # Built on first use; delta logs split again since then are indexed first
+    case_index = CaseIndex(config.delta_log_dir)
+    case_index.refresh()
+    events = case_index.events(args.case_id)
+    if events.empty:
+        sys.exit(f"Case {args.case_id} has no events in {config.delta_log_dir}.")
+    print(events.to_string(index=False))
+
+    run_description = case_index.run_description()
+    if run_description:
+        print(f"\nStatus changes ({', '.join(f'{key}={value}' for key, value in run_description.items())}):")
+        changes = case_index.status_history(args.case_id)
+    elif config.case_db_path is not None and os.path.exists(config.case_db_path):
+        from case_db import CaseDatabase
+
+        print(f"\nStatus changes (case database {config.case_db_path}):")
+        database = CaseDatabase(config.case_db_path)
+        changes = database.status_history(args.case_id)
+        database.close()
+    else:
+        changes = []
+        print("\nNo status changes stored; run with case_index = True or --database to keep them.")
+    for change in changes:
+        print(f"{change['delta_name']}: {change['previous']} -> {change['new']}")
+    case_index.close()
+
+
+def bench(args):
+    if args.target == "startup":
+        bench_startup(args)
+    elif args.target == "load":
+        from loadtest import LoadTester
+
+        LoadTester(build_config(args), speedup=args.speedup, synthetic_cases=args.synthetic_cases, seed=args.seed,
+                   max_backlog=args.max_backlog).run()
+    else:
+        from test_processing_time import measure_processing_times
+
+        measure_processing_times({"initial_months": args.months, "freq": args.frequencies}, base_config=build_config(args))
+
+
+def bench_startup(args):
+    """
+    Measure the cold-start time from launching `cli.py run` to its first processed event.
+
+    The child process is stopped as soon as it reports the first event.
+    """
+    config = build_config(args)
+    command = [sys.executable, os.path.abspath(__file__), "run", "--report-startup", "--no-plot"] + config_arguments(config)
+
+    timings = []
+    for _ in range(args.repeat):
+        start_time = time.time()
+        child = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        first_event_time = None
+        for line in child.stdout:
+            if line.startswith(STARTUP_MARKER):
+                first_event_time = float(line.rsplit(" ", 1)[1])
+                break
+        child.terminate()
+        child.wait()
+        if first_event_time is None:
+            sys.exit("The run finished without reporting a processed event.")
+        timings.append(first_event_time - start_time)
+
+    best = min(timings)
+    print(f"Cold start to first processed event: best {best:.2f} seconds, "
+          f"mean {sum(timings) / len(timings):.2f} seconds over {len(timings)} runs "
+          f"(target {args.target_seconds:.2f} seconds)")
+    if best > args.target_seconds:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trace completeness evaluation framework.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--event-log", help="Path of the event log CSV.")
+    common.add_argument("--frequency", help="Delta frequency: daily, weekly, monthly, a time width such as 6h "
+                                            "or 3D, or events (batches of --max-delta-events events).")
+    common.add_argument("--max-delta-events", type=int, help="Maximum number of events per delta.")
+    common.add_argument("--initial-months", type=int, help="Months in the initial log.")
+    common.add_argument("--max-days", type=int, help="Days without updates before a trace is incomplete.")
+    common.add_argument("--output-dir", help="Root directory of the delta logs and outputs.")
+    common.add_argument("--memory-budget", type=int, help="Maximum number of cases kept in memory.")
+    common.add_argument("--database", help="SQLite file the cases and deltas are stored in.")
+    common.add_argument("--watermark", type=int, help="Apply late events up to this many deltas old.")
+    common.add_argument("--approximate", action=argparse.BooleanOptionalAction,
+                        help="Estimate the counts of every delta with mergeable sketches instead of exact case sets.")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    split_parser = commands.add_parser("split", parents=[common],
+                                       help="Split the event log into delta logs, or only its appended rows.")
+    split_parser.add_argument("--full", action="store_true", help="Split the whole event log again.")
+    split_parser.set_defaults(func=split)
+
+    run_parser = commands.add_parser("run", parents=[common], help="Split if needed, process and evaluate.")
+    run_parser.add_argument("--no-plot", action="store_true", help="Skip the confusion matrix plot.")
+    run_parser.add_argument("--report-startup", action="store_true", help="Print when the first event is processed.")
+    run_parser.set_defaults(func=run)
+
+    evaluate_parser = commands.add_parser("evaluate", parents=[common], help="Evaluate the outputs of a previous run.")
+    evaluate_parser.add_argument("--no-plot", action="store_true", help="Skip the confusion matrix plot.")
+    evaluate_parser.add_argument("--bootstrap", type=int, default=0,
+                                 help="Bootstrap resamples for confidence intervals of the metrics.")
+    evaluate_parser.set_defaults(func=evaluate)
+
+    compare_parser = commands.add_parser("compare", help="Compare the metrics of two evaluation outputs.")
+    compare_parser.add_argument("baseline", help="Evaluation CSV of the baseline run.")
+    compare_parser.add_argument("candidate", help="Evaluation CSV of the run compared with it.")
+    compare_parser.add_argument("--resamples", type=int, default=2000, help="Bootstrap resamples.")
+    compare_parser.add_argument("--confidence", type=float, default=0.95, help="Coverage of the intervals.")
+    compare_parser.add_argument("--resampling", choices=["deltas", "cases", "both"], default="both",
+                                help="Resample the deltas, the cases of every delta, or both.")
+    compare_parser.add_argument("--seed", type=int, help=f"Random seed (default: {__RANDOM_SEED__}).")
+    compare_parser.set_defaults(func=compare)
+
+    visualize_parser = commands.add_parser("visualize", parents=[common], help="Show the interactive plots.")
+    visualize_parser.add_argument("--focus", nargs="*", help="Delta names to restrict the plots to.")
+    visualize_parser.set_defaults(func=visualize)
+
+    report_parser = commands.add_parser("report", parents=[common],
+                                        help="Render every plot of one or more runs to files, in parallel.")
+    report_parser.add_argument("--months", type=int, nargs="+", help="Initial months of the runs to render.")
+    report_parser.add_argument("--frequencies", nargs="+", help="Frequencies of the runs to render.")
+    report_parser.add_argument("--formats", nargs="+", choices=["html", "png"], default=["html"])
+    report_parser.add_argument("--workers", type=int, help="Worker processes (default: number of cores).")
+    report_parser.add_argument("--report-dir", default=report_dir, help="Each run is rendered to a subdirectory.")
+    report_parser.add_argument("--focus", nargs="*", help="Delta names to restrict the delta plots to.")
+    report_parser.add_argument("--force", action="store_true", help="Render even the figures that are unchanged.")
+    report_parser.set_defaults(func=report)
+
+    sample_parser = commands.add_parser("sample", parents=[common],
+                                        help="Draw a stratified sample of cases and their events for manual review.")
+    sample_parser.add_argument("--size", type=int, help="Number of sampled cases (default: sample_size).")
+    sample_parser.add_argument("--seed", type=int, help=f"Random seed (default: {__RANDOM_SEED__}).")
+    sample_parser.add_argument("--sample-dir", help="Directory of the sampled cases and events.")
+    sample_parser.set_defaults(func=sample)
+
+    multi_parser = commands.add_parser("multi", parents=[common], help="Process several event logs concurrently.")
+    multi_parser.add_argument("event_logs", nargs="+", help="Event log CSV files.")
+    multi_parser.add_argument("--workers", type=int, help="Worker processes (default: number of cores).")
+    multi_parser.add_argument("--output-root", default="Dataset/Multi Log Outputs",
+                              help="Each log writes its outputs to a subdirectory of this directory.")
+    multi_parser.add_argument("--no-plot", action="store_true", help="Skip the confusion matrix plots.")
+    multi_parser.set_defaults(func=multi)
+
+    query_parser = commands.add_parser("query", parents=[common], help="Query the case database of a run.")
+    query_parser.add_argument("--case", help="Show the final state and status history of one case.")
+    query_parser.add_argument("--status", default="INCOMPLETE", help="Final status of the listed cases.")
+    query_parser.add_argument("--last-state", help="Only list cases with this last state.")
+    query_parser.add_argument("--limit", type=int, help="Maximum number of cases listed.")
+    query_parser.set_defaults(func=query)
+
+    history_parser = commands.add_parser("history", parents=[common],
+                                         help="Show the raw events and status changes of one case.")
+    history_parser.add_argument("case_id")
+    history_parser.set_defaults(func=history)
+
+    bench_parser = commands.add_parser("bench", parents=[common],
+                                       help="Benchmark cold start, processing time or accelerated replay latency.")
+    bench_parser.add_argument("target", choices=["startup", "runtime", "load"])
+    bench_parser.add_argument("--repeat", type=int, default=3, help="Cold-start measurements to take.")
+    bench_parser.add_argument("--target-seconds", type=float, default=startup_target_seconds,
+                              help="Cold-start time the startup benchmark must meet (default: %(default)s).")
+    bench_parser.add_argument("--months", type=int, nargs="+", default=[1, 6, 12],
+                              help="Initial months of the runtime benchmark (default: %(default)s).")
+    bench_parser.add_argument("--frequencies", nargs="+", default=["daily", "weekly", "monthly"],
+                              help="Frequencies of the runtime benchmark (default: %(default)s).")
+    bench_parser.add_argument("--speedup", type=float, default=100_000,
+                              help="Simulated seconds per second of the load test replay.")
+    bench_parser.add_argument("--synthetic-cases", type=int, help="Replay a synthetic log with this many cases.")
+    bench_parser.add_argument("--seed", type=int, help=f"Random seed of the synthetic log (default: {__RANDOM_SEED__}).")
+    bench_parser.add_argument("--max-backlog", type=int, default=1,
+                              help="Waiting deltas a sustainable arrival rate may build up.")
+    bench_parser.set_defaults(func=bench)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,79 @@
 import os
+from dataclasses import dataclass, field
 
 event_log_path = 'Dataset/csv/Hospital Billing - Event Log.csv'
 initial_months = 1
-frequency = 'weekly'  # 'daily', 'weekly', or 'monthly'
+# Delta windows: 'daily', 'weekly' or 'monthly' calendar periods, a fixed time width such as '6h' or '3D'
+# (counted from midnight of the initial cutoff), or 'events' for batches of `max_delta_events` events
+frequency = 'weekly'
+# Maximum number of events per delta; larger windows are cut into consecutive parts (None: no cap)
+max_delta_events = None
 
+
+def run_name_for(frequency, initial_months, max_delta_events=None):
+    """Name of a run's delta log directory and outputs, e.g. 'weekly_(1)' or 'weekly_max5000_(1)'."""
+    if max_delta_events is None:
+        return f"{frequency}_({initial_months})"
+    return f"{frequency}_max{max_delta_events}_({initial_months})"
+
+
+run_name = run_name_for(frequency, initial_months, max_delta_events)
 filename = os.path.splitext(os.path.basename(event_log_path))[0]
-delta_log_dir = f'Dataset/Hospital Billing Delta Logs/{filename}_{frequency}_({initial_months})'
+delta_log_dir = f'Dataset/Hospital Billing Delta Logs/{filename}_{run_name}'
 
 delta_dir_path = "Dataset/Hospital Billing Delta Logs/"
-cases_output_path = f"Dataset/Hospital Billing Delta Logs/cases_output/cases_output_{frequency}_({initial_months}).csv"
-delta_output_path = f"Dataset/Hospital Billing Delta Logs/Delta Stats/delta_stats_{frequency}_({initial_months}).csv"
-evaluation_output_path = f"Dataset/Hospital Billing Delta Logs/evaluation/eval_{frequency}_({initial_months}).csv"
+cases_output_path = f"Dataset/Hospital Billing Delta Logs/cases_output/cases_output_{run_name}.csv"
+delta_output_path = f"Dataset/Hospital Billing Delta Logs/Delta Stats/delta_stats_{run_name}.jsonl"
+evaluation_output_path = f"Dataset/Hospital Billing Delta Logs/evaluation/eval_{run_name}.csv"
 
+# Days without updates before a trace is flagged incomplete.
+# `python log_profile.py` suggests a value from the wait periods of the event log.
 max_days = 190
 
+# Maximum number of cases kept in memory while processing; finalised cases beyond it are spilled to disk.
+# None keeps every case in memory. case_store_path = None uses a temporary SQLite file.
+case_memory_budget = None
+case_store_path = None
+
+# SQLite database the run writes its cases, deltas, memberships and transitions into (None disables it)
+case_db_path = None
+
+# Store each case's status changes of a run in the case index (case_index.py). Off by default: `cli.py history`
+# builds the row offsets of the index on demand, and the case database (case_db_path) also keeps the status changes
+case_index = False
+
+# Late events: events that arrive in a later delta log than the period they belong to.
+# None processes every event in the delta log it arrives in. A number of deltas enables the late-event
+# mode: late events up to that many deltas old are applied to their cases and the affected delta
+# reports are revised; older ones are dropped and counted.
+late_event_watermark = None
+
+# Approximate delta statistics for very large deltas: mergeable sketches replace the exact event counter and
+# case id sets of every delta. Case counts are HyperLogLog estimates, event counts count-min estimates and the
+# most frequent events a SpaceSaving summary, each with its error bound in the report. The sketches are stored
+# in each report and merge over any range of deltas or runs (delta_stats.py). Without case ids the run is not
+# evaluated. Not combinable with late events.
+approximate_delta_stats = False
+
+# Result files a run writes; the in-memory API (api.py) leaves out the ones it is not asked for.
+# Without "delta_stats" and "cases_output" the delta reports and cases are kept in memory instead.
+saved_outputs = ["delta_stats", "cases_output", "evaluation"]
+
+# Columns written to the case output (None writes all of them, see case_export.DEFAULT_COLUMNS).
+# evaluation.py needs case_id and final_status; visualize.py needs the default columns.
+case_output_columns = None
+
+# Stratified sample of cases for manual review (sampler.py, `cli.py sample`).
+# When sample_output_dir is set, every run also draws the sample while saving its cases.
 sample_size = 100
 __RANDOM_SEED__ = 31
+sample_output_dir = None
+
+# Event names accepted by the validation stage of the splitter (validation.py); None accepts any name.
+# Rows with other names are quarantined with the UNKNOWN_EVENT reason.
+known_events = ["NEW", "FIN", "RELEASE", "CODE OK", "BILLED", "CHANGE DIAGN", "DELETE", "REOPEN", "CODE NOK",
+                "STORNO", "REJECT", "SET STATUS", "MANUAL", "JOIN-PAT", "CODE ERROR", "CHANGE END", "ZDBC_BEHAN",
+                "EMPTY"]
 
 # Run the evaluation without running the model
 # Change it to True only if the case_output and delta_stat datasets exist
@@ -29,4 +87,56 @@ attributes_for_miss_check = ["case", "event", "startTime", "completeTime",
                              "isCancelled", "blocked", "isClosed", "state",
                              ]
 
+# Path of the confusion matrix plot rendered after a run (None skips plotting)
+confusion_matrix_path = "VIS/confusion_matrix.png"
+
+# Directory of the headless reports rendered by `cli.py report` (one subdirectory per run)
+report_dir = "VIS/reports"
+
+# Target for the time from process start to the first processed event (cli.py bench startup)
+startup_target_seconds = 3.0
+
+
+@dataclass
+class RunConfig:
+    """
+    Parameters of one processing run. Defaults are the module-level settings above;
+    output paths left as None are derived from the event log, frequency and initial months.
+    """
+    event_log_path: str = event_log_path
+    initial_months: int = initial_months
+    frequency: str = frequency
+    max_delta_events: int = max_delta_events
+    max_days: int = max_days
+    output_dir: str = delta_dir_path
+    delta_log_dir: str = None
+    cases_output_path: str = None
+    delta_output_path: str = None
+    evaluation_output_path: str = None
+    confusion_matrix_path: str = confusion_matrix_path
+    case_memory_budget: int = case_memory_budget
+    case_store_path: str = case_store_path
+    case_db_path: str = case_db_path
+    case_output_columns: list = field(default_factory=lambda: case_output_columns)
+    sample_size: int = sample_size
+    random_seed: int = __RANDOM_SEED__
+    sample_output_dir: str = sample_output_dir
+    late_event_watermark: int = late_event_watermark
+    approximate_delta_stats: bool = approximate_delta_stats
+    case_index: bool = case_index
+    known_events: list = field(default_factory=lambda: known_events)
+    saved_outputs: list = field(default_factory=lambda: list(saved_outputs))
+
+    def __post_init__(self):
+        run_name = run_name_for(self.frequency, self.initial_months, self.max_delta_events)
+        log_name = os.path.splitext(os.path.basename(self.event_log_path))[0]
+        if self.delta_log_dir is None:
+            self.delta_log_dir = os.path.join(self.output_dir, f"{log_name}_{run_name}")
+        if self.cases_output_path is None:
+            self.cases_output_path = os.path.join(self.output_dir, "cases_output", f"cases_output_{run_name}.csv")
+        if self.delta_output_path is None:
+            self.delta_output_path = os.path.join(self.output_dir, "Delta Stats", f"delta_stats_{run_name}.jsonl")
+        if self.evaluation_output_path is None:
+            self.evaluation_output_path = os.path.join(self.output_dir, "evaluation", f"eval_{run_name}.csv")
+
 
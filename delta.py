@@ -1,19 +1,41 @@
 from collections import Counter
+from sketches import QuantileSketch, DeltaSketches
+
+
+def delta_label(delta_name):
+    """Name of a delta in reports and case attributes: its log file name without `_delta_log.csv`."""
+    return delta_name.removesuffix("_delta_log.csv")
+
 
 class Delta:
 
-    def __init__(self, delta_file_name):
+    def __init__(self, delta_file_name, position=None, sketches=None):
+        """
+        :param sketches: `DeltaSketches` for the approximate mode; they replace the event counter and
+                         the case id sets, which are then left None.
+        """
         # Initialize attributes to track statistics for the delta file
-        self.delta_file_name = delta_file_name[:8]
-        self.event_counter = Counter()
-        self.not_finished = set()
-        self.complete_cases = set()
-        self.incomplete_cases = set()
-        self.cancelled = set()
-        self.total_event = sum(dict(self.event_counter).values())
-        self.initialised_cases = set()
-        self.ongoing_cases_count = set()
-
+        self.delta_file_name = delta_label(delta_file_name)
+        # Processing position of the delta (0 is the initial log); cases count the deltas between their updates by it
+        self.position = position
+        self.sketches = sketches
+        exact = sketches is None
+        self.event_counter = Counter() if exact else None
+        self.not_finished = set() if exact else None
+        self.complete_cases = set() if exact else None
+        self.incomplete_cases = set() if exact else None
+        self.cancelled = set() if exact else None
+        self.initialised_cases = set() if exact else None
+        self.ongoing_cases_count = set() if exact else None
+        # Approximate mode: case ids of each case set, hashed into the sketches in one batch per report
+        self.pending_cases = None if exact else {name: [] for name in DeltaSketches.CASE_COUNTS.values()}
+        self.variant_counter = Counter()
+        self.wait_time_sketch = QuantileSketch()
+        self.wait_time_by_event = {}
+        self.completion_time_sketch = QuantileSketch()
+        # Late-event mode: extremes of every case's times per sketch, so the extremes of a revised
+        # delta stay exact when the contribution of a replayed case is taken back (see `track_extremes`)
+        self.case_extremes = None
 
 
     def process_event(self, event):
@@ -22,10 +44,70 @@ class Delta:
 
         :param event: A dictionary containing event data.
         """
-        # Track the occurrence of the event
-        event_name = event.get("event")
-        self.event_counter[event_name] += 1
+        # Track the occurrence of the event; the approximate mode counts all events of the delta at once
+        if self.sketches is None:
+            event_name = event.get("event")
+            self.event_counter[event_name] += 1
+
+    def process_events(self, case_ids, event_names):
+        """
+        Add all events of the delta to its sketches (approximate mode).
+
+        :param case_ids: Case id of every event.
+        :param event_names: Name of every event.
+        """
+        self.sketches.add_events(case_ids, event_names)
+
+    def add_initialised(self, case_id):
+        """Record a case created by an event of this delta."""
+        if self.sketches is None:
+            self.initialised_cases.add(case_id)
+
+    def add_updated(self, case_id):
+        """Record an update of a case, unless this delta created it."""
+        if self.sketches is None and case_id not in self.initialised_cases:
+            self.ongoing_cases_count.add(case_id)
+
+    def add_incomplete(self, case_ids):
+        """Record the cases the sleep check of this delta flagged incomplete."""
+        if self.sketches is None:
+            self.case_info["incomplete"] = case_ids
+            self.incomplete_cases = case_ids
+        else:
+            self.pending_cases["incomplete"].extend(case_ids)
+
+
+    def process_wait_time(self, event_name, seconds, case_id=None):
+        """
+        Record the time that passed before an event of an existing case.
+
+        :param event_name: Name of the event that ended the wait.
+        :param seconds: Time since the previous event of the case, in seconds.
+        :param case_id: Case of the event, for the extremes kept by `track_extremes`.
+        """
+        self.wait_time_sketch.add(seconds)
+        if event_name not in self.wait_time_by_event:
+            self.wait_time_by_event[event_name] = QuantileSketch()
+        self.wait_time_by_event[event_name].add(seconds)
+        if self.case_extremes is not None:
+            self.record_extreme("wait_time", case_id, seconds)
+            self.record_extreme(("wait_time_by_event", event_name), case_id, seconds)
+
+    def track_extremes(self):
+        """Keep the extremes of every case's times, so contributions can be taken back exactly."""
+        self.case_extremes = {}
+        return self
+
+    def record_extreme(self, key, case_id, seconds):
+        low, high = self.case_extremes.setdefault(key, {}).get(case_id, (seconds, seconds))
+        self.case_extremes[key][case_id] = (min(low, seconds), max(high, seconds))
 
+    def keyed_sketches(self):
+        """The sketches of the delta by their key in `case_extremes`."""
+        yield "wait_time", self.wait_time_sketch
+        yield "completion_time", self.completion_time_sketch
+        for event_name, sketch in self.wait_time_by_event.items():
+            yield ("wait_time_by_event", event_name), sketch
 
     def process_case_status(self, case):
         """
@@ -38,6 +120,27 @@ class Delta:
         COMPLETE = (case.final_status == "COMPLETE") and not (CANCELLED)
         ONGOING = (case.final_status == "ONGOING")
 
+        self.variant_counter[case.trace_node] += 1
+
+        if COMPLETE:
+            # The completion time is recorded once, in the delta where the case became complete
+            last_transition = case.status_transitions[-1] if case.status_transitions else None
+            if (last_transition is not None and last_transition["new"] == "COMPLETE"
+                    and last_transition["delta_name"] == self.delta_file_name):
+                completion_time = (case.last_event_time - case.first_event_time).total_seconds()
+                self.completion_time_sketch.add(completion_time)
+                if self.case_extremes is not None:
+                    self.record_extreme("completion_time", case.case_id, completion_time)
+
+        if self.sketches is not None:
+            pending = self.pending_cases
+            new = delta_label(case.first_delta) == self.delta_file_name
+            pending["initialised" if new else "updated"].append(case.case_id)
+            for name, member in (("cancelled", CANCELLED), ("complete", COMPLETE), ("ongoing", ONGOING)):
+                if member:
+                    pending[name].append(case.case_id)
+            return
+
         case_info = self.case_info
         if CANCELLED:
             case_info["cancelled"].add(case.case_id)
@@ -55,12 +158,94 @@ class Delta:
         #     case_info["incomplete"].add(case.case_id)
         #     self.incomplete_cases = len(case_info["incomplete"])
 
-    def generate_report(self):
+    def case_sets(self):
+        return (self.not_finished, self.complete_cases, self.incomplete_cases, self.cancelled,
+                self.initialised_cases, self.ongoing_cases_count)
+
+    def add_contribution(self, other, sign=1):
+        """
+        Add (sign=1) or remove (sign=-1) the statistics of another delta of the same period.
+
+        Used to revise this delta with the contribution of replayed cases: the old contribution of
+        the cases is removed and the replayed one added. Bucket counts are subtracted exactly; the
+        extremes of the sketches are recomputed from the extremes of the remaining cases, which
+        both deltas must track (`track_extremes`).
+        """
+        for own, theirs in zip(self.case_sets(), other.case_sets()):
+            if sign > 0:
+                own.update(theirs)
+            else:
+                own.difference_update(theirs)
+        for own, theirs in ((self.event_counter, other.event_counter), (self.variant_counter, other.variant_counter)):
+            if sign > 0:
+                own.update(theirs)
+            else:
+                own.subtract(theirs)
+                for key in [key for key, count in own.items() if count <= 0]:
+                    del own[key]
+
+        sketches = [(self.wait_time_sketch, other.wait_time_sketch),
+                    (self.completion_time_sketch, other.completion_time_sketch)]
+        for event_name, sketch in other.wait_time_by_event.items():
+            sketches.append((self.wait_time_by_event.setdefault(event_name, QuantileSketch()), sketch))
+        for own, theirs in sketches:
+            if sign > 0:
+                own.merge(theirs)
+            else:
+                own.subtract(theirs)
+        self.wait_time_by_event = {event_name: sketch for event_name, sketch in self.wait_time_by_event.items()
+                                   if sketch.count}
+
+        if self.case_extremes is None or other.case_extremes is None:
+            return
+        for key, extremes in other.case_extremes.items():
+            own = self.case_extremes.setdefault(key, {})
+            for case_id, (low, high) in extremes.items():
+                if sign > 0:
+                    own_low, own_high = own.get(case_id, (low, high))
+                    own[case_id] = (min(own_low, low), max(own_high, high))
+                else:
+                    own.pop(case_id, None)
+        for key, sketch in self.keyed_sketches():
+            extremes = self.case_extremes.get(key, {}).values()
+            sketch.min = min((low for low, _ in extremes), default=None)
+            sketch.max = max((high for _, high in extremes), default=None)
+
+    def generate_report(self, variants=None):
         """
         Generate a summary report of the delta statistics.
 
+        In the approximate mode the counts are sketch estimates with their error bounds (see
+        `DeltaSketches.summary`), the case id sets are left out and the serialised sketches are
+        added as `delta_sketches`, so that `delta_stats.rollup_delta_sketches` can merge them.
+
+        :param variants: Optional `VariantTrie` used to render the most frequent variants.
         :return: A dictionary containing the summary statistics.
         """
+        if self.sketches is not None:
+            self.sketches.add_case_sets(self.pending_cases)
+            self.pending_cases = {name: [] for name in self.pending_cases}
+            report = {"delta_file_name": self.delta_file_name, **self.sketches.summary(),
+                      "distinct_variants": len(self.variant_counter)}
+        else:
+            report = self.exact_report()
+        # Wait and completion time distributions (seconds)
+        for name, sketch in (("wait_time", self.wait_time_sketch), ("completion_time", self.completion_time_sketch)):
+            for statistic, value in sketch.summary().items():
+                report[f"{name}_{statistic}"] = value
+            report[f"{name}_sketch"] = sketch.to_dict()
+        report["wait_time_by_event"] = {event_name: sketch.summary()
+                                        for event_name, sketch in self.wait_time_by_event.items()}
+        report["wait_time_by_event_sketch"] = {event_name: sketch.to_dict()
+                                               for event_name, sketch in self.wait_time_by_event.items()}
+        if variants is not None:
+            report["top_variants"] = variants.format_variants(self.variant_counter)
+        if self.sketches is not None:
+            report["delta_sketches"] = self.sketches.to_dict()
+        return report
+
+    def exact_report(self):
+        """Counts and case id sets of the delta, from its event counter and case sets."""
         return {
             "delta_file_name": self.delta_file_name,
             "event_counts": dict(self.event_counter),
@@ -78,6 +263,6 @@ class Delta:
             "incomplete_cases": self.incomplete_cases,
             "cancelled_cases": self.cancelled,
             "ongoing_cases": self.not_finished,
-
-         }
+            "distinct_variants": len(self.variant_counter),
+        }
 
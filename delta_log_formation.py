@@ -1,33 +1,190 @@
+import io
 import os
+import json
+import hashlib
+import numpy as np
 import pandas as pd
-from config import delta_dir_path
+from config import delta_dir_path, known_events, run_name_for
+from validation import EventValidator, parse_complete_times, UNASSIGNED
+
+# Manifest of the source event log the split logs were written from
+MANIFEST_NAME = "split_manifest.json"
+# Bytes hashed at the start of the source and just before the end of the part already split
+HASH_BYTES = 1 << 16
+
+# Calendar period frequencies
+CALENDAR_PERIODS = ("daily", "weekly", "monthly")
+# Deltas of `max_delta_events` events each, whatever time they span
+EVENT_BATCHES = "events"
+
+
+def window_width(frequency):
+    """
+    Time width of the fixed-width delta windows of a frequency such as '6h' or '3D'.
+
+    :return: A `pd.Timedelta`, or None for calendar periods and event batches.
+    """
+    if frequency in CALENDAR_PERIODS or frequency == EVENT_BATCHES:
+        return None
+    try:
+        width = pd.to_timedelta(frequency)
+    except ValueError:
+        width = None
+    if width is None or width <= pd.Timedelta(0):
+        raise ValueError("Frequency must be 'daily', 'weekly', 'monthly', 'events' or a time width such as "
+                         f"'6h' or '3D', not {frequency!r}.")
+    return width
+
+
+def list_delta_logs(delta_log_dir):
+    """
+    Locate the initial log and the delta logs written by `EventLogSplitter`.
+
+    :param delta_log_dir: Directory containing the split logs.
+    :return: (initial_log_path, [(delta_log_path, delta_file_name), ...]) with deltas in chronological order.
+    """
+    initial_log_path = None
+    delta_logs = []
+    for file_name in sorted(os.listdir(delta_log_dir)):
+        file_path = os.path.join(delta_log_dir, file_name)
+        if "initial_log" in file_name:
+            initial_log_path = file_path
+        elif "delta_log" in file_name:
+            delta_logs.append((file_path, file_name))
+    return initial_log_path, delta_logs
+
+
+def source_fingerprint(path, size):
+    """Hashes of the first bytes of a file and of the bytes just before `size`."""
+    with open(path, "rb") as file:
+        head = file.read(min(size, HASH_BYTES))
+        file.seek(max(size - HASH_BYTES, 0))
+        tail = file.read(size - max(size - HASH_BYTES, 0))
+    return {"head_hash": hashlib.blake2b(head).hexdigest(), "tail_hash": hashlib.blake2b(tail).hexdigest(),
+            "ends_with_newline": tail.endswith(b"\n")}
+
+
+def merge_rows(path, rows: pd.DataFrame):
+    """
+    Merge new rows into a split log, keeping it sorted by `completeTime`.
+
+    The rows already in the file keep their text; ties in time keep the existing rows first, as a
+    full split of the grown event log would.
+    """
+    existing = pd.read_csv(path, dtype=str, keep_default_na=False)
+    added = pd.read_csv(io.StringIO(rows.to_csv(index=False)), dtype=str, keep_default_na=False)
+    merged = pd.concat([existing, added[existing.columns]], ignore_index=True)
+    order = np.argsort(pd.to_datetime(merged["completeTime"]).values, kind="stable")
+    temporary_path = f"{path}.tmp"
+    merged.iloc[order].to_csv(temporary_path, index=False)
+    os.replace(temporary_path, path)
 
 
 class EventLogSplitter:
-    def __init__(self, csv_file_path, frequency='weekly', initial_months=3):
+    def __init__(self, csv_file_path, frequency='weekly', initial_months=3, output_dir=None,
+                 known_events=known_events, max_delta_events=None):
         """
         Initializes the EventLogSplitter with file path, frequency, and initial months.
 
         :param csv_file_path: Path to the CSV file containing the event log data.
-        :param frequency: Splitting frequency ('daily', 'weekly', 'monthly').
+        :param frequency: Splitting frequency ('daily', 'weekly', 'monthly'), a time width such as '6h' or
+                          '3D', or 'events' for batches of `max_delta_events` events.
         :param initial_months: Number of months to include in the initial log.
+        :param output_dir: Directory for the split logs; derived from the file name when omitted.
+        :param known_events: Valid event names for the validation stage; None accepts any name.
+        :param max_delta_events: Maximum number of events per delta log; None leaves the windows whole.
         """
+        self.width = window_width(frequency)
+        if frequency == EVENT_BATCHES and max_delta_events is None:
+            raise ValueError("The 'events' frequency needs max_delta_events, the number of events per delta.")
         self.csv_file_path = csv_file_path
         self.frequency = frequency
         self.initial_months = initial_months
+        self.max_delta_events = max_delta_events
         self.filename = os.path.splitext(os.path.basename(csv_file_path))[0]
-        self.output_dir = f"{delta_dir_path}{self.filename}_{frequency}_({initial_months})"
+        self.output_dir = (output_dir or
+                           f"{delta_dir_path}{self.filename}_{run_name_for(frequency, initial_months, max_delta_events)}")
+        self.manifest_path = os.path.join(self.output_dir, MANIFEST_NAME)
+        self.known_events = known_events
         self.dataframe = None
+        self.validator = None
+        self.raw_times = None
+        self.initial_cutoff = None
+        # Delta log name of every valid row of the last validation
+        self.row_names = None
 
-    def load_and_sort_event_log(self):
-        """Loads and sorts the event log by 'completeTime'."""
-        self.dataframe = pd.read_csv(self.csv_file_path, keep_default_na=False, na_values=['NaN', "", " "])
-        self.dataframe["case"] = self.dataframe["case"].astype(str)
+    @classmethod
+    def from_config(cls, config):
+        """Create a splitter for the event log, frequency and output directory of a `RunConfig`."""
+        return cls(config.event_log_path, config.frequency, config.initial_months, config.delta_log_dir,
+                   config.known_events, config.max_delta_events)
+
+    def prepare_events(self, dataframe):
+        """Parse the case ids and completion times of raw event rows; bad times become NaT for the validation."""
+        dataframe["case"] = dataframe["case"].astype(str).where(dataframe["case"].notna())
+        dataframe['completeTime'], self.raw_times = parse_complete_times(dataframe)
+        return dataframe
+
+    def window_starts(self, times):
+        """Start of the fixed-width window of each time; windows are counted from midnight of the initial cutoff."""
+        anchor = self.initial_cutoff.normalize()
+        return anchor + (times - anchor).dt.floor(self.width)
 
+    def window_format(self):
+        """Format of the window starts in the delta log names; seconds only for widths that need them."""
+        return "%Y-%m-%d_%H%M" if self.width % pd.Timedelta(minutes=1) == pd.Timedelta(0) else "%Y-%m-%d_%H%M%S"
 
+    def delta_names(self, times, initial_cutoff):
+        """
+        Name of the split log each event goes to, as listed by `list_delta_logs`.
+
+        The names sort in processing order. Event batches and the parts of windows cut by
+        `max_delta_events` are counted along `times`, which must be sorted.
+        """
+        in_deltas = times >= initial_cutoff
+        if self.frequency == 'weekly':
+            iso = times.dt.isocalendar()
+            periods = iso["year"].astype(str) + "_w" + iso["week"].astype(str).str.zfill(2)
+        elif self.frequency == 'daily':
+            periods = times.dt.strftime("%Y-%m-%d")
+        elif self.frequency == 'monthly':
+            periods = times.dt.to_period('M').astype(str)
+        elif self.frequency == EVENT_BATCHES:
+            # Each batch is named after the time of its first event, then numbered in case of equal times
+            batches = (in_deltas.cumsum() - 1) // self.max_delta_events
+            starts = times.groupby(batches).transform("first")
+            periods = starts.dt.strftime("%Y-%m-%d_%H%M%S") + "_" + batches.astype(str).str.zfill(6)
+        else:
+            periods = self.window_starts(times).dt.strftime(self.window_format())
 
-        self.dataframe['completeTime'] = pd.to_datetime(self.dataframe['completeTime']).dt.tz_localize(None)
-        self.dataframe = self.dataframe.sort_values(by='completeTime')
+        if self.max_delta_events is not None and self.frequency != EVENT_BATCHES and in_deltas.any():
+            # Windows with more events than the cap are cut into numbered parts of consecutive events
+            windows = periods[in_deltas]
+            parts = windows.groupby(windows).cumcount() // self.max_delta_events
+            last_parts = parts.groupby(windows).transform("max")
+            digits = max(3, len(str(int(last_parts.max()) + 1)))
+            cut = last_parts > 0
+            periods = periods.copy()
+            periods[cut[cut].index] = windows[cut] + "_" + (parts[cut] + 1).astype(str).str.zfill(digits)
+
+        names = (periods + "_delta_log.csv").astype(object)
+        names[times < initial_cutoff] = "initial_log"
+        names[times.isna()] = UNASSIGNED
+        return names
+
+    def validate(self, events, initial_cutoff):
+        """Valid event rows; the rejected ones go to the quarantine file with the split log they belong to."""
+        names = self.delta_names(events['completeTime'], initial_cutoff)
+        valid = self.validator.validate(events, self.raw_times.loc[events.index], names)
+        self.row_names = names.loc[valid.index]
+        return valid
+
+    def load_and_sort_event_log(self):
+        """Loads and sorts the event log by 'completeTime'."""
+        self.dataframe = pd.read_csv(self.csv_file_path, keep_default_na=False, na_values=['NaN', "", " "])
+        self.prepare_events(self.dataframe)
+        # Stable, so events with the same time stay in log order and an incremental split gives the same files
+        self.dataframe = self.dataframe.sort_values(by='completeTime', kind='stable')
         print("Event log loaded and sorted by 'completeTime'.")
 
     def split_initial_and_delta_logs(self):
@@ -37,6 +194,8 @@ class EventLogSplitter:
 
         # Define initial and delta logs
         initial_cutoff = self.dataframe['completeTime'].min() + pd.DateOffset(months=self.initial_months)
+        self.initial_cutoff = initial_cutoff
+        self.dataframe = self.validate(self.dataframe, initial_cutoff)
         initial_log = self.dataframe[self.dataframe['completeTime'] < initial_cutoff]
         delta_logs = self.dataframe[self.dataframe['completeTime'] >= initial_cutoff]
 
@@ -48,33 +207,264 @@ class EventLogSplitter:
 
         return delta_logs
 
-    def save_delta_logs(self, delta_logs):
-        """Splits and saves delta logs based on the specified frequency."""
+    def assign_periods(self, delta_logs):
+        """Add the `delta_period` column for the splitting frequency (the window start for time widths)."""
         if self.frequency == 'daily':
             delta_logs['delta_period'] = delta_logs['completeTime'].dt.date
         elif self.frequency == 'weekly':
             delta_logs['delta_period'] = delta_logs['completeTime'].dt.to_period('W')
         elif self.frequency == 'monthly':
             delta_logs['delta_period'] = delta_logs['completeTime'].dt.to_period('M')
+        elif self.width is not None:
+            delta_logs['delta_period'] = self.window_starts(delta_logs['completeTime'])
         else:
-            raise ValueError("Frequency must be 'daily', 'weekly', or 'monthly'.")
-
-        for period, group in delta_logs.groupby('delta_period'):
-            if self.frequency == 'weekly':
-                # Correctly determine year and week based on the ISO week date system
-                first_date = group['completeTime'].iloc[0]
-                year, week, _ = first_date.isocalendar()
-                period_str = f"{year}_w{week:02}"
-            else:
-                # Use default period string for daily or monthly
-                period_str = str(period).replace('/', '_')
+            raise ValueError("Event batches have no periods; their rows are named by `delta_names`.")
+        return delta_logs
+
+    def period_name(self, period, group):
+        if self.frequency == 'weekly':
+            # Correctly determine year and week based on the ISO week date system
+            first_date = group['completeTime'].iloc[0]
+            year, week, _ = first_date.isocalendar()
+            return f"{year}_w{week:02}"
+        if self.width is not None:
+            return period.strftime(self.window_format())
+        # Use default period string for daily or monthly
+        return str(period).replace('/', '_')
+
+    def iter_delta_logs(self, delta_logs):
+        """(file name, events) of every delta log, in chronological order, named as in the last validation."""
+        names = self.row_names.loc[delta_logs.index]
+        if self.frequency == EVENT_BATCHES:
+            delta_logs['delta_period'] = names.str.removesuffix("_delta_log.csv")
+        else:
+            delta_logs = self.assign_periods(delta_logs)
+        for file_name, group in delta_logs.groupby(names):
+            yield file_name, group
 
-            delta_log_path = os.path.join(self.output_dir, f"{period_str}_delta_log.csv")
+    def save_delta_logs(self, delta_logs):
+        """Splits and saves delta logs based on the specified frequency."""
+        for file_name, group in self.iter_delta_logs(delta_logs):
+            period_str = file_name.removesuffix("_delta_log.csv")
+            delta_log_path = os.path.join(self.output_dir, file_name)
             group.to_csv(delta_log_path, index=False)
             print(f"Delta log for {period_str} saved to: {delta_log_path}")
 
     def run_splitting(self):
         """Executes the full splitting process."""
+        size = os.path.getsize(self.csv_file_path)
+        self.validator = EventValidator(self.output_dir, self.known_events)
         self.load_and_sort_event_log()
         delta_logs = self.split_initial_and_delta_logs()
         self.save_delta_logs(delta_logs)
+        self.validator.save_report()
+        times = self.dataframe['completeTime']
+        self.save_manifest(size, times.min(), times.max())
+
+    # ===================== In-memory splitting ===================== #
+    def iter_split_logs(self, dataframe, quarantine_dir=None):
+        """
+        Split an in-memory event log exactly like `run_splitting`, without writing the split logs.
+
+        :param dataframe: Raw event rows, as read from the event log CSV.
+        :param quarantine_dir: Directory of the quarantine file and validation report; None keeps
+                               them in `self.validator`.
+        :return: Generator of (delta name, events) in processing order, named as by `list_delta_logs`.
+        """
+        self.validator = EventValidator(quarantine_dir, self.known_events)
+        self.dataframe = self.prepare_events(dataframe.copy()).sort_values(by='completeTime', kind='stable')
+        initial_cutoff = self.dataframe['completeTime'].min() + pd.DateOffset(months=self.initial_months)
+        self.initial_cutoff = initial_cutoff
+        self.dataframe = self.validate(self.dataframe, initial_cutoff)
+        delta_logs = self.dataframe[self.dataframe['completeTime'] >= initial_cutoff].copy()
+        yield "initial_log", self.dataframe[self.dataframe['completeTime'] < initial_cutoff]
+        yield from self.iter_delta_logs(delta_logs)
+
+    def iter_split_batches(self, batches, quarantine_dir=None):
+        """
+        Split a stream of event batches into the initial log and delta logs as they fill up.
+
+        The initial cutoff is set by the first batch. A delta is yielded as soon as an event of a
+        later period arrives, so only the newest period is buffered; chronological batches give the
+        same deltas as `iter_split_logs` on the whole log. Events of a period that was already
+        yielded are processed with the next delta. Deltas cut by event count need the whole log, so
+        `max_delta_events` is not supported here.
+
+        :param batches: Iterable of DataFrames of raw event rows.
+        :param quarantine_dir: As for `iter_split_logs`.
+        :return: Generator of (delta name, events) in processing order.
+        """
+        if self.max_delta_events is not None:
+            raise ValueError("Deltas cut by event count need the whole log; split a DataFrame with iter_split_logs.")
+        self.validator = EventValidator(quarantine_dir, self.known_events)
+        pending = None
+        initial_cutoff = latest = last_period = None
+        initial_done = False
+
+        def flush(final):
+            nonlocal pending, initial_done, last_period
+            pending = pending.sort_values(by='completeTime', kind='stable')
+            if not initial_done:
+                if not final and latest < initial_cutoff:
+                    return
+                initial = pending['completeTime'] < initial_cutoff
+                initial_done = True
+                yield "initial_log", pending[initial]
+                pending = pending[~initial]
+
+            periods = self.assign_periods(pending[['completeTime']].copy())['delta_period']
+            open_period = self.assign_periods(pd.DataFrame({'completeTime': [latest]}))['delta_period'].iloc[0]
+            late = pending['completeTime'] < initial_cutoff
+            if last_period is not None:
+                late |= periods <= last_period
+            due = ~late & ((periods < open_period) | final)
+            if not due.any():
+                return
+            late_events = pending[late]
+            for period, group in pending[due].assign(delta_period=periods[due]).groupby('delta_period'):
+                file_name = f"{self.period_name(period, group)}_delta_log.csv"
+                if len(late_events):
+                    group = pd.concat([late_events.assign(delta_period=period), group])
+                    late_events = late_events.iloc[:0]
+                last_period = period
+                yield file_name, group
+            pending = pending[~(due | late)]
+
+        for batch in batches:
+            events = self.prepare_events(batch.copy())
+            if initial_cutoff is None and events['completeTime'].notna().any():
+                initial_cutoff = events['completeTime'].min() + pd.DateOffset(months=self.initial_months)
+                self.initial_cutoff = initial_cutoff
+            events = self.validate(events, initial_cutoff if initial_cutoff is not None else pd.NaT)
+            if initial_cutoff is None or events.empty:
+                continue
+            pending = events if pending is None else pd.concat([pending, events])
+            latest = events['completeTime'].max() if latest is None else max(latest, events['completeTime'].max())
+            yield from flush(final=False)
+        if pending is not None:
+            yield from flush(final=True)
+
+    # ===================== Incremental splitting ===================== #
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path) as file:
+            return json.load(file)
+
+    def save_manifest(self, size, first_time, last_time, complete=True):
+        """Record the part of the source that the split logs hold."""
+        manifest = {"source": os.path.abspath(self.csv_file_path), "size": size,
+                    **source_fingerprint(self.csv_file_path, size),
+                    "first_complete_time": str(first_time), "last_complete_time": str(last_time),
+                    "frequency": self.frequency, "initial_months": self.initial_months,
+                    "max_delta_events": self.max_delta_events,
+                    "complete": complete}
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(f"{self.manifest_path}.tmp", "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def is_extension_of(self, manifest, size):
+        """Whether the source still starts with the bytes the split logs were written from."""
+        return (manifest.get("complete") and manifest["frequency"] == self.frequency
+                and manifest["initial_months"] == self.initial_months
+                and manifest.get("max_delta_events") == self.max_delta_events and size >= manifest["size"]
+                and manifest["ends_with_newline"]
+                and source_fingerprint(self.csv_file_path, manifest["size"]) ==
+                {key: manifest[key] for key in ("head_hash", "tail_hash", "ends_with_newline")})
+
+    def remove_split_logs(self):
+        for file_name in os.listdir(self.output_dir):
+            if file_name.endswith(".csv") and ("initial_log" in file_name or "delta_log" in file_name):
+                os.remove(os.path.join(self.output_dir, file_name))
+
+    def read_appended_events(self, offset, size):
+        """
+        Parse the complete rows appended to the source between `offset` and `size`.
+
+        :return: (events, end) where `end` is the offset after the last complete row; a row that is
+                 still being written is left for the next update.
+        """
+        with open(self.csv_file_path, "rb") as file:
+            header = file.readline()
+            file.seek(offset)
+            appended = file.read(size - offset)
+        appended = appended[:appended.rfind(b"\n") + 1]
+        events = pd.read_csv(io.BytesIO(header + appended), keep_default_na=False, na_values=['NaN', "", " "])
+        return self.prepare_events(events), offset + len(appended)
+
+    def update(self, full=False):
+        """
+        Bring the split logs up to date with the source event log.
+
+        The manifest records the size of the source when it was split, hashes of its first bytes
+        and of the bytes before that size, and its first and last `completeTime`. If the source
+        only grew, just the appended rows are read: they are merged into the initial log and the
+        period files they fall in (new periods get new files) and no other file is touched. If the
+        source changed in any other way, has an event before the first split event (which moves the
+        initial cutoff) or there is no manifest, everything is split again. Deltas cut by
+        `max_delta_events` are counted from the start of the log, so a grown source is split again
+        too. Only the hashed bytes are compared, so an edit in the middle of the already split part
+        goes unnoticed; use `full=True` after such edits.
+
+        :param full: Always split the whole event log again.
+        :return: Names of the files written.
+        """
+        size = os.path.getsize(self.csv_file_path)
+        manifest = None if full else self.load_manifest()
+        if manifest is not None and size == manifest["size"] and self.is_extension_of(manifest, size):
+            print(f"Delta logs in {self.output_dir} are up to date with the event log.")
+            return []
+
+        events = None
+        if manifest is not None and self.is_extension_of(manifest, size) and self.max_delta_events is None:
+            events, size = self.read_appended_events(manifest["size"], size)
+            first_time = pd.Timestamp(manifest["first_complete_time"])
+            if len(events) and events['completeTime'].min() < first_time:
+                print("Appended events precede the initial log.")
+                events = None
+
+        if events is None:
+            print(f"Splitting the whole event log into {self.frequency} delta logs...")
+            if os.path.isdir(self.output_dir):
+                self.remove_split_logs()
+            self.run_splitting()
+            initial_log_path, delta_logs = list_delta_logs(self.output_dir)
+            return [os.path.basename(initial_log_path)] + [file_name for _, file_name in delta_logs]
+
+        # A run that stops halfway leaves an incomplete manifest, so the next update splits everything
+        self.save_manifest(manifest["size"], manifest["first_complete_time"], manifest["last_complete_time"],
+                           complete=False)
+        events = events.sort_values(by='completeTime', kind='stable')
+        last_time = pd.Timestamp(manifest["last_complete_time"])
+        initial_cutoff = first_time + pd.DateOffset(months=self.initial_months)
+        self.initial_cutoff = initial_cutoff
+        written = []
+
+        # Duplicates are only detected among the appended rows
+        self.validator = EventValidator(self.output_dir, self.known_events, append=True)
+        events = self.validate(events, initial_cutoff)
+        initial_events = events[events['completeTime'] < initial_cutoff]
+        if len(initial_events):
+            merge_rows(os.path.join(self.output_dir, "initial_log.csv"), initial_events)
+            written.append("initial_log.csv")
+
+        for file_name, group in self.iter_delta_logs(events[events['completeTime'] >= initial_cutoff].copy()):
+            delta_log_path = os.path.join(self.output_dir, file_name)
+            if not os.path.exists(delta_log_path):
+                group.to_csv(delta_log_path, index=False)
+            elif group['completeTime'].min() >= last_time:
+                # Only later events: the file stays sorted when they are appended
+                group.to_csv(delta_log_path, mode="a", header=False, index=False)
+            else:
+                merge_rows(delta_log_path, group)
+            written.append(file_name)
+
+        late = int((events['completeTime'] < last_time).sum())
+        if len(events):
+            last_time = max(last_time, events['completeTime'].max())
+        self.validator.save_report()
+        self.save_manifest(size, first_time, last_time)
+        print(f"{len(events)} appended events ({late} before the last split event) written to "
+              f"{len(written)} files in {self.output_dir}.")
+        return written
@@ -0,0 +1,142 @@
+import os
+import re
+import ast
+import json
+import pandas as pd
+from sketches import QuantileSketch, DeltaSketches
+
+# Reports start with their delta position, so revisions can be matched without parsing the line
+DELTA_INDEX = re.compile(rb'\{"delta_index": (\d+)')
+
+# Columns of the delta statistics holding Python literals when they are stored as CSV
+LITERAL_COLUMNS = ["event_counts", "initialised_cases", "updated_cases", "complete_cases", "incomplete_cases",
+                   "cancelled_cases", "ongoing_cases"]
+
+
+def to_json(value):
+    """JSON fallback for the values of a delta report (case id sets, NumPy scalars)."""
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class DeltaStatsWriter:
+    """
+    Appends delta reports to a line-delimited JSON file, one line per delta.
+
+    Every report is flushed to disk as soon as it is written, so only the current delta's report is
+    held in memory and a run that stops early keeps the reports of every delta it finished.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.deltas_written = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # A new run replaces the reports of a previous run with the same configuration
+        self.file = open(path, "w")
+
+    def write(self, report: dict):
+        self.file.write(json.dumps(report, default=to_json) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.deltas_written += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_delta_stats(path, columns=None, chunk_size=100):
+    """
+    Stream the delta reports of a run, one dictionary per delta.
+
+    Reads the line-delimited JSON written by `DeltaStatsWriter`, and also the CSV files of earlier
+    versions (`chunk_size` rows at a time), so memory stays bounded by a single delta. When late
+    events revised a delta, only its last revision is returned, in the position of the delta.
+
+    :param path: Delta statistics file (.jsonl or .csv).
+    :param columns: Keys to keep from each report; None keeps all of them.
+    """
+    if path.endswith(".csv"):
+        usecols = None if columns is None else (lambda column: column in columns)
+        converters = {column: ast.literal_eval for column in LITERAL_COLUMNS
+                      if columns is None or column in columns}
+        for chunk in pd.read_csv(path, usecols=usecols, keep_default_na=False, na_values=['NaN', "", " "],
+                                 converters=converters, chunksize=chunk_size):
+            yield from chunk.to_dict("records")
+        return
+
+    # First pass: offset of the last line written for each delta
+    offsets = {}
+    with open(path, "rb") as file:
+        offset = 0
+        for number, line in enumerate(file):
+            if line.strip():
+                match = DELTA_INDEX.match(line)
+                offsets[int(match.group(1)) if match else number] = offset
+            offset += len(line)
+
+        for delta_index in sorted(offsets):
+            file.seek(offsets[delta_index])
+            report = json.loads(file.readline())
+            yield report if columns is None else {column: report.get(column) for column in columns}
+
+
+def load_delta_stats(path, columns):
+    """DataFrame of selected delta statistics, e.g. the per-delta counts used for plotting."""
+    return pd.DataFrame(read_delta_stats(path, columns), columns=columns)
+
+
+def rollup_sketches(path, first=None, last=None):
+    """
+    Merge the wait and completion time sketches of a range of deltas.
+
+    Only the sketches are read and merged, so the cost depends on the number of deltas and the
+    sketch sizes, not on the number of events. The results merge again with the sketches of
+    other runs through `QuantileSketch.merge`.
+
+    :param path: Delta statistics file (.jsonl).
+    :param first: Position of the first delta (0 is the initial log); None starts at the first.
+    :param last: Position of the last delta, included; None ends at the last.
+    :return: Dictionary with the merged `wait_time` and `completion_time` sketches, and a
+             `wait_time_by_event` dictionary with the merged sketch of every event.
+    """
+    merged = {"wait_time": QuantileSketch(), "completion_time": QuantileSketch(), "wait_time_by_event": {}}
+    columns = ["delta_index", "wait_time_sketch", "completion_time_sketch", "wait_time_by_event_sketch"]
+    for report in read_delta_stats(path, columns):
+        position = report["delta_index"]
+        if (first is not None and position < first) or (last is not None and position > last):
+            continue
+        for name in ("wait_time", "completion_time"):
+            if report[f"{name}_sketch"] is not None:
+                merged[name].merge(QuantileSketch.from_dict(report[f"{name}_sketch"]))
+        for event_name, sketch in (report["wait_time_by_event_sketch"] or {}).items():
+            merged["wait_time_by_event"].setdefault(event_name, QuantileSketch()).merge(QuantileSketch.from_dict(sketch))
+    return merged
+
+
+def rollup_delta_sketches(paths, first=None, last=None):
+    """
+    Approximate statistics of a range of deltas from the sketches of their reports (approximate mode).
+
+    Only the sketches are merged, so the cost depends on the number of deltas and the sketch
+    sizes, not on the number of events. Several files, e.g. the runs of the shards of a log, are
+    merged into one result, in which a case seen by several deltas or shards is counted once.
+
+    :param paths: Delta statistics file (.jsonl) written with `approximate_delta_stats`, or a list of them.
+    :param first: Position of the first delta (0 is the initial log); None starts at the first.
+    :param last: Position of the last delta, included; None ends at the last.
+    :return: The merged `DeltaSketches` (see `DeltaSketches.summary`), or None if no delta in the range has sketches.
+    """
+    merged = None
+    for path in [paths] if isinstance(paths, str) else paths:
+        for report in read_delta_stats(path, columns=["delta_index", "delta_sketches"]):
+            position = report["delta_index"]
+            in_range = (first is None or position >= first) and (last is None or position <= last)
+            if not in_range or report["delta_sketches"] is None:
+                continue
+            sketches = DeltaSketches.from_dict(report["delta_sketches"])
+            merged = sketches if merged is None else merged.merge(sketches)
+    return merged
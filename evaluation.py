@@ -1,13 +1,33 @@
+import os
+import numpy as np
 import pandas as pd
-import ast
 
-from matplotlib import pyplot as plt
-import seaborn as sns
-from config import test_eval
+from config import test_eval, delta_output_path, cases_output_path, confusion_matrix_path, __RANDOM_SEED__
+from delta_stats import read_delta_stats
 
-def evaluate(delta_stats: pd.DataFrame, case_stats: pd.DataFrame) -> pd.DataFrame:
+# Delta report keys needed by `evaluate`
+EVALUATION_COLUMNS = ["delta_file_name", "complete_cases", "incomplete_cases", "complete_count", "incomplete_count"]
+
+# Confusion counts and metrics of the evaluation output, in the order of the bootstrap arrays
+CONFUSION_COLUMNS = ["TP", "FP", "TN", "FN"]
+METRICS = ["Accuracy", "Precision", "Recall", "F1-Score"]
+
+# Bootstrap resampling: "deltas" draws deltas with replacement, "cases" redraws the classified cases
+# of every delta within its predicted classes, "both" does both (two-stage bootstrap)
+RESAMPLING = ["deltas", "cases", "both"]
+BOOTSTRAP_RESAMPLES = 2000
+
+def evaluate(delta_stats, case_stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compare the classification of each delta with the final status of its cases.
+
+    :param delta_stats: DataFrame of delta statistics, or an iterable of delta reports
+                        (e.g. `read_delta_stats`), which is consumed one delta at a time.
+    :param case_stats: Case output with the `case_id` and `final_status` columns.
+    """
     case_dict = case_stats[["case_id", "final_status"]].set_index("case_id").to_dict()["final_status"]
-    delta_stats = delta_stats[["delta_file_name", "complete_cases", "incomplete_cases", "complete_count", "incomplete_count"]]
+    if isinstance(delta_stats, pd.DataFrame):
+        delta_stats = delta_stats[EVALUATION_COLUMNS].to_dict("records")
     evaluation_metrics = {
         "Delta": [],
         "TP": [],
@@ -21,8 +41,11 @@ def evaluate(delta_stats: pd.DataFrame, case_stats: pd.DataFrame) -> pd.DataFram
         "Traces Classified": []
     }
 
-    for delta_index, delta_row in delta_stats.iterrows():
+    for delta_row in delta_stats:
         delta_id = delta_row["delta_file_name"]
+        if delta_row["complete_cases"] is None:
+            raise ValueError(f"The statistics of delta {delta_id} hold no case ids (approximate mode) "
+                             "and cannot be evaluated.")
         complete_case_ids = set(delta_row["complete_cases"])
         incomplete_case_ids = set(delta_row["incomplete_cases"])
 
@@ -102,6 +125,9 @@ def avg_cm_per_delta(evaluation_df: pd.DataFrame, save_path: str):
         evaluation_df (pd.DataFrame): DataFrame containing evaluation metrics for deltas.
         save_path (str): Path to save the confusion matrix plot.
     """
+    # Plotting libraries are slow to import, so they are only loaded when a matrix is drawn
+    from matplotlib import pyplot as plt
+    import seaborn as sns
 
     tp = round(evaluation_df["TP"].sum() / len(evaluation_df), 0)
     fp = round(evaluation_df["FP"].sum() / len(evaluation_df), 0)
@@ -128,6 +154,7 @@ def avg_cm_per_delta(evaluation_df: pd.DataFrame, save_path: str):
     plt.xlabel("Predicted Labels")
     plt.ylabel("True Labels")
     plt.tight_layout()
+    os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
     plt.savefig(save_path)
     plt.close()
 
@@ -211,22 +238,187 @@ def avg_cm_per_delta(evaluation_df: pd.DataFrame, save_path: str):
 #           f"Recal: {recall}\n"
 #           f"F1 Score: {f1_score}\n")
 
-if test_eval:
-    deltas = pd.read_csv("Dataset/Hospital Billing Delta Logs/Delta Stats/delta_stats_weekly_(1).csv",
-                         keep_default_na=False,
-                         na_values=['NaN', "", " "],
-                         converters = {"complete_cases": ast.literal_eval,"incomplete_cases": ast.literal_eval,})
-    cases = pd.read_csv("Dataset/Hospital Billing Delta Logs/cases_output/cases_output_weekly_(1).csv")
+# ===================== Bootstrap confidence intervals ===================== #
+def delta_metrics(counts: np.ndarray):
+    """
+    Accuracy, precision, recall and F1-score of every delta, rounded as by `evaluate`.
+
+    :param counts: Confusion counts (TP, FP, TN, FN) in the last axis, e.g. (resamples, deltas, 4).
+    :return: (metrics with the four metrics in the last axis, number of classified cases).
+    """
+    tp, fp, tn, fn = np.moveaxis(np.asarray(counts, dtype=float), -1, 0)
+    total = tp + fp + tn + fn
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accuracy = np.where(total > 0, np.round((tp + tn) / total, 2), 0.0)
+        precision = np.where(tp + fp > 0, np.round(tp / (tp + fp), 2), 0.0)
+        recall = np.where(tp + fn > 0, np.round(tp / (tp + fn), 2), 0.0)
+        f1_score = np.where(precision + recall > 0,
+                            np.round(2 * precision * recall / (precision + recall), 2), 0.0)
+    return np.stack([accuracy, precision, recall, f1_score], axis=-1), total
+
+
+def weighted_metrics(counts: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+    """
+    Weighted metrics of `calculate_weighted_metrics` (unrounded), for any number of resamples at once.
+
+    :param counts: Confusion counts of the deltas, (..., deltas, 4).
+    :param weights: Number of times each delta is drawn, (..., deltas); None counts every delta once.
+    :return: The four weighted metrics, (..., 4).
+    """
+    metrics, total = delta_metrics(counts)
+    if weights is not None:
+        total = total * weights
+    cases = total.sum(axis=-1, keepdims=True)
+    return np.where(cases > 0, (metrics * total[..., None]).sum(axis=-2) / np.where(cases > 0, cases, 1), 0.0)
+
+
+def resample_deltas(rng, n_deltas, size) -> np.ndarray:
+    """How often each delta is drawn in `size` resamples of `n_deltas` deltas with replacement, (size, deltas)."""
+    return rng.multinomial(n_deltas, np.full(n_deltas, 1 / n_deltas), size=size)
+
+
+def resample_cases(rng, counts: np.ndarray, size) -> np.ndarray:
+    """
+    Confusion counts of `size` resamples of the classified cases of every delta, (size, deltas, 4).
+
+    The cases are resampled within each predicted class: a delta keeps its numbers of cases
+    predicted complete and incomplete, and only how many of them are right is redrawn. A resample
+    thus never loses all positive predictions of a delta, which would turn its precision into 0.
+    """
+    tp, fp, tn, fn = counts.T
+    predicted_complete, predicted_incomplete = tp + fp, tn + fn
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tp_share = np.where(predicted_complete > 0, tp / predicted_complete, 0.0)
+        tn_share = np.where(predicted_incomplete > 0, tn / predicted_incomplete, 0.0)
+    tp = rng.binomial(predicted_complete, tp_share, size=(size, len(counts)))
+    tn = rng.binomial(predicted_incomplete, tn_share, size=(size, len(counts)))
+    return np.stack([tp, predicted_complete - tp, tn, predicted_incomplete - tn], axis=-1)
+
+
+def bootstrap_metrics(counts, n_resamples=BOOTSTRAP_RESAMPLES, resampling="both", seed=__RANDOM_SEED__,
+                      batch_size=500, paired_counts=None) -> np.ndarray:
+    """
+    Weighted metrics of bootstrap resamples of an evaluation, drawn in batches of NumPy arrays.
+
+    :param counts: Confusion counts of the deltas, (deltas, 4) in the order of `CONFUSION_COLUMNS`.
+    :param resampling: What is resampled, from `RESAMPLING`.
+    :param batch_size: Resamples drawn at once; bounds the memory to batch_size x deltas x 4 counts.
+    :param paired_counts: Counts of a second evaluation of the same deltas (same order); its resamples
+                          draw the same deltas, and its metrics are returned second.
+    :return: Array (resamples, 4), or a pair of them with `paired_counts`.
+    """
+    if resampling not in RESAMPLING:
+        raise ValueError(f"Unknown resampling {resampling!r}; choose from {RESAMPLING}.")
+    evaluations = [np.asarray(counts, dtype=np.int64)]
+    if paired_counts is not None:
+        evaluations.append(np.asarray(paired_counts, dtype=np.int64))
+    rng = np.random.default_rng(seed)
+    n_deltas = len(evaluations[0])
+    results = [[] for _ in evaluations]
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        weights = resample_deltas(rng, n_deltas, size) if resampling != "cases" else None
+        for evaluation, result in zip(evaluations, results):
+            if resampling == "deltas":
+                sample = np.broadcast_to(evaluation, (size,) + evaluation.shape)
+            else:
+                sample = resample_cases(rng, evaluation, size)
+            result.append(weighted_metrics(sample, weights))
+    results = [np.concatenate(result) for result in results]
+    return results[0] if paired_counts is None else tuple(results)
+
+
+def confusion_counts(evaluation_df: pd.DataFrame) -> np.ndarray:
+    return evaluation_df[CONFUSION_COLUMNS].to_numpy(dtype=np.int64)
+
+
+def load_evaluation(path) -> pd.DataFrame:
+    """Evaluation output written by `ProcessManager.perform_evaluation`."""
+    return pd.read_csv(path, index_col=0)
+
+
+def confidence_intervals(evaluation_df: pd.DataFrame, n_resamples=BOOTSTRAP_RESAMPLES, confidence=0.95,
+                         resampling="both", seed=__RANDOM_SEED__) -> pd.DataFrame:
+    """
+    Bootstrap percentile confidence intervals of the weighted metrics.
+
+    :param evaluation_df: Evaluation of `evaluate` (or `load_evaluation`).
+    :param confidence: Coverage of the intervals.
+    :return: One row per metric with its weighted value, interval bounds and the bootstrap standard error.
+    """
+    counts = confusion_counts(evaluation_df)
+    estimate = weighted_metrics(counts)
+    resamples = bootstrap_metrics(counts, n_resamples, resampling, seed)
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(resamples, [tail, 1 - tail], axis=0)
+    return pd.DataFrame({"Weighted": estimate, "CI Low": low, "CI High": high,
+                         "Std. Error": resamples.std(axis=0, ddof=1)},
+                        index=pd.Index([f"Weighted {metric}" for metric in METRICS], name="Metric"))
+
+
+def compare_evaluations(baseline: pd.DataFrame, candidate: pd.DataFrame, n_resamples=BOOTSTRAP_RESAMPLES,
+                        confidence=0.95, resampling="both", seed=__RANDOM_SEED__) -> pd.DataFrame:
+    """
+    Difference of the weighted metrics of two evaluations (candidate - baseline) with bootstrap intervals.
 
-    evaluation_df = evaluate(deltas, cases)
+    When both evaluations cover the same deltas (e.g. runs that only differ in `max_days`), they are
+    paired by delta name and every resample draws the same deltas for both, which removes the
+    variation between deltas from the difference. Otherwise they are resampled independently.
+    Cases are always redrawn independently, so the intervals of paired runs are conservative.
+
+    :return: One row per metric with both weighted values, the difference and its interval, the share
+             of resamples in which the candidate is better and whether the interval excludes 0.
+    """
+    paired = (set(baseline["Delta"]) == set(candidate["Delta"]) and not baseline["Delta"].duplicated().any()
+              and not candidate["Delta"].duplicated().any())
+    baseline_counts = confusion_counts(baseline)
+    if paired:
+        candidate_counts = confusion_counts(candidate.set_index("Delta").loc[baseline["Delta"]])
+        baseline_resamples, candidate_resamples = bootstrap_metrics(baseline_counts, n_resamples, resampling, seed,
+                                                                    paired_counts=candidate_counts)
+    else:
+        candidate_counts = confusion_counts(candidate)
+        baseline_resamples = bootstrap_metrics(baseline_counts, n_resamples, resampling, seed)
+        candidate_resamples = bootstrap_metrics(candidate_counts, n_resamples, resampling, seed + 1)
+
+    baseline_metrics, candidate_metrics = weighted_metrics(baseline_counts), weighted_metrics(candidate_counts)
+    differences = candidate_resamples - baseline_resamples
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(differences, [tail, 1 - tail], axis=0)
+    return pd.DataFrame({"Baseline": baseline_metrics, "Candidate": candidate_metrics,
+                         "Difference": candidate_metrics - baseline_metrics, "CI Low": low, "CI High": high,
+                         "P(Better)": (differences > 0).mean(axis=0), "Significant": (low > 0) | (high < 0),
+                         "Paired": paired},
+                        index=pd.Index([f"Weighted {metric}" for metric in METRICS], name="Metric"))
+
+
+def evaluate_saved_outputs(delta_stats_path: str, case_output_path: str, save_path: str = None,
+                           n_resamples: int = 0) -> pd.DataFrame:
+    """
+    Evaluate the delta statistics and case output of a previous run without reprocessing.
+
+    Args:
+        delta_stats_path (str): Delta statistics written by `ProcessManager` (.jsonl, or .csv of older runs).
+        case_output_path (str): CSV file written by `ProcessManager.save_case_statistics`.
+        save_path (str): Path to save the confusion matrix plot, or None to skip plotting.
+        n_resamples (int): Bootstrap resamples for the confidence intervals of the metrics; 0 skips them.
+    """
+    cases = pd.read_csv(case_output_path)
+
+    evaluation_df = evaluate(read_delta_stats(delta_stats_path, EVALUATION_COLUMNS), cases)
     weighted_metrics = calculate_weighted_metrics(evaluation_df)
 
     print("\nWeighted Metrics:")
     for metric, value in weighted_metrics.items():
         print(f"{metric}: {value:.2f}")
+    if n_resamples:
+        print(f"\n95% Bootstrap Confidence Intervals ({n_resamples} resamples of deltas and cases):")
+        print(confidence_intervals(evaluation_df, n_resamples).to_string(float_format=lambda value: f"{value:.4f}"))
 
-    avg_cm_per_delta(evaluation_df, "VIS/confusion_matrix.png")
-
-
+    if save_path is not None:
+        avg_cm_per_delta(evaluation_df, save_path)
+    return evaluation_df
 
 
+if __name__ == "__main__" and test_eval:
+    evaluate_saved_outputs(delta_output_path, cases_output_path, confusion_matrix_path)
@@ -0,0 +1,280 @@
+import pickle
+import numpy as np
+import pandas as pd
+from case import Case
+from delta import delta_label
+
+
+class LateEventIndex:
+    """
+    Bookkeeping for late events: events that arrive in a delta log after the period they belong to.
+
+    Every event belongs to the delta of its own period, named by `period_of` as the splitter
+    would have named it; when no delta log of that period was processed, it belongs to the last
+    processed delta before it. An event of an earlier delta than the current one is late. Deltas
+    cut by event count have no period of their own: without `period_of`, an event older than the
+    high watermark (the latest `completeTime` processed so far) is late and belongs to the
+    earliest processed delta whose events reach its time. If that delta is at most `watermark`
+    deltas back, the event is applied there by replaying the affected cases; older events are
+    dropped and counted.
+
+    The per-case dependency index records, for every event of a case, the delta it belongs to and
+    the delta log and row it was read from, so the events of a case can be fetched again without
+    reading the rest of the log. The `Delta` objects of the last `watermark` deltas are kept so
+    their reports can be revised.
+
+    A case is replayed from a checkpoint: its pickled state at the end of a delta before the
+    earliest one a late event can still reach. States are saved at the end of every delta that
+    changes a case, and before the first change of a case that has none. Once a delta leaves the
+    window, the index entries up to it and all states but the latest one before it are dropped,
+    so the index holds only the cases changed within the last `watermark` deltas.
+    """
+
+    def __init__(self, watermark, period_of=None, variants=None):
+        """
+        :param watermark: Number of deltas a late event may lag behind the delta it arrives in.
+        :param period_of: Maps event times (int64 nanoseconds) to the delta label of their period,
+                          e.g. `ProcessManager.late_event_periods`; None places events by time.
+        :param variants: The shared `VariantTrie`, re-attached to the cases restored from a checkpoint.
+        """
+        self.watermark = watermark
+        self.period_of = period_of
+        self.variants = variants
+        self.case_events = {}
+        # Pickled state of a case by delta position (None: the case did not exist yet)
+        self.states = {}
+        # Cases with index entries or states at each delta position, to compact them once it leaves the window
+        self.position_cases = {}
+        self.delta_paths = []
+        self.delta_names = []
+        self.delta_labels = []
+        self.max_times = []
+        self.window = {}
+        self.revisions = {}
+        self.late_counts = {}
+
+    def start_delta(self, path, delta_name):
+        """Register the delta log being processed; returns its position (0 is the initial log)."""
+        self.delta_paths.append(path)
+        self.delta_names.append(delta_name)
+        self.delta_labels.append(delta_label(delta_name))
+        return len(self.delta_paths) - 1
+
+    def classify(self, times):
+        """
+        Find the late events of the current delta log.
+
+        :param times: `completeTime` of its events, as int64 nanoseconds.
+        :return: (late, target) where `late` flags the events of an earlier delta and `target` is
+                 the position of the delta each event belongs to.
+        """
+        position = len(self.delta_paths) - 1
+        if self.period_of is not None:
+            target = self.period_positions(self.period_of(times), position)
+            return target < position, target
+
+        target = np.full(len(times), position)
+        if not self.max_times:
+            return np.zeros(len(times), dtype=bool), target
+        late = times < self.max_times[-1]
+        target[late] = np.searchsorted(self.max_times, times[late], side="left")
+        return late, target
+
+    def period_positions(self, labels, position):
+        """
+        Delta position of each period label: the processed delta of that period, or the last one
+        before it when the period has no delta log. Delta names sort in processing order.
+        """
+        processed = np.array(self.delta_labels[1:position + 1], dtype=str)
+        labels = np.asarray(labels, dtype=str)
+        positions = np.searchsorted(processed, labels, side="right")
+        positions[labels == "initial_log"] = 0
+        return positions
+
+    def raise_max_times(self, positions, times):
+        """
+        Move the high watermark of every delta from `positions` on up to the late events that belong there.
+
+        :return: The first delta position raised, or None.
+        """
+        raised = None
+        for position, time in sorted(zip(positions.tolist(), times.tolist())):
+            # The watermarks never decrease, so the first delta already past the event ends the raise
+            for later in range(position, len(self.max_times)):
+                if self.max_times[later] >= time:
+                    break
+                self.max_times[later] = time
+                raised = later if raised is None else min(raised, later)
+        return raised
+
+    def cases_changed_since(self, position):
+        """Cases with index entries or states from a delta position on."""
+        return set().union(*(case_ids for saved, case_ids in self.position_cases.items() if saved >= position))
+
+    def add_events(self, case_ids, positions, times, rows):
+        """Record events of the current delta log in the dependency index of their cases."""
+        file_position = len(self.delta_paths) - 1
+        for case_id, position, time, row in zip(case_ids, positions.tolist(), times.tolist(), rows.tolist()):
+            self.case_events.setdefault(case_id, []).append((position, time, file_position, row))
+            self.position_cases.setdefault(position, set()).add(case_id)
+
+    # ===================== Checkpoints ===================== #
+    def save_state(self, case_id, position, case):
+        """Record the state of a case at the end of a delta position."""
+        self.states.setdefault(case_id, {})[position] = None if case is None else pickle.dumps(
+            case, protocol=pickle.HIGHEST_PROTOCOL)
+        self.position_cases.setdefault(position, set()).add(case_id)
+
+    def before_change(self, case_id, case):
+        """
+        Save the state of a case (None for a new case) before its first change within the window.
+
+        A case without states did not change since the last delta that left the window, so its
+        state holds from there on, before the earliest delta a late event can still reach.
+        """
+        if case_id not in self.states:
+            self.save_state(case_id, len(self.delta_paths) - 2 - self.watermark, case)
+
+    def checkpoint(self, case_id, before):
+        """
+        Latest saved state of a case before a delta position, to replay the case from.
+
+        :return: (delta position of the state, a fresh copy of the case or None).
+        """
+        states = self.states[case_id]
+        position = max(saved for saved in states if saved < before)
+        data = states[position]
+        if data is None:
+            return position, None
+        case = pickle.loads(data)
+        case.variants = self.variants
+        return position, case
+
+    def revise_states(self, case_id, first_changed, states):
+        """Replace the states of a case from `first_changed` on by those of its replay."""
+        kept = {position: data for position, data in self.states[case_id].items() if position < first_changed}
+        for position, data in states.items():
+            if position >= first_changed:
+                kept[position] = data
+                self.position_cases.setdefault(position, set()).add(case_id)
+        self.states[case_id] = kept
+
+    def compact(self, frozen):
+        """
+        Drop what no replay needs once the deltas up to `frozen` left the window: index entries up
+        to it, and all states of a case but the latest one up to it, which is kept only while the
+        case has later states. Late events can no longer reach those deltas, so every later replay
+        starts at or after that state.
+        """
+        for position in [position for position in self.position_cases if position <= frozen]:
+            for case_id in self.position_cases.pop(position):
+                entries = [entry for entry in self.case_events.get(case_id, []) if entry[0] > frozen]
+                if entries:
+                    self.case_events[case_id] = entries
+                else:
+                    self.case_events.pop(case_id, None)
+
+                states = self.states.get(case_id, {})
+                later = {saved: data for saved, data in states.items() if saved > frozen}
+                if later:
+                    latest = max(saved for saved in states if saved <= frozen)
+                    later[latest] = states[latest]
+                    self.states[case_id] = later
+                else:
+                    self.states.pop(case_id, None)
+
+    def finish_delta(self, position, delta, on_time_times):
+        """
+        Keep the delta for revisions and move the high watermark past its events.
+
+        :return: The deltas that left the window; late events can no longer revise them.
+        """
+        latest = self.max_times[-1] if self.max_times else None
+        if len(on_time_times):
+            latest = int(on_time_times.max()) if latest is None else max(latest, int(on_time_times.max()))
+        self.max_times.append(latest if latest is not None else np.iinfo(np.int64).min)
+        self.window[position] = delta
+        self.revisions[position] = 0
+        self.compact(position - self.watermark)
+        return [self.window.pop(old) for old in sorted(self.window) if old <= position - self.watermark]
+
+    def close_window(self):
+        """Release the deltas still in the window once every delta log has been processed."""
+        final = [self.window[position] for position in sorted(self.window)]
+        self.window = {}
+        return final
+
+    def history(self, case_id):
+        """Events of a case in processing order: by delta, then time, then arrival."""
+        return sorted(self.case_events.get(case_id, []))
+
+    def read_events(self, entries):
+        """
+        Fetch the event rows of index entries from their delta logs, reading only those rows.
+
+        :return: Dictionary of the events by (delta log position, row).
+        """
+        wanted = {}
+        for entry in entries:
+            wanted.setdefault(entry[2], set()).add(entry[3])
+
+        events = {}
+        for file_position, rows in wanted.items():
+            rows = sorted(rows)
+            selected = set(rows)
+            frame = pd.read_csv(self.delta_paths[file_position], keep_default_na=False, na_values=['NaN', "", " "],
+                                skiprows=lambda line: line > 0 and (line - 1) not in selected)
+            for row, (_, event) in zip(rows, frame.iterrows()):
+                events[(file_position, row)] = event
+        return events
+
+
+def sleep_positions(contributions):
+    """Delta positions at which a replay flagged its case incomplete."""
+    return {position for position, delta in contributions.items() if delta.incomplete_cases}
+
+
+def replay_case(checkpoint, events, delta_names, last_position, variants, new_delta, sleep_times, states=None):
+    """
+    Rebuild a case from a checkpoint and its later events, as `ProcessManager` would have processed them.
+
+    :param checkpoint: (delta position, case) from `LateEventIndex.checkpoint`; the case is advanced in place.
+    :param events: (delta position, event) pairs after the checkpoint, in processing order.
+    :param delta_names: Name of each delta position, as passed to `ProcessManager.process_logs`.
+    :param last_position: Last delta to replay; deltas without events still count towards the sleep check.
+    :param new_delta: Creates an empty `Delta` for a delta name and position.
+    :param sleep_times: (last event time processed up to each delta position, longest time without
+                        events), as in `ProcessManager.perform_sleep_check`.
+    :param states: Filled with the pickled state of the case at the end of every delta that changed it.
+    :return: (case, {position: Delta holding only this case's contribution}).
+    """
+    by_position = {}
+    for position, event in events:
+        by_position.setdefault(position, []).append(event)
+
+    reference_times, max_idle = sleep_times
+    checkpoint_position, case = checkpoint
+    contributions = {}
+    if case is None and not events:
+        return None, contributions
+    for position in range(checkpoint_position + 1 if case is not None else events[0][0], last_position + 1):
+        delta_name = delta_names[position]
+        if position in by_position:
+            delta = contributions[position] = new_delta(delta_name, position)
+            for event in by_position[position]:
+                if case is None:
+                    case = Case(event, delta_name, delta, variants)
+                else:
+                    case.update(event, delta)
+                case.check_missing_attributes(event)
+            delta.process_case_status(case)
+
+        sleeping = reference_times[position] - case.last_event_time > max_idle
+        if sleeping and not (case.complete or case.cancelled or case.incomplete):
+            if position not in contributions:
+                contributions[position] = new_delta(delta_name, position)
+            contributions[position].incomplete_cases.add(case.case_id)
+            case.run_function_and_update_status(delta_name, case.final_status, case.update_sleep())
+        if states is not None and position in contributions:
+            states[position] = pickle.dumps(case, protocol=pickle.HIGHEST_PROTOCOL)
+    return case, contributions
@@ -0,0 +1,257 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from config import RunConfig, run_name_for, __RANDOM_SEED__
+from validation import EventValidator, parse_complete_times
+
+# Latency percentiles reported per speed-up
+PERCENTILES = [50, 90, 95, 99]
+
+# Speed-ups of the latency curves, as multiples of the maximum sustainable speed-up
+CURVE_FACTORS = [0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0]
+
+
+def synthetic_event_log(template: pd.DataFrame, n_cases, seed=__RANDOM_SEED__) -> pd.DataFrame:
+    """
+    Event log of a larger (or smaller) hospital, resampled from the traces of a real one.
+
+    `n_cases` traces are drawn with replacement from the valid rows of `template`, given new case
+    ids ("SYN0000001", ...) and started at uniformly drawn times over the period in which the
+    template's cases start. Each trace keeps its events and the times between them; other time
+    columns such as `startTime` are copied unchanged, as the classification only reads `completeTime`.
+
+    :param template: Raw event rows, as read from the event log CSV.
+    :param n_cases: Number of cases of the synthetic log.
+    :param seed: Random seed; the same seed draws the same log.
+    """
+    events = template.copy()
+    events["case"] = events["case"].astype(str).where(events["case"].notna())
+    events["completeTime"], raw_times = parse_complete_times(events)
+    events = events[EventValidator(None).reasons(events, raw_times) == ""]
+
+    codes, _ = pd.factorize(events["case"])
+    first = events.groupby(codes)["completeTime"].min().to_numpy()
+    offsets = (events["completeTime"] - first[codes]).to_numpy()
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes)
+    row_starts = np.cumsum(counts) - counts
+
+    rng = np.random.default_rng(seed)
+    drawn = rng.integers(0, len(counts), n_cases)
+    span_seconds = (first.max() - first.min()) / np.timedelta64(1, "s")
+    starts = first.min() + (rng.random(n_cases) * span_seconds).astype("timedelta64[s]")
+    lengths = counts[drawn]
+    # Row positions of the drawn traces, one trace after the other
+    trace_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = order[np.repeat(row_starts[drawn], lengths) + np.arange(lengths.sum()) - trace_offsets]
+
+    synthetic = events.iloc[rows].copy()
+    synthetic["case"] = np.repeat([f"SYN{number:07d}" for number in range(1, n_cases + 1)], lengths)
+    synthetic["completeTime"] = np.repeat(starts, lengths) + offsets[rows]
+    return synthetic.sort_values(by="completeTime", kind="stable").reset_index(drop=True)
+
+
+def simulate_queue(arrivals, service):
+    """
+    Finish times and backlog of deltas served one at a time in arrival order (Lindley recursion).
+
+    A delta starts when it has arrived and the one before it has finished, so its finish time is
+    the largest arrival time plus the service times from there on; computed for all deltas at once.
+
+    :param arrivals: Arrival time of every delta in seconds, non-decreasing.
+    :param service: Processing time of every delta in seconds.
+    :return: (finish times, number of earlier deltas waiting or in progress when each delta arrives).
+    """
+    total = np.cumsum(service)
+    finish = total + np.maximum.accumulate(arrivals - (total - service))
+    backlog = np.arange(len(arrivals)) - np.searchsorted(finish, arrivals, side="right")
+    return finish, backlog
+
+
+def latency_percentiles(latencies) -> dict:
+    """Percentiles, mean and maximum of end-to-end latencies in seconds."""
+    if len(latencies) == 0:
+        return {**{f"p{q}_latency": np.nan for q in PERCENTILES}, "mean_latency": np.nan, "max_latency": np.nan}
+    values = np.percentile(latencies, PERCENTILES)
+    return {**{f"p{q}_latency": value for q, value in zip(PERCENTILES, values)},
+            "mean_latency": float(np.mean(latencies)), "max_latency": float(np.max(latencies))}
+
+
+def sustainable_speedup(simulated_arrivals, service, max_backlog=1):
+    """
+    Largest speed-up of simulated time at which no delta arrives to more than `max_backlog` waiting deltas.
+
+    The backlog only grows with the speed-up, so the limit is found by bisection on a log scale.
+
+    :param simulated_arrivals: Arrival time of every delta in simulated seconds since the replay start.
+    :param service: Processing time of every delta in seconds.
+    :return: The speed-up; 0 if even a slow replay exceeds the backlog (deltas arriving together).
+    """
+    def keeps_up(speedup):
+        return simulate_queue(simulated_arrivals / speedup, service)[1].max(initial=0) <= max_backlog
+
+    low, high = 1e-3, 1e12
+    if not keeps_up(low):
+        return 0.0
+    if keeps_up(high):
+        return high
+    for _ in range(100):
+        middle = np.sqrt(low * high)
+        low, high = (middle, high) if keeps_up(middle) else (low, middle)
+        if high / low < 1.001:
+            break
+    return low
+
+
+class LoadTester:
+    """
+    Accelerated replay of an event log into `ProcessManager`, to see whether it keeps up with the arrival rate.
+
+    The log is validated and split in memory first. A delta arrives once its last event has
+    happened, with simulated time running `speedup` times faster than real time from the initial
+    cutoff onwards; the initial log is processed before the clock starts. Deltas are processed one
+    at a time in arrival order, and for each the queueing delay, processing time, end-to-end
+    latency (arrival to finished report) and the backlog of deltas waiting at its arrival are
+    recorded. From the measured processing times, the latencies at other speed-ups and the
+    maximum sustainable arrival rate follow without replaying again (`simulate_queue`).
+    """
+
+    def __init__(self, config: RunConfig = None, speedup=100_000, synthetic_cases=None, seed=None, max_backlog=1):
+        """
+        :param config: Run parameters (event log, frequency, max_delta_events, ...); defaults to `config.py`.
+        :param speedup: Simulated seconds per second of real time.
+        :param synthetic_cases: Replay a synthetic log with this many cases resampled from the event log
+                                (`synthetic_event_log`) instead of the event log itself.
+        :param seed: Random seed of the synthetic log; defaults to the configured `random_seed`.
+        :param max_backlog: Waiting deltas a sustainable arrival rate may build up.
+        """
+        from api import run_config_for
+
+        # Results stay in memory, so the measured times are those of the classification alone
+        self.config = run_config_for(config or RunConfig(), artifacts=())
+        self.speedup = speedup
+        self.synthetic_cases = synthetic_cases
+        self.seed = self.config.random_seed if seed is None else seed
+        self.max_backlog = max_backlog
+        self.run_name = run_name_for(self.config.frequency, self.config.initial_months, self.config.max_delta_events)
+        self.output_dir = os.path.join(self.config.output_dir, "loadtest")
+
+    def event_log(self) -> pd.DataFrame:
+        events = pd.read_csv(self.config.event_log_path, keep_default_na=False, na_values=['NaN', "", " "])
+        if self.synthetic_cases:
+            events = synthetic_event_log(events, self.synthetic_cases, self.seed)
+        return events
+
+    def split(self):
+        """
+        Split the event log in memory.
+
+        :return: [(delta name, events, arrival in simulated seconds since the initial cutoff), ...],
+                 starting with the initial log at 0.
+        """
+        from api import as_read_from_csv
+        from delta_log_formation import EventLogSplitter
+
+        splitter = EventLogSplitter.from_config(self.config)
+        deltas = []
+        for delta_name, events in splitter.iter_split_logs(self.event_log()):
+            if delta_name == "initial_log":
+                arrival = 0.0
+            else:
+                arrival = (events["completeTime"].max() - splitter.initial_cutoff).total_seconds()
+            deltas.append((delta_name, as_read_from_csv(events), arrival))
+        return deltas
+
+    def replay(self):
+        """
+        Process the deltas as they arrive on the accelerated clock.
+
+        :return: One row per delta after the initial log with its events, arrival, start and finish
+                 (seconds since the clock started), queueing delay, processing time, latency and backlog.
+        """
+        from process import ProcessManager
+
+        deltas = self.split()
+        process_manager = ProcessManager(config=self.config)
+
+        (_, initial_events, _), deltas = deltas[0], deltas[1:]
+        start_time = time.perf_counter()
+        process_manager.process_events(initial_events, "initial_log")
+        print(f"[LOAD TEST] Initial log: {len(initial_events)} events in {time.perf_counter() - start_time:.2f} s")
+
+        rows = []
+        clock = time.perf_counter()
+        for delta_name, events, simulated_arrival in deltas:
+            arrival = simulated_arrival / self.speedup
+            wait = arrival - (time.perf_counter() - clock)
+            if wait > 0:
+                time.sleep(wait)
+            start = time.perf_counter() - clock
+            process_manager.process_events(events, delta_name)
+            finish = time.perf_counter() - clock
+            rows.append({"delta_name": delta_name, "events": len(events), "simulated_arrival": simulated_arrival,
+                         "arrival": arrival, "start": start, "finish": finish})
+        process_manager.cases.close()
+
+        replay = pd.DataFrame(rows, columns=["delta_name", "events", "simulated_arrival", "arrival", "start",
+                                             "finish"])
+        replay["queueing"] = replay["start"] - replay["arrival"]
+        replay["service"] = replay["finish"] - replay["start"]
+        replay["latency"] = replay["finish"] - replay["arrival"]
+        replay["backlog"] = (np.arange(len(replay))
+                             - np.searchsorted(replay["finish"].to_numpy(), replay["arrival"].to_numpy(), side="right"))
+        return replay
+
+    def latency_curves(self, replay: pd.DataFrame, sustainable) -> pd.DataFrame:
+        """Estimated latency percentiles and backlog at multiples of the sustainable speed-up and at the replayed one."""
+        simulated_arrivals = replay["simulated_arrival"].to_numpy()
+        service = replay["service"].to_numpy()
+        speedups = sorted({self.speedup, *(sustainable * factor for factor in CURVE_FACTORS if sustainable)})
+        rows = []
+        for speedup in speedups:
+            arrivals = simulated_arrivals / speedup
+            finish, backlog = simulate_queue(arrivals, service)
+            rows.append({"speedup": speedup, "deltas_per_hour": len(replay) / (arrivals[-1] or np.nan) * 3600,
+                         **latency_percentiles(finish - arrivals), "max_backlog": backlog.max(initial=0),
+                         "mean_backlog": backlog.mean()})
+        return pd.DataFrame(rows)
+
+    def run(self):
+        """
+        Replay the log, print the latency percentiles and maximum sustainable arrival rate, and save the results.
+
+        :return: (per-delta replay frame, latency curves, summary dictionary).
+        """
+        replay = self.replay()
+        if replay.empty:
+            raise ValueError("The event log has no deltas after the initial log to replay.")
+        service = replay["service"].to_numpy()
+        sustainable = sustainable_speedup(replay["simulated_arrival"].to_numpy(), service, self.max_backlog)
+        span = replay["simulated_arrival"].iloc[-1]
+        summary = {
+            "run_name": self.run_name, "synthetic_cases": self.synthetic_cases, "speedup": self.speedup,
+            "deltas": len(replay), "events": int(replay["events"].sum()),
+            **latency_percentiles(replay["latency"].to_numpy()),
+            "max_backlog": int(replay["backlog"].max()), "mean_service": float(service.mean()),
+            "events_per_second": replay["events"].sum() / service.sum(),
+            "sustainable_speedup": sustainable,
+            "sustainable_deltas_per_hour": len(replay) / span * sustainable * 3600 if span else np.nan,
+        }
+        curves = self.latency_curves(replay, sustainable)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"{self.run_name}{f'_syn{self.synthetic_cases}' if self.synthetic_cases else ''}"
+        replay.to_csv(os.path.join(self.output_dir, f"loadtest_deltas_{name}_x{self.speedup:g}.csv"), index=False)
+        curves.to_csv(os.path.join(self.output_dir, f"latency_curves_{name}.csv"), index=False)
+
+        percentiles = ", ".join(f"p{q} {summary[f'p{q}_latency']:.3f} s" for q in PERCENTILES)
+        print(f"[LOAD TEST] {summary['deltas']} deltas ({summary['events']} events) at {self.speedup:g}x: "
+              f"latency {percentiles}, max {summary['max_latency']:.3f} s; max backlog {summary['max_backlog']}")
+        print(f"[LOAD TEST] Processing {summary['events_per_second']:,.0f} events/s, "
+              f"{summary['mean_service']:.3f} s per delta on average")
+        print(f"[LOAD TEST] Maximum sustainable speed-up (backlog <= {self.max_backlog}): {sustainable:,.0f}x, "
+              f"{summary['sustainable_deltas_per_hour']:,.1f} deltas per hour")
+        print(curves.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+        print(f"Load test results saved to: {self.output_dir}")
+        return replay, curves, summary
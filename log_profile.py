@@ -0,0 +1,255 @@
+import os
+import math
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from sketches import QuantileSketch
+from config import event_log_path, delta_dir_path
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+class EventLogProfiler:
+    """
+    Single-pass, chunked profiling of an event log.
+
+    Replaces the ad-hoc analysis of the exploration notebook: time before each event (delta_t),
+    wait period after each event, trace length outliers and trace duration quantiles. Events are
+    read `chunk_size` rows at a time and summarised into quantile sketches. Memory grows with the
+    chunk size plus a few numbers per distinct case, i.e. O(cases) for the per-case state.
+
+    Events are sorted by `completeTime` within each case of a chunk, and the rows of the case at
+    the end of a chunk are carried into the next one, so a log grouped by case needs no order
+    within a case. An event older than the last event of its case in an earlier chunk raises a
+    ValueError instead of producing negative wait periods.
+    """
+
+    def __init__(self, csv_file_path, chunk_size=200_000, cache_path=None):
+        """
+        :param csv_file_path: Path to the CSV file containing the event log data.
+        :param chunk_size: Number of rows parsed at once.
+        :param cache_path: JSON file caching the profile; defaults to a file next to the delta logs.
+        """
+        self.csv_file_path = csv_file_path
+        self.chunk_size = chunk_size
+        self.filename = os.path.splitext(os.path.basename(csv_file_path))[0]
+        self.cache_path = cache_path or f"{delta_dir_path}profiles/{self.filename}_profile.json"
+
+    # ===================== Cache ===================== #
+    def source_signature(self):
+        stat = os.stat(self.csv_file_path)
+        return {"path": os.path.abspath(self.csv_file_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    def load_cache(self):
+        """Return the cached profile if it was computed from the current version of the log."""
+        if not os.path.exists(self.cache_path):
+            return None
+        with open(self.cache_path) as file:
+            profile = json.load(file)
+        return profile if profile.get("source") == self.source_signature() else None
+
+    def save_cache(self, profile):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with open(self.cache_path, "w") as file:
+            json.dump(profile, file, indent=2)
+
+    def profile(self, refresh=False, max_days_quantile=0.95):
+        """
+        Compute the profile of the event log, or load it from the cache.
+
+        :param refresh: Recompute even if a valid cached profile exists.
+        :param max_days_quantile: Wait period quantile used to suggest `max_days`.
+        :return: A JSON-serialisable dictionary with the profile.
+        """
+        profile = None if refresh else self.load_cache()
+        if profile is None or profile["max_days_quantile"] != max_days_quantile:
+            profile = self.compute(max_days_quantile)
+            self.save_cache(profile)
+            print(f"Profile saved to: {self.cache_path}")
+        else:
+            print(f"Profile loaded from cache: {self.cache_path}")
+        return profile
+
+    # ===================== Single Pass ===================== #
+    def read_chunks(self):
+        return pd.read_csv(self.csv_file_path, usecols=["case", "event", "completeTime"],
+                           keep_default_na=False, na_values=['NaN', "", " "], chunksize=self.chunk_size)
+
+    def compute(self, max_days_quantile=0.95):
+        sketches = ({}, {}, QuantileSketch())
+        cases = None
+        n_events = 0
+        tail = None
+
+        for chunk in self.read_chunks():
+            n_events += len(chunk)
+            chunk["case"] = chunk["case"].astype(str)
+            chunk["completeTime"] = pd.to_datetime(chunk["completeTime"]).dt.tz_localize(None)
+            if tail is not None:
+                chunk = pd.concat([tail, chunk], ignore_index=True)
+
+            # The last case may continue in the next chunk: carry its rows over
+            open_case = chunk["case"].to_numpy() == chunk["case"].iloc[-1]
+            tail = chunk[open_case]
+            cases = self.add_chunk(chunk[~open_case], cases, sketches)
+
+        if tail is not None:
+            cases = self.add_chunk(tail, cases, sketches)
+        return self.summarise(cases, n_events, *sketches, max_days_quantile)
+
+    def add_chunk(self, chunk, cases, sketches):
+        """
+        Add the wait periods of a chunk to the sketches and fold its cases into the per-case state.
+
+        :param chunk: Events with `case`, `event` and parsed `completeTime` columns.
+        :param cases: Running per-case state, or None before the first chunk.
+        :param sketches: Tuple of delta_t by event, wait period by event and overall wait period sketches.
+        :return: The updated per-case state.
+        """
+        if chunk.empty:
+            return cases
+        delta_t_by_event, wait_period_by_event, wait_period = sketches
+        chunk = chunk.sort_values(["case", "completeTime"], kind="stable")
+
+        # Previous event of the same case, continuing from the previous chunk where needed
+        grouped = chunk.groupby("case", sort=False)
+        previous_time = grouped["completeTime"].shift(1)
+        previous_event = grouped["event"].shift(1)
+        if cases is not None:
+            first_in_chunk = (grouped.cumcount() == 0).to_numpy()
+            carried = cases.reindex(chunk.loc[first_in_chunk, "case"])
+            out_of_order = (chunk.loc[first_in_chunk, "completeTime"].to_numpy()
+                            < carried["last_time"].to_numpy())
+            if out_of_order.any():
+                raise ValueError(
+                    f"{int(out_of_order.sum())} case(s), e.g. '{carried.index[out_of_order][0]}', have events "
+                    f"older than events of an earlier chunk of {self.csv_file_path}. "
+                    f"Increase --chunk-size or sort the log by case and completeTime.")
+            previous_time[first_in_chunk] = carried["last_time"].to_numpy()
+            previous_event[first_in_chunk] = carried["last_event"].to_numpy()
+        chunk["delta_t"] = (chunk["completeTime"] - previous_time).dt.total_seconds()
+        chunk["previous_event"] = previous_event
+
+        # Time passed before an event and wait period after an event
+        for event_name, values in chunk.groupby("event")["delta_t"]:
+            delta_t_by_event.setdefault(event_name, QuantileSketch()).add_array(values.to_numpy())
+        for event_name, values in chunk.groupby("previous_event")["delta_t"]:
+            wait_period_by_event.setdefault(event_name, QuantileSketch()).add_array(values.to_numpy())
+        wait_period.add_array(chunk["delta_t"].to_numpy())
+
+        return self.merge_case_state(cases, chunk)
+
+    @staticmethod
+    def merge_case_state(cases, chunk):
+        """Fold the per-case aggregates of a chunk into the running per-case state."""
+        aggregated = chunk.groupby("case", sort=False).agg(
+            start=("completeTime", "min"),
+            end=("completeTime", "max"),
+            length=("event", "size"),
+            gap_sum=("delta_t", "sum"),
+            gap_count=("delta_t", "count"),
+            last_time=("completeTime", "last"),
+            last_event=("event", "last"),
+        )
+        if cases is None:
+            return aggregated
+
+        overlap = aggregated.index.intersection(cases.index)
+        if len(overlap):
+            old, new = cases.loc[overlap], aggregated.loc[overlap]
+            cases.loc[overlap, "start"] = np.minimum(old["start"], new["start"])
+            cases.loc[overlap, "end"] = np.maximum(old["end"], new["end"])
+            for column in ("length", "gap_sum", "gap_count"):
+                cases.loc[overlap, column] = old[column] + new[column]
+            cases.loc[overlap, ["last_time", "last_event"]] = new[["last_time", "last_event"]]
+        return pd.concat([cases, aggregated.loc[aggregated.index.difference(cases.index)]])
+
+    # ===================== Summaries ===================== #
+    @staticmethod
+    def iqr_bounds(q1, q3, lower_limit=None):
+        iqr = q3 - q1
+        lower, upper = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+        if lower_limit is not None:
+            lower = max(lower, lower_limit)
+        return lower, upper
+
+    @staticmethod
+    def describe(sketch: QuantileSketch, scale=SECONDS_PER_DAY):
+        """describe()-like summary of a sketch of seconds, expressed in days."""
+        summary = sketch.summary(quantiles=(0.25, 0.5, 0.75, 0.95, 0.99))
+        return {key: (value / scale if value is not None and key != "count" else value)
+                for key, value in summary.items()}
+
+    def summarise(self, cases, n_events, delta_t_by_event, wait_period_by_event, wait_period, max_days_quantile):
+        lengths = cases["length"]
+        q1, q3 = lengths.quantile(0.25), lengths.quantile(0.75)
+        length_lower, length_upper = self.iqr_bounds(q1, q3)
+        length_outliers = (lengths < length_lower) | (lengths > length_upper)
+
+        durations = (cases["end"] - cases["start"]).dt.total_seconds() / SECONDS_PER_DAY
+        d1, d3 = durations.quantile(0.25), durations.quantile(0.75)
+        duration_lower, duration_upper = self.iqr_bounds(d1, d3, lower_limit=0)
+        kept = durations[(durations >= duration_lower) & (durations <= duration_upper)]
+        log_end = cases["end"].max()
+        zero_duration = durations == 0
+        since_start = (log_end - cases["start"]).dt.total_seconds() / SECONDS_PER_DAY
+
+        wait = self.describe(wait_period)
+        wait_iqr_upper = self.iqr_bounds(wait["p25"], wait["p75"])[1] if wait_period.count else None
+        suggested = wait_period.quantile(max_days_quantile)
+        case_delta_t = (cases["gap_sum"] / cases["gap_count"]).dropna() / SECONDS_PER_DAY
+
+        return {
+            "source": self.source_signature(),
+            "max_days_quantile": max_days_quantile,
+            "events": int(n_events),
+            "cases": int(len(cases)),
+            "timeframe": [str(cases["start"].min()), str(log_end)],
+            "delta_t_by_event_days": {str(event): self.describe(sketch) for event, sketch in delta_t_by_event.items()},
+            "wait_period_by_event_days": {str(event): self.describe(sketch)
+                                          for event, sketch in wait_period_by_event.items()},
+            "wait_period_days": dict(wait, iqr_upper=wait_iqr_upper),
+            "case_mean_delta_t_days": {key: float(value) for key, value in case_delta_t.describe().items()},
+            "trace_length": {
+                "q1": float(q1), "q3": float(q3),
+                "lower_bound": float(length_lower), "upper_bound": float(length_upper),
+                "outliers": int(length_outliers.sum()),
+                "distribution": {str(length): int(count) for length, count in lengths.value_counts().sort_index().items()},
+            },
+            "trace_duration_days": {
+                "mean": float(durations.mean()), "median": float(durations.median()),
+                "q1": float(d1), "q3": float(d3),
+                "lower_bound": float(duration_lower), "upper_bound": float(duration_upper),
+                "mean_without_outliers": float(kept.mean()), "median_without_outliers": float(kept.median()),
+                "zero_duration_cases": int(zero_duration.sum()),
+                "unfinished_zero_duration_cases": int((zero_duration & (since_start > duration_upper)).sum()),
+            },
+            "suggested_max_days": math.ceil(suggested / SECONDS_PER_DAY) if suggested is not None else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile an event log in one chunked pass.")
+    parser.add_argument("csv_file_path", nargs="?", default=event_log_path)
+    parser.add_argument("--chunk-size", type=int, default=200_000)
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cached profile.")
+    parser.add_argument("--max-days-quantile", type=float, default=0.95,
+                        help="Wait period quantile used to suggest max_days.")
+    args = parser.parse_args()
+
+    profile = EventLogProfiler(args.csv_file_path, args.chunk_size).profile(args.refresh, args.max_days_quantile)
+
+    print(f"Events: {profile['events']}, Cases: {profile['cases']}, Timeframe: {profile['timeframe']}")
+    print(pd.DataFrame(profile["wait_period_by_event_days"]).T.round(2))
+    print(f"Trace length IQR bounds: {profile['trace_length']['lower_bound']} - "
+          f"{profile['trace_length']['upper_bound']} ({profile['trace_length']['outliers']} outliers)")
+    duration = profile["trace_duration_days"]
+    print(f"Trace duration (days) - mean: {duration['mean']:.2f}, median: {duration['median']:.2f}, "
+          f"upper bound: {duration['upper_bound']:.2f}")
+    print(f"Suggested max_days (p{round(args.max_days_quantile * 100)} of wait periods): "
+          f"{profile['suggested_max_days']}")
+
+
+if __name__ == "__main__":
+    main()
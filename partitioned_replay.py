@@ -0,0 +1,323 @@
+import os
+import time
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from delta_log_formation import list_delta_logs
+from state_machine import (BatchStateMachine, COMPLETE, F_CANCELLED, F_COMPLETE, F_ONGOING, F_SLEPT, INCOMPLETE,
+                           NEXT_FLAGS, ONGOING, OTHER_STATE, REQUIRED_MASKS, TRACKED_EVENTS, cancelled_flags,
+                           delta_report, event_counts, event_ranks, event_times)
+from config import RunConfig
+
+# Event time of a delta without any event yet
+NO_TIME = np.iinfo(np.int64).min
+
+
+@dataclass
+class PartitionSummary:
+    """
+    Encoded events and per-case summary of a contiguous run of delta logs, relative to the
+    (unknown) state the cases enter the partition with.
+    """
+    start: int                # Position of the first delta of the partition (0 is the initial log)
+    delta_names: list
+    case_ids: np.ndarray      # Partition-local vocabularies, in order of first appearance
+    event_names: list
+    state_names: list
+    event_counts: list        # `event_counts` of every delta
+    latest: np.ndarray        # Latest event time of the partition up to each delta, NO_TIME before the first one
+    events: pd.DataFrame      # Events in processing order with their outcome, see `summarise_partition`
+    cases: pd.DataFrame       # Summary of every case, in `case_ids` order, see `summarise_partition`
+
+
+def partition_log_files(log_files, n_partitions):
+    """
+    Cut the delta logs into at most `n_partitions` contiguous runs of about the same number of bytes.
+
+    :return: List of (start position, log files) pairs.
+    """
+    sizes = np.array([os.path.getsize(path) for path, _ in log_files], dtype=float)
+    targets = np.arange(1, n_partitions) * sizes.sum() / n_partitions
+    cuts = np.unique(np.searchsorted(np.cumsum(sizes), targets, side="right"))
+    bounds = [0] + [int(cut) for cut in cuts if 0 < cut < len(log_files)] + [len(log_files)]
+    return [(start, log_files[start:end]) for start, end in zip(bounds, bounds[1:])]
+
+
+def summarise_partition(partition):
+    """
+    Worker task: read and encode a partition of delta logs and summarise each of its cases.
+
+    The codes are local to the partition; a `BatchStateMachine` is only used for its vocabularies.
+    Nothing depends on earlier partitions, so all partitions are summarised in parallel. Each event
+    gets the status outcome it has whatever the case did before the partition: cancelled events
+    complete the case and events in a state other than Billed/Unbillable make it ongoing. The other
+    events complete it only if the case already covered their `missing` events when entering the
+    partition, and otherwise keep its status. `next_delta` is the delta of the next event of the case
+    (the number of deltas after its last one), which bounds the idle span the sleep check looks at.
+
+    Per case the summary holds the OR of its event coverage, its first and last delta and event time,
+    its number of events and its last state and event. These combine associatively with the state of
+    the run before the partition (`PartitionedReplay.merge_partition`).
+
+    :param partition: (start position, [(path, delta name), ...]) as made by `partition_log_files`.
+    """
+    start, log_files = partition
+    vocabulary = BatchStateMachine(max_days=0)
+    frames, counts = [], []
+    for delta, (path, delta_name) in enumerate(log_files):
+        event_log = pd.read_csv(path, keep_default_na=False, na_values=['NaN', "", " "])
+        cases = vocabulary.encode_cases(event_log["case"].to_numpy(dtype=object))
+        events = vocabulary.encode_events(event_log["event"])
+        frames.append(pd.DataFrame({
+            "case": cases,
+            "delta": np.full(len(cases), delta),
+            "rank": event_ranks(cases),
+            "event": events,
+            "state": vocabulary.encode_states(event_log["state"]),
+            "cancelled": cancelled_flags(event_log).astype(bool),
+            "time": event_times(event_log),
+        }))
+        counts.append(event_counts(vocabulary.event_names, events))
+    events = pd.concat(frames, ignore_index=True)
+    n_deltas = len(log_files)
+
+    # Coverage of the events of each case in the partition up to and including every event
+    bit_positions = np.arange(len(TRACKED_EVENTS))
+    bits = vocabulary.event_bits[events["event"]].astype(np.int64)
+    seen = pd.DataFrame((bits[:, None] >> bit_positions) & 1).groupby(events["case"].to_numpy()).cummax()
+    coverage = (seen.to_numpy() << bit_positions).sum(axis=1).astype(np.uint8)
+
+    state_class = vocabulary.state_classes[events["state"]] if len(events) else np.zeros(0, dtype=np.int8)
+    cancelled = events["cancelled"].to_numpy()
+    events["state_class"] = state_class
+    events["outcome"] = np.select([cancelled, state_class == OTHER_STATE], [COMPLETE, ONGOING], -1).astype(np.int8)
+    events["missing"] = REQUIRED_MASKS[state_class] & ~coverage
+    events["first"] = ~events["case"].duplicated()
+    events["row_end"] = ~events.duplicated(["case", "delta"], keep="last")
+    events["next_delta"] = events["delta"]
+    row_ends = events[events["row_end"]]
+    events.loc[row_ends.index, "next_delta"] = row_ends.groupby("case")["delta"].shift(-1, fill_value=n_deltas)
+
+    latest = events.groupby("delta")["time"].max().reindex(range(n_deltas), fill_value=NO_TIME).cummax()
+
+    # Events are in processing order and case codes in order of first appearance
+    first = events[events["first"]]
+    last = events[~events["case"].duplicated(keep="last")].sort_values("case")
+    summary = pd.DataFrame({
+        "first_event_time": first["time"].to_numpy().view("datetime64[ns]"),
+        "last_event_time": last["time"].to_numpy().view("datetime64[ns]"),
+        "events": np.bincount(events["case"], minlength=vocabulary.n_cases),
+        "first_delta": first["delta"].to_numpy(),
+        "last_delta": last["delta"].to_numpy(),
+        "coverage": coverage[last.index],
+        "last_state": last["state"].to_numpy(),
+        "last_event": last["event"].to_numpy(),
+        "last_row": last.index.to_numpy(),
+    }, index=pd.Index(vocabulary.case_index, name="case_id"))
+    return PartitionSummary(start, [delta_name for _, delta_name in log_files], vocabulary.case_index.to_numpy(),
+                            vocabulary.event_names, vocabulary.state_names, counts, latest.to_numpy(), events,
+                            summary)
+
+
+class PartitionedReplay:
+    """
+    Time-partitioned parallel run of the table-driven classification (`state_machine.py`).
+
+    The delta sequence is cut into contiguous partitions of about equal size. Worker processes
+    read, encode and summarise their partition in parallel (`summarise_partition`), relative to the
+    state the cases enter it with: the status outcome of every event and, per case, its coverage,
+    idle spans, last state and event, first and last event time and number of events. The merge
+    combines each partition with one `BatchStateMachine` in a single vectorised pass
+    (`merge_partition`) instead of replaying its deltas, and reproduces the status, transitions,
+    sleep checks and delta reports of a sequential run exactly. Partitions are merged in order as
+    soon as they arrive, while later ones are still being summarised.
+    """
+
+    def __init__(self, config: RunConfig = None, n_workers=None, n_partitions=None):
+        """
+        :param config: Run parameters; defaults to `config.py`.
+        :param n_workers: Number of worker processes; defaults to the number of CPU cores.
+        :param n_partitions: Number of partitions; defaults to two per worker, so merging overlaps encoding.
+        """
+        self.config = config or RunConfig()
+        if self.config.late_event_watermark is not None:
+            raise ValueError("The late-event mode revises earlier deltas; use ProcessManager.run for it.")
+        self.n_workers = n_workers or os.cpu_count()
+        self.n_partitions = n_partitions or 2 * self.n_workers
+        self.machine = BatchStateMachine(self.config.max_days)
+        self.first_event_times = np.array([], dtype="datetime64[ns]")
+        self.last_event_times = np.array([], dtype="datetime64[ns]")
+        self.event_counts = np.array([], dtype=np.int64)
+
+    def merge_partition(self, partition: PartitionSummary):
+        """
+        Combine the summaries of the next partition with the state machine, without replaying its deltas.
+
+        Given the state the cases enter the partition with, the outcome of every event is known, and
+        the status after each event is the last decisive outcome (forward filled per case). The sleep
+        check flags a case at the first delta of an idle span whose reference time passes its last
+        event time by more than `max_days`, unless its last event settled it; these flags are decisive
+        outcomes too. All cases of the partition are evaluated at once with NumPy operations.
+
+        :return: The delta reports of the partition.
+        """
+        machine = self.machine
+        events, cases = partition.events, partition.cases
+        n_before = machine.n_cases
+        delta_offset = len(machine.delta_names)
+        n_deltas = len(partition.delta_names)
+        event_codes = machine.encode_events(partition.event_names)
+        state_codes = machine.encode_states(partition.state_names)
+        case_positions = machine.case_index.get_indexer(partition.case_ids)
+        unseen = np.flatnonzero(case_positions == -1)
+        case_positions[unseen] = machine.add_cases(partition.case_ids[unseen])
+
+        # Outcome and flags of every event given the coverage of its case at the start of the partition
+        position = case_positions[events["case"].to_numpy()]
+        delta = events["delta"].to_numpy()
+        times = events["time"].to_numpy()
+        cancelled = events["cancelled"].to_numpy()
+        new_case = position >= n_before
+        missing = events["missing"].to_numpy()
+        incoming = np.where(new_case, 0, machine.coverage[position]).astype(np.uint8)
+        covered = (incoming & missing) == missing
+        initialised = new_case & events["first"].to_numpy()
+        outcome = events["outcome"].to_numpy()
+        outcome = np.where(outcome < 0, np.where(covered, COMPLETE, -1), outcome)
+        outcome = np.where(initialised, np.where(cancelled, COMPLETE, ONGOING), outcome).astype(np.int8)
+        flags = np.where(initialised, np.where(cancelled, F_CANCELLED, 0) | F_ONGOING,
+                         NEXT_FLAGS[events["state_class"].to_numpy(), cancelled.astype(np.int8),
+                                    covered.astype(np.int8)]).astype(np.uint8)
+
+        # Sleep check: idle spans before the first event of the cases registered earlier and after
+        # every event; the reference time of each delta includes the deltas merged before
+        reference = np.maximum(partition.latest, NO_TIME if machine.reference_time is None else machine.reference_time)
+        threshold = reference.copy()
+        threshold[reference != NO_TIME] -= machine.max_idle
+        until = np.full(n_before, n_deltas)
+        known = case_positions < n_before
+        until[case_positions[known]] = cases["first_delta"].to_numpy()[known]
+        waiting = np.flatnonzero((machine.flags[:n_before] & (F_COMPLETE | F_CANCELLED | F_SLEPT)) == 0)
+        unsettled = (flags & (F_COMPLETE | F_CANCELLED)) == 0
+        span_position = np.concatenate([waiting, position[unsettled]])
+        span_start = np.concatenate([np.zeros(len(waiting), dtype=np.int64), delta[unsettled]])
+        span_end = np.concatenate([until[waiting], events["next_delta"].to_numpy()[unsettled]])
+        span_time = np.concatenate([machine.last_time[waiting], times[unsettled]])
+        sleep_delta = np.maximum(span_start, np.searchsorted(threshold, span_time, side="right"))
+        slept = sleep_delta < span_end
+        sleep_order = np.lexsort((span_position[slept], sleep_delta[slept]))
+        sleep_position, sleep_delta = span_position[slept][sleep_order], sleep_delta[slept][sleep_order]
+
+        # Events and sleep flags of each case in the order the sequential state machine applies them
+        n_events, n_sleeps = len(events), len(sleep_position)
+        item_position = np.concatenate([position, sleep_position])
+        item_delta = np.concatenate([delta, sleep_delta])
+        item_sleep = np.concatenate([np.zeros(n_events, dtype=bool), np.ones(n_sleeps, dtype=bool)])
+        item_rank = np.concatenate([events["rank"].to_numpy(), np.zeros(n_sleeps, dtype=np.int64)])
+        item_order = np.concatenate([np.arange(n_events), sleep_position])
+        item_outcome = np.concatenate([outcome, np.full(n_sleeps, INCOMPLETE, dtype=np.int8)])
+        order = np.lexsort((item_order, item_rank, item_sleep, item_delta))
+        grouped = order[np.argsort(item_position[order], kind="stable")]
+
+        cases_of = item_position[grouped]
+        starts = np.ones(len(grouped), dtype=bool)
+        starts[1:] = cases_of[1:] != cases_of[:-1]
+        ends = np.ones(len(grouped), dtype=bool)
+        ends[:-1] = starts[1:]
+        status = item_outcome[grouped]
+        seeded = starts & (status < 0)
+        status[seeded] = machine.status[cases_of[seeded]]
+        status = status[np.maximum.accumulate(np.where(status >= 0, np.arange(len(status)), 0))]
+        previous = np.empty_like(status)
+        previous[1:] = status[:-1]
+        previous[starts] = machine.status[cases_of[starts]]
+
+        processed = np.empty(len(order), dtype=np.int64)
+        processed[order] = np.arange(len(order))
+        changed = (status != previous) & ~np.concatenate([initialised, np.zeros(n_sleeps, dtype=bool)])[grouped]
+        changed = np.flatnonzero(changed)
+        changed = changed[np.argsort(processed[grouped[changed]])]
+        if len(changed):
+            machine.transitions.append((cases_of[changed], previous[changed], status[changed],
+                                        (delta_offset + item_delta[grouped[changed]]).astype(np.int32),
+                                        item_sleep[grouped[changed]]))
+
+        event_status = np.empty(n_events, dtype=np.int8)
+        is_event = grouped < n_events
+        event_status[grouped[is_event]] = status[is_event]
+
+        # Delta reports from the status after the last event of every touched case in each delta
+        rows = np.flatnonzero(events["row_end"].to_numpy())
+        row_initialised = new_case[rows] & (delta[rows] == cases["first_delta"].to_numpy()[events["case"].to_numpy()[rows]])
+        row_bounds = np.searchsorted(delta[rows], np.arange(n_deltas + 1))
+        sleep_bounds = np.searchsorted(sleep_delta, np.arange(n_deltas + 1))
+        reports = []
+        for k, delta_name in enumerate(partition.delta_names):
+            touched = rows[row_bounds[k]:row_bounds[k + 1]]
+            reports.append(delta_report(delta_name, partition.event_counts[k], machine.case_index, position[touched],
+                                        event_status[touched], cancelled[touched],
+                                        row_initialised[row_bounds[k]:row_bounds[k + 1]],
+                                        sleep_position[sleep_bounds[k]:sleep_bounds[k + 1]]))
+
+        # Combine the case summaries with the state arrays; a sleep flag after the last event settles the case
+        machine.delta_names.extend(partition.delta_names)
+        if reference[-1] != NO_TIME:
+            machine.reference_time = int(reference[-1])
+        machine.first_delta[case_positions[unseen]] = delta_offset + cases["first_delta"].to_numpy()[unseen]
+        machine.last_delta[case_positions] = delta_offset + cases["last_delta"].to_numpy()
+        machine.coverage[case_positions] |= cases["coverage"].to_numpy()
+        machine.last_state[case_positions] = state_codes[cases["last_state"].to_numpy()]
+        machine.last_event[case_positions] = event_codes[cases["last_event"].to_numpy()]
+        machine.last_time[case_positions] = cases["last_event_time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        machine.flags[case_positions] = flags[cases["last_row"].to_numpy()]
+        machine.status[cases_of[ends]] = status[ends]
+        final_sleep = cases_of[ends & item_sleep[grouped]]
+        machine.flags[final_sleep] = (machine.flags[final_sleep] & ~np.uint8(F_ONGOING)) | F_SLEPT
+
+        self.merge_case_summary(cases, case_positions)
+        return reports
+
+    def merge_case_summary(self, summary: pd.DataFrame, positions):
+        """
+        Fold the case summary of the next partition into the run: first times are kept from the
+        earliest partition of a case, last times come from the latest one and event counts add up.
+        """
+        n_new = self.machine.n_cases - len(self.event_counts)
+        self.first_event_times = np.concatenate([self.first_event_times, np.full(n_new, np.datetime64("NaT", "ns"))])
+        self.last_event_times = np.concatenate([self.last_event_times, np.full(n_new, np.datetime64("NaT", "ns"))])
+        self.event_counts = np.concatenate([self.event_counts, np.zeros(n_new, dtype=np.int64)])
+
+        first_event_times = self.first_event_times[positions]
+        unseen = np.isnat(first_event_times)
+        first_event_times[unseen] = summary["first_event_time"].to_numpy(dtype="datetime64[ns]")[unseen]
+        self.first_event_times[positions] = first_event_times
+        self.last_event_times[positions] = summary["last_event_time"].to_numpy(dtype="datetime64[ns]")
+        self.event_counts[positions] += summary["events"].to_numpy()
+
+    def run(self):
+        """
+        Split the event log if needed and classify every delta.
+
+        :return: (delta reports in processing order, case frame of `BatchStateMachine.to_frame` with the
+                 first and last event time and number of events of every case).
+        """
+        from process import ProcessManager
+
+        start_time = time.time()
+        process_manager = ProcessManager(config=self.config)
+        process_manager.check_or_split_logs()
+        process_manager.cases.close()
+
+        initial_log_path, delta_logs = list_delta_logs(self.config.delta_log_dir)
+        partitions = partition_log_files([(initial_log_path, "initial_log")] + delta_logs, self.n_partitions)
+        reports = []
+        with ProcessPoolExecutor(max_workers=min(self.n_workers, len(partitions))) as pool:
+            for partition in pool.map(summarise_partition, partitions):
+                reports.extend(self.merge_partition(partition))
+
+        cases = self.machine.to_frame().assign(first_event_time=self.first_event_times,
+                                               last_event_time=self.last_event_times, events=self.event_counts)
+        print(f"[PARTITIONED REPLAY] {len(reports)} deltas in {len(partitions)} partitions with "
+              f"{self.n_workers} workers: {time.time() - start_time:.2f} seconds")
+        return reports, cases
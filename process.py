@@ -1,64 +1,118 @@
 import os
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 import time
-from delta_log_formation import EventLogSplitter
+from delta_log_formation import EventLogSplitter, list_delta_logs
 from case import Case
-from delta import Delta
-from evaluation import evaluate, calculate_weighted_metrics, avg_cm_per_delta
-from config import (
-    event_log_path, cases_output_path, delta_output_path,
-    max_days, evaluation_output_path
-)
+from delta import Delta, delta_label
+from variant_trie import VariantTrie
+from case_store import CaseTable
+from case_db import CaseDatabase
+from case_export import CaseExporter, DEFAULT_COLUMNS
+from sampler import StratifiedSampler, export_sample
+from late_events import LateEventIndex, replay_case, sleep_positions
+from case_index import CaseIndex
+from sketches import QuantileSketch, DeltaSketches
+from delta_stats import DeltaStatsWriter, read_delta_stats
+from config import RunConfig
 
 
 class ProcessManager:
-    def __init__(self, initial_months, frequency, delta_log_dir):
-        self.cases = {}
-        self.delta_stats_list = []
-        self.delta_log_dir = delta_log_dir
-        self.delta_counts = pd.DataFrame(columns=["case_id", "count"]).set_index("case_id")
-        self.initial = initial_months
-        self.frequency = frequency
-        self.event_log_path = event_log_path
-        self.cases_output_path = cases_output_path
-        self.delta_output_path = delta_output_path
-        self.evaluation_output_path = evaluation_output_path
+    def __init__(self, initial_months=None, frequency=None, delta_log_dir=None, config: RunConfig = None):
+        """
+        :param initial_months: Number of months in the initial log.
+        :param frequency: Splitting frequency of the delta logs.
+        :param delta_log_dir: Directory of the delta logs.
+        :param config: Full run configuration; when given, the other arguments are ignored.
+        """
+        if config is None:
+            arguments = {"initial_months": initial_months, "frequency": frequency, "delta_log_dir": delta_log_dir}
+            config = RunConfig(**{key: value for key, value in arguments.items() if value is not None})
+        self.config = config
+        if config.approximate_delta_stats and config.late_event_watermark is not None:
+            raise ValueError("Approximate delta statistics cannot be revised by late events; "
+                             "turn off approximate_delta_stats or late_event_watermark.")
+
+        self.variants = VariantTrie()
+        self.cases = CaseTable(self.variants, config.case_memory_budget, config.case_store_path)
+        self.database = CaseDatabase(config.case_db_path, reset=True) if config.case_db_path else None
+        self.delta_stats_writer = None
+        # Reports of the deltas by position and the typed case table, kept in memory when they are not
+        # saved or when `keep_results` is set (api.py)
+        self.keep_results = False
+        # Progress bars and messages; the in-memory API (api.py) turns them off unless asked for
+        self.progress = True
+        self.delta_reports = {}
+        self.case_table = None
+        self.delta_position = 0
+        self.late_events = (None if config.late_event_watermark is None
+                            else LateEventIndex(config.late_event_watermark, variants=self.variants))
+        self.last_delta_report = None
+        self.wait_time_sketch = QuantileSketch()
+        self.completion_time_sketch = QuantileSketch()
+        # Approximate mode: the delta sketches merged over the run
+        self.delta_sketches = DeltaSketches() if config.approximate_delta_stats else None
+        self.delta_log_dir = config.delta_log_dir
+        # Last event time of every case that is not finalised and the latest event time processed, for
+        # the sleep check; finalised cases leave it, so it tracks the active cases like `CaseTable`
+        self.open_cases = {}
+        self.reference_time = None
+        self.initial = config.initial_months
+        self.frequency = config.frequency
+        self.max_days = config.max_days
+        self.event_log_path = config.event_log_path
+        self.cases_output_path = config.cases_output_path
+        self.delta_output_path = config.delta_output_path
+        self.evaluation_output_path = config.evaluation_output_path
+        self.first_event_time = None
+        self.on_first_event = None
 
     # ===================== Helper Functions ===================== #
-    def increment_delta_counts(self):
-        """Increment delta counts for all cases."""
-        self.delta_counts["count"] += 1
-
-    def reset_case_count(self, case_id):
-        """Reset the delta count for a specific case."""
-        self.delta_counts.loc[case_id, "count"] = 0
-
-    def add_case_to_delta_counts(self, case_id):
-        """Add a new case to the delta counts DataFrame."""
-        temp_df = pd.DataFrame({"case_id": [case_id], "count": [0]}).set_index("case_id")
-        self.delta_counts = pd.concat([self.delta_counts, temp_df])
-
-    def perform_sleep_check(self, limit: int, delta_name: str):
-        """Flag cases as sleep based on the delta count limit."""
-        sleep_ids = set(self.delta_counts[(self.delta_counts["count"] > limit)].index)
+    def log(self, message):
+        """Print a progress message, unless progress output is turned off."""
+        if self.progress:
+            print(message)
+
+    def perform_sleep_check(self, delta_name: str):
+        """
+        Flag cases as sleep when more than `max_days` passed between their last event and the last
+        event processed so far. Time is measured on the events, so the check is the same for every
+        kind of delta window, whatever time one delta spans.
+        """
+        if self.reference_time is None:
+            return set()
+        cutoff = self.reference_time - pd.Timedelta(days=self.max_days)
+        sleep_ids = [case_id for case_id, last_event_time in self.open_cases.items() if last_event_time < cutoff]
         inc_cases = set()
         for case_id in sleep_ids:
-            case = self.cases.get(case_id)
-            # Ignore the cases that are already classified as complete, cancelled or incomplete
-            if not (case.complete or case.cancelled or case.incomplete):
-                self.log_incomplete_cases(case, inc_cases)
-                case.run_function_and_update_status(delta_name, case.final_status, case.update_sleep())
+            # Only cases that are not complete, cancelled or incomplete are open, and those are never spilled
+            case = self.cases.get_resident(case_id)
+            if self.late_events is not None:
+                self.late_events.before_change(case_id, case)
+            self.log_incomplete_cases(case, inc_cases)
+            case.run_function_and_update_status(delta_name, case.final_status, case.update_sleep())
+            del self.open_cases[case_id]
         return inc_cases
     def update_case_or_initialize(self, event, delta_name, delta):
         """Update an existing case or initialize a new one."""
         case_id = event.get("case")
-        if self.cases.get(case_id) is None:
-            self.cases[case_id] = Case(event, delta_name, delta)
-            self.add_case_to_delta_counts(case_id)
+        case = self.cases.get(case_id)
+        if self.late_events is not None:
+            self.late_events.before_change(case_id, case)
+        if case is None:
+            self.cases[case_id] = Case(event, delta_name, delta, self.variants)
         else:
-            self.cases[case_id].update(event, delta, self.delta_counts)
-            self.reset_case_count(case_id)
+            case.update(event, delta)
+
+    def update_open_cases(self, case_ids):
+        """Track the last event time of updated cases for the sleep check, while they are not finalised."""
+        for case_id in case_ids:
+            case = self.cases.get(case_id)
+            if case.complete or case.cancelled or case.incomplete:
+                self.open_cases.pop(case_id, None)
+            else:
+                self.open_cases[case_id] = case.last_event_time
 
     def log_incomplete_cases(self, case: Case, inc_cases: set):
         case_id = case.case_id
@@ -68,127 +122,385 @@ class ProcessManager:
     # ===================== Core Functions ===================== #
 
     def check_or_split_logs(self):
-        """Check if delta logs exist; if not, split the event log."""
+        """Check if delta logs exist; if not, split the event log, and if the event log grew, split its new rows."""
+        splitter = EventLogSplitter.from_config(self.config)
         if not os.path.exists(self.delta_log_dir):
-            print(f"Splitting event log into {self.frequency} delta logs...")
-            splitter = EventLogSplitter(self.event_log_path, self.frequency, self.initial)
+            self.log(f"Splitting event log into {self.frequency} delta logs...")
             splitter.run_splitting()
-            print(f"Splitting completed. Logs saved in {self.delta_log_dir}.")
+            self.log(f"Splitting completed. Logs saved in {self.delta_log_dir}.")
+        elif os.path.exists(self.event_log_path):
+            splitter.update()
         else:
-            print(f"{self.frequency.capitalize()} delta logs already exist in {self.delta_log_dir}. Skipping splitting.")
+            self.log(f"{self.frequency.capitalize()} delta logs already exist in {self.delta_log_dir}. Skipping splitting.")
 
 
 
     def save_delta_statistics(self):
-        """Save delta-level statistics to a CSV file."""
-        delta_df = pd.DataFrame(self.delta_stats_list)
-        delta_df.to_csv(self.delta_output_path, index=False)
-        print(f"Delta Statistics saved to: {self.delta_output_path}")
-        return delta_df
-
-    def save_case_statistics(self):
+        """Close the delta statistics file; every report was already written as its delta was processed."""
+        if self.late_events is not None:
+            self.merge_run_sketches(self.late_events.close_window())
+        if self.delta_stats_writer is not None:
+            self.delta_stats_writer.close()
+            self.log(f"Delta Statistics ({self.delta_stats_writer.deltas_written} deltas) saved to: {self.delta_output_path}")
+
+        for name, sketch in (("Wait Time", self.wait_time_sketch), ("Completion Time", self.completion_time_sketch)):
+            if sketch.count:
+                quantiles = ", ".join(f"p{round(q * 100)}: {sketch.quantile(q) / 86400:.2f}" for q in (0.5, 0.9, 0.99))
+                self.log(f"{name} (days) - {quantiles}")
+        if self.delta_sketches is not None:
+            summary = self.delta_sketches.summary()
+            self.log(f"Distinct cases (approximate): {summary['cases_processed']} "
+                     f"(± {summary['case_count_error']:.1%} standard error); top events: "
+                     + ", ".join(f"{top['event']} {top['count']}" for top in summary["top_events"][:5]))
+
+    def top_variants(self, status="INCOMPLETE", n=10):
+        """Most frequent trace variants among the cases with the given final status."""
+        nodes = (case.trace_node for case in self.cases.values() if case.final_status == status)
+        return self.variants.top_variants(nodes, n)
+
+    def save_case_statistics(self, with_traces=True):
         """Save case-level statistics to a CSV file."""
-        case_dict = {case_id: vars(case_obj) for case_id, case_obj in self.cases.items()}
-        case_df = pd.DataFrame.from_dict(case_dict, orient="index").drop(["critical_events", "t_since_last_event","rejected_events"], axis=1)
-        case_df["completion_time"] = case_df["last_event_time"] - case_df["first_event_time"]
-
-        processed_cases = len(case_df)
-        cancelled_cases = case_df[case_df["cancelled"]]
-        completed_cases = case_df[(case_df["final_status"] == "COMPLETE")]
-        ongoing_cases = case_df[(case_df["final_status"] == "ONGOING")]
-        incomplete_cases = case_df[(case_df["final_status"] == "INCOMPLETE")]
-
-
-        print(f"Number of Cases Processed: {processed_cases}")
-        print(f"Number of Cancelled Cases: {len(cancelled_cases)}")
-        print(f"Number of Complete Cases: {len(completed_cases)}")
-        print(f"Number of Ongoing Cases: {len(ongoing_cases)}")
-        print(f"Number of Incomplete Cases: {len(incomplete_cases)}")
-
-        print(f"Ratio of Complete cases: {((len(completed_cases) / processed_cases) * 100):.2f}%\n")
-
-        case_df.to_csv(self.cases_output_path, index=True)
-        print(f"Final Results saved to: {self.cases_output_path}")
+        columns = [column for column in self.config.case_output_columns or DEFAULT_COLUMNS
+                   if with_traces or column != "trace"]
+        cases_output_path = self.cases_output_path if "cases_output" in self.config.saved_outputs else None
+        exporter = CaseExporter(cases_output_path, columns, self.variants, keep_frame=self.keep_results)
+        observers, sampler, case_index = [], None, None
+        if self.config.sample_output_dir is not None:
+            sampler = StratifiedSampler(self.config.sample_size, self.config.random_seed)
+            observers.append(lambda case_id, case: sampler.offer_case(case, self.variants))
+        if self.config.case_index:
+            case_index = CaseIndex(self.delta_log_dir)
+            observers.append(case_index.add_status_changes)
+        case_df = exporter.export(self.observe_cases(self.cases.items(), observers))
+        summary = exporter.summary
+        self.case_table = exporter.frame
+
+        self.log(f"Number of Cases Processed: {summary['processed']}")
+        self.log(f"Number of Cancelled Cases: {summary['cancelled']}")
+        self.log(f"Number of Complete Cases: {summary['complete']}")
+        self.log(f"Number of Ongoing Cases: {summary['ongoing']}")
+        self.log(f"Number of Incomplete Cases: {summary['incomplete']}")
+
+        self.log(f"Ratio of Complete cases: {((summary['complete'] / summary['processed']) * 100):.2f}%\n")
+        if cases_output_path is not None:
+            self.log(f"Final Results saved to: {self.cases_output_path}")
+
+        # The case index is saved first, so that the sample reads its events through it
+        if case_index is not None:
+            self.save_case_index(case_index)
+        if sampler is not None:
+            export_sample(sampler.sample(), self.event_log_path, self.config.sample_output_dir,
+                          os.path.basename(os.path.normpath(self.delta_log_dir)), delta_log_dir=self.delta_log_dir)
         return case_df
 
-    def perform_evaluation(self, delta_stats, case_stats):
+    def observe_cases(self, items, observers):
+        """Pass the cases through, handing each one to the observers (sampler, case index) on the way."""
+        for case_id, case in items:
+            for observer in observers:
+                observer(case_id, case)
+            yield case_id, case
+
+    def save_case_index(self, case_index: CaseIndex):
+        """Store the status changes of this run in the case index, updating its event part if needed."""
+        case_index.refresh()
+        case_index.save_status_changes({"event_log_path": self.event_log_path, "frequency": self.frequency,
+                                        "initial_months": self.initial, "max_days": self.max_days,
+                                        "late_event_watermark": self.config.late_event_watermark})
+        case_index.close()
+        self.log(f"Status changes stored in the case index: {case_index.path}")
+
+    def perform_evaluation(self, case_stats):
         """Perform evaluation of completeness detection."""
+        # Imported here so that plotting libraries are only loaded once a run is evaluated
+        from evaluation import evaluate, calculate_weighted_metrics, avg_cm_per_delta, EVALUATION_COLUMNS
+
+        if self.config.approximate_delta_stats:
+            self.log("Evaluation skipped: approximate delta statistics hold no case ids to evaluate.")
+            return None, {}
+        # The delta reports are streamed back from disk one at a time, unless they were kept in memory
+        if "delta_stats" in self.config.saved_outputs and not self.keep_results:
+            delta_stats = read_delta_stats(self.delta_output_path, EVALUATION_COLUMNS)
+        else:
+            delta_stats = (self.delta_reports[position] for position in sorted(self.delta_reports))
         evaluation_df = evaluate(delta_stats, case_stats)
-        evaluation_df.to_csv(self.evaluation_output_path, index=True)
+        if "evaluation" in self.config.saved_outputs:
+            os.makedirs(os.path.dirname(self.evaluation_output_path) or ".", exist_ok=True)
+            evaluation_df.to_csv(self.evaluation_output_path, index=True)
 
         weighted_metrics = calculate_weighted_metrics(evaluation_df)
         for metric, value in weighted_metrics.items():
-            print(f"{metric}: {value:.2f}")
-
-        avg_cm_per_delta(evaluation_df, "VIS/confusion_matrix.png")
-
-    def process_logs(self, path, delta_name, limit):
+            self.log(f"{metric}: {value:.2f}")
+
+        if self.config.confusion_matrix_path is not None:
+            avg_cm_per_delta(evaluation_df, self.config.confusion_matrix_path)
+        return evaluation_df, weighted_metrics
+
+    def new_delta(self, delta_name, position=None):
+        delta = Delta(delta_name, position, DeltaSketches() if self.config.approximate_delta_stats else None)
+        if delta.sketches is None:
+            delta.case_info = {
+                "not_finished": set(),
+                "complete": set(),
+                "incomplete": set(),
+                "cancelled": set()
+            }
+        # Deltas that late events can revise keep the extremes of every case
+        if self.late_events is not None:
+            delta.track_extremes()
+        return delta
+
+    def merge_run_sketches(self, deltas):
+        """Add the wait and completion times of final deltas to the distributions of the run."""
+        for delta in deltas:
+            self.wait_time_sketch.merge(delta.wait_time_sketch)
+            self.completion_time_sketch.merge(delta.completion_time_sketch)
+            if delta.sketches is not None:
+                self.delta_sketches.merge(delta.sketches)
+
+    def write_delta_report(self, position, delta, revision=0):
+        """Write the report of a delta; revisions of earlier deltas are appended with a higher revision number."""
+        report = {"delta_index": position, "revision": revision, **delta.generate_report(self.variants)}
+        if self.late_events is not None:
+            applied, dropped = self.late_events.late_counts.get(position, (0, 0))
+            report["late_events_applied"] = applied
+            report["late_events_dropped"] = dropped
+        if self.keep_results or "delta_stats" not in self.config.saved_outputs:
+            self.delta_reports[position] = report
+        if "delta_stats" in self.config.saved_outputs:
+            if self.delta_stats_writer is None:
+                self.delta_stats_writer = DeltaStatsWriter(self.delta_output_path)
+            self.delta_stats_writer.write(report)
+        if self.database is not None:
+            self.database.write_delta(report)
+        return report
+
+    # ===================== Late Events ===================== #
+    def late_event_periods(self):
+        """
+        Delta label of the period of event times, as the splitter names the delta logs; None for
+        deltas cut by event count, whose names depend on the events before them.
+        """
+        if self.config.max_delta_events is not None:
+            return None
+        splitter = EventLogSplitter.from_config(self.config)
+        splitter.initial_cutoff = self.first_complete_time(splitter) + pd.DateOffset(months=self.initial)
+
+        def period_of(times):
+            names = splitter.delta_names(pd.Series(times.astype("datetime64[ns]")), splitter.initial_cutoff)
+            return names.map(delta_label).to_numpy(dtype=str)
+        return period_of
+
+    def first_complete_time(self, splitter):
+        """
+        First `completeTime` of the split event log, from the split manifest or, when the delta logs
+        arrived without one, from the initial log, which holds the first events of the log.
+        """
+        manifest = splitter.load_manifest()
+        if manifest is not None:
+            return pd.Timestamp(manifest["first_complete_time"])
+        initial_log_path, _ = list_delta_logs(self.delta_log_dir)
+        if initial_log_path is None:
+            raise ValueError(f"The late-event mode needs the initial log or {os.path.basename(splitter.manifest_path)} "
+                             f"in {self.delta_log_dir} to name the period of an event.")
+        return pd.to_datetime(pd.read_csv(initial_log_path, usecols=["completeTime"])["completeTime"]).min()
+
+    def apply_late_events(self, event_log, position):
+        """
+        Separate the late events of a delta log and apply those within the watermark.
+
+        Late events are added to the dependency index under the delta they belong to, and the
+        cases they affect are replayed. The reports of the deltas whose statistics changed are
+        written again as revisions. Only the affected cases are replayed, from their own events.
+
+        A late event later than every event processed up to its delta moves the reference time
+        of the sleep check of that delta (and of the later ones it exceeds). Cases that this can
+        flag earlier, the open ones past `max_days` and those changed since, are replayed as well
+        and revised when their sleep checks come out differently.
+
+        :return: The on-time events in time order, and their times in nanoseconds.
+        """
+        index = self.late_events
+        times = pd.to_datetime(event_log["completeTime"]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+        case_ids = event_log["case"].to_numpy()
+        rows = np.arange(len(event_log))
+
+        late, target = index.classify(times)
+        accepted = late & (position - target <= index.watermark)
+        index.late_counts[position] = (int(accepted.sum()), int((late & ~accepted).sum()))
+
+        affected = pd.unique(case_ids[accepted])
+        old_histories = {case_id: index.history(case_id) for case_id in affected}
+        index.add_events(case_ids[accepted], target[accepted], times[accepted], rows[accepted])
+        old_times = self.sleep_reference_times()
+        raised_from = index.raise_max_times(target[accepted], times[accepted])
+        sleep_candidates = []
+        if raised_from is not None:
+            self.reference_time = max(self.reference_time, pd.Timestamp(index.max_times[-1]))
+            cutoff = self.reference_time - pd.Timedelta(days=self.max_days)
+            sleep_candidates = ({case_id for case_id, last_event_time in self.open_cases.items()
+                                 if last_event_time < cutoff} | index.cases_changed_since(raised_from)) - set(affected)
+        if len(affected) or sleep_candidates:
+            self.replay_cases(affected, old_histories, position, old_times, raised_from, sorted(sleep_candidates))
+
+        on_time = rows[~late][np.argsort(times[~late], kind="stable")]
+        index.add_events(case_ids[on_time], np.full(len(on_time), position), times[on_time], on_time)
+        return event_log.iloc[on_time], times[on_time]
+
+    def sleep_reference_times(self):
+        """Last event time processed up to each delta, for the sleep check of replays."""
+        return [pd.Timestamp(latest) for latest in self.late_events.max_times], pd.Timedelta(days=self.max_days)
+
+    def replay_cases(self, case_ids, old_histories, position, old_times, raised_from=None, sleep_candidates=()):
+        """
+        Replay cases with new late events and revise the deltas up to the current one.
+
+        :param old_times: `sleep_reference_times` before the late events, which the current reports were checked with.
+        :param raised_from: First delta position whose reference time the late events moved, if any.
+        :param sleep_candidates: Cases without late events whose sleep checks may change from `raised_from` on;
+                                 they are only revised when they do.
+        """
+        index = self.late_events
+        histories = {case_id: index.history(case_id) for case_id in [*case_ids, *sleep_candidates]}
+        events = index.read_events([entry for history in histories.values() for entry in history])
+        new_times = self.sleep_reference_times()
+        revised = set()
+
+        for case_id in [*case_ids, *sleep_candidates]:
+            history = histories[case_id]
+            old_history = old_histories.get(case_id, history)
+            changes = [entry[0] for entry in set(history) - set(old_history)]
+            first_changed = min(changes + ([] if raised_from is None else [raised_from]))
+            index.before_change(case_id, self.cases.get(case_id))
+            replays, states = [], {}
+            # Both histories are replayed from the same checkpoint; only the new one records its states
+            for entries, times, replay_states in ((old_history, old_times, None), (history, new_times, states)):
+                checkpoint = index.checkpoint(case_id, first_changed)
+                replay_events = [(entry[0], events[(entry[2], entry[3])]) for entry in entries
+                                 if entry[0] > checkpoint[0]]
+                replays.append(replay_case(checkpoint, replay_events, index.delta_names, position - 1, self.variants,
+                                           self.new_delta, times, replay_states))
+            (_, old_contributions), (case, contributions) = replays
+            if not changes and sleep_positions(old_contributions) == sleep_positions(contributions):
+                continue
+            index.revise_states(case_id, first_changed, states)
+
+            # Contributions before the earliest late event are identical and left untouched
+            for changed in range(first_changed, position):
+                for contribution, sign in ((old_contributions.get(changed), -1), (contributions.get(changed), 1)):
+                    if contribution is None:
+                        continue
+                    index.window[changed].add_contribution(contribution, sign)
+                    revised.add(changed)
+
+            self.cases[case_id] = case
+            self.update_open_cases([case_id])
+
+        for changed in sorted(revised):
+            index.revisions[changed] += 1
+            self.write_delta_report(changed, index.window[changed], index.revisions[changed])
+
+    # ===================== Processing ===================== #
+    def process_logs(self, path, delta_name):
         """Process events in a single delta log."""
         event_log = pd.read_csv(path, keep_default_na=False, na_values=['NaN', "", " "])
-        delta = Delta(delta_name)
+        self.process_events(event_log, delta_name, path)
+
+    def process_events(self, event_log, delta_name, path=None):
+        """
+        Process the events of one delta, read from its delta log or handed over in memory (api.py).
+
+        :param path: Delta log the events were read from; the late-event mode needs it to read them again.
+        """
+        position = self.delta_position
+        delta = self.new_delta(delta_name, position)
+        self.delta_position += 1
+        if self.late_events is not None:
+            self.late_events.start_delta(path, delta_name)
+            event_log, on_time_times = self.apply_late_events(event_log, position)
         cases_processed = event_log["case"].unique()
-        delta.case_info = {
-            "not_finished": set(),
-            "complete": set(),
-            "incomplete": set(),
-            "cancelled": set()
-        }
-
-        self.increment_delta_counts()
+        if delta.sketches is not None:
+            delta.process_events(event_log["case"].to_numpy(), event_log["event"].to_numpy())
+        if len(event_log):
+            latest = pd.to_datetime(event_log["completeTime"]).max()
+            self.reference_time = latest if self.reference_time is None else max(self.reference_time, latest)
+
         # Process each event
-        for _, event in tqdm(event_log.iterrows(), total=len(event_log), desc=f"Processing events for {delta_name}"):
+        for _, event in tqdm(event_log.iterrows(), total=len(event_log), desc=f"Processing events for {delta_name}",
+                             disable=not self.progress):
+            if self.first_event_time is None:
+                self.first_event_time = time.time()
+                if self.on_first_event is not None:
+                    self.on_first_event(self.first_event_time)
             self.update_case_or_initialize(event, delta_name, delta)
             case = self.cases.get(event.get("case"))
             case.check_missing_attributes(event)
 
         # Update delta attributes for processed cases
-        for case_id in tqdm(cases_processed, desc=f"Updating delta attributes for {delta_name}"):
+        for case_id in tqdm(cases_processed, desc=f"Updating delta attributes for {delta_name}",
+                            disable=not self.progress):
             case = self.cases.get(case_id)
             delta.process_case_status(case)
+        self.update_open_cases(cases_processed)
+
+        incomplete_cases = self.perform_sleep_check(delta_name)
+        delta.add_incomplete(incomplete_cases)
+        if self.late_events is not None:
+            for case_id in set(cases_processed) | incomplete_cases:
+                self.late_events.save_state(case_id, position, self.cases.get(case_id))
+        self.cases.spill()
+
+        self.last_delta_report = self.write_delta_report(position, delta)
+        # The run distributions only take deltas that late events can no longer revise
+        if self.late_events is not None:
+            self.merge_run_sketches(self.late_events.finish_delta(position, delta, on_time_times))
+        else:
+            self.merge_run_sketches([delta])
 
-        incomplete_cases = self.perform_sleep_check(limit, delta_name)
-        delta.case_info["incomplete"] = incomplete_cases
-        delta.incomplete_cases = delta.case_info["incomplete"]
-
-        self.delta_stats_list.append(delta.generate_report())
+    def iter_process_logs(self):
+        """
+        Split the event log if needed and process the initial log and every delta log in order.
 
-    def run(self):
-        """Run the entire process pipeline."""
-        start_time = time.time()
+        Yields the name of each log once it has been processed, so that callers (e.g. the
+        multi-log scheduler) can interleave several runs delta by delta.
+        """
         self.check_or_split_logs()
-
-        initial_log_path = None
-        delta_logs = []
-        delta_limits = {
-            "daily": max_days,
-            "weekly": round(max_days / 7),
-            "monthly": round(max_days / 30)
-        }
-        limit = delta_limits[self.frequency]
+        if self.late_events is not None:
+            self.late_events.period_of = self.late_event_periods()
 
         # Identify logs
-        for file_name in os.listdir(self.delta_log_dir):
-            file_path = os.path.join(self.delta_log_dir, file_name)
-            if "initial_log" in file_name:
-                initial_log_path = file_path
-            elif "delta_log" in file_name:
-                delta_logs.append((file_path, file_name))
+        initial_log_path, delta_logs = list_delta_logs(self.delta_log_dir)
 
         # Process logs
-        print(f"[PROCESS MANAGER] Limit for delta updates is set to: {limit}")
-        print("[PROCESS MANAGER] Processing initial log file...")
-        self.process_logs(initial_log_path, "initial_log", limit=limit)
+        self.log(f"[PROCESS MANAGER] Cases without events for more than {self.max_days} days are flagged incomplete")
+        self.log("[PROCESS MANAGER] Processing initial log file...")
+        self.process_logs(initial_log_path, "initial_log")
+        yield "initial_log"
         for file, delta_name in delta_logs:
-            self.process_logs(file, delta_name, limit=limit)
-
+            self.process_logs(file, delta_name)
+            yield delta_name
 
-        # Save results and evaluate
-        delta_stats = self.save_delta_statistics()
+    def finalise(self, start_time=None):
+        """Save results and evaluate once every log has been processed."""
+        self.save_delta_statistics()
         case_stats = self.save_case_statistics()
+        if self.database is not None:
+            self.database.write_cases(self.cases.items())
+            self.log(f"Cases and deltas stored in: {self.config.case_db_path}")
 
-        end_time = time.time()
-        m,s = divmod((end_time - start_time), 60)
-        print(f"Run Time: {m} minutes {"%.2f" %s} seconds")
+        if start_time is not None:
+            end_time = time.time()
+            m,s = divmod((end_time - start_time), 60)
+            self.log(f"Run Time: {m} minutes {"%.2f" %s} seconds")
 
-        self.perform_evaluation(delta_stats, case_stats)
+        evaluation = self.perform_evaluation(case_stats)
+        self.cases.close()
+        if self.database is not None:
+            self.database.close()
+        return evaluation
 
+    def run(self):
+        """Run the entire process pipeline."""
+        start_time = time.time()
+        for _ in self.iter_process_logs():
+            pass
+        self.finalise(start_time)
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import dataclasses
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from config import RunConfig
+
+# Figure name -> (VisualizationManager method, input it is drawn from)
+FIGURES = {
+    "event_counts": ("plot_event_counts_line_chart", "delta_stats"),
+    "trace_classifications": ("plot_trace_classifications_across_deltas", "delta_stats"),
+    "case_status": ("plot_case_status_pie_chart", "case_stats"),
+    "incompleteness_reasons": ("plot_incompleteness_reasons", "case_stats"),
+    "missing_events": ("plot_missing_events", "case_stats"),
+    "complete_cases": ("plot_complete_cases_pie_chart", "case_stats"),
+    "incomplete_last_states": ("plot_incomplete_trace_last_states", "case_stats"),
+}
+MANIFEST_NAME = "manifest.json"
+
+
+def file_digest(path):
+    """SHA-256 of a file's content, so that rewriting identical outputs does not trigger a render."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def sweep_configs(base: RunConfig, months, frequencies):
+    """One configuration per (initial months, frequency) pair, with the output paths derived again."""
+    return [dataclasses.replace(base, initial_months=initial_months, frequency=frequency, delta_log_dir=None,
+                                cases_output_path=None, delta_output_path=None, evaluation_output_path=None)
+            for initial_months in months for frequency in frequencies]
+
+
+def report_dir_for(config: RunConfig, report_root):
+    return os.path.join(report_root, os.path.basename(os.path.normpath(config.delta_log_dir)))
+
+
+def render_run(config: RunConfig, report_dir, formats=("html",), focus_deltas=(), force=False):
+    """
+    Render every plot of one run to `report_dir`, skipping figures whose inputs are unchanged.
+
+    A figure is re-rendered when the content of the CSV it is drawn from, the focus deltas (for
+    delta plots) or the plotting code changed since the manifest entry of the file was written.
+    The outputs are only loaded if at least one figure needs to be rendered, and then once for all.
+
+    :return: Dictionary with the lists of rendered, skipped and missing output files.
+    """
+    # Headless: never open a window, whichever backend the environment configures
+    os.environ["MPLBACKEND"] = "Agg"
+    import visualize
+    import evaluation
+
+    os.makedirs(report_dir, exist_ok=True)
+    manifest_path = os.path.join(report_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    inputs = {"delta_stats": config.delta_output_path, "case_stats": config.cases_output_path,
+              "evaluation": config.evaluation_output_path}
+    digests = {name: file_digest(path) for name, path in inputs.items() if os.path.exists(path)}
+    code = {module.__name__: file_digest(module.__file__) for module in (visualize, evaluation)}
+    summary = {"report_dir": report_dir, "rendered": [], "skipped": [], "missing": []}
+
+    # Work out what is stale before loading anything
+    outputs = []
+    for name, (method, source) in FIGURES.items():
+        focus = sorted(focus_deltas) if source == "delta_stats" else []
+        key = fingerprint(name, digests.get(source), focus, code["visualize"])
+        for extension in formats:
+            outputs.append((f"{name}.{extension}", method, source, key))
+    outputs.append(("confusion_matrix.png", None, "evaluation", fingerprint(digests.get("evaluation"), code["evaluation"])))
+
+    pending = []
+    for file_name, method, source, key in outputs:
+        if source not in digests:
+            summary["missing"].append(file_name)
+        elif manifest.get(file_name) == key and os.path.exists(os.path.join(report_dir, file_name)):
+            summary["skipped"].append(file_name)
+        else:
+            pending.append((file_name, method, key))
+
+    plots = figures = None
+    for file_name, method, key in pending:
+        path = os.path.join(report_dir, file_name)
+        if method is None:
+            import pandas as pd
+
+            evaluation.avg_cm_per_delta(pd.read_csv(config.evaluation_output_path), path)
+        else:
+            if plots is None:
+                plots = visualize.VisualizationManager(config.delta_output_path, config.cases_output_path,
+                                                       list(focus_deltas))
+                figures = {}
+            # A figure written in several formats is built once
+            if method not in figures:
+                figures[method] = getattr(plots, method)(show=False)
+            if file_name.endswith(".html"):
+                figures[method].write_html(path, include_plotlyjs="directory")
+            else:
+                figures[method].write_image(path)
+        manifest[file_name] = key
+        summary["rendered"].append(file_name)
+
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    return summary
+
+
+def render_reports(configs, report_root, formats=("html",), n_workers=None, focus_deltas=(), force=False):
+    """
+    Render the reports of several runs (e.g. the `test_processing_time.py` sweep) in parallel.
+
+    Each configuration is rendered by one worker process, so its outputs are loaded once for all
+    of its figures; different configurations render concurrently.
+    """
+    if "png" in formats and importlib.util.find_spec("kaleido") is None:
+        raise ImportError("PNG output of the Plotly figures needs the kaleido package (pip install kaleido).")
+
+    n_workers = min(n_workers or os.cpu_count() or 1, len(configs))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(render_run, config, report_dir_for(config, report_root), tuple(formats),
+                                   tuple(focus_deltas), force)
+                   for config in configs]
+        summaries = [future.result() for future in futures]
+
+    for summary in summaries:
+        print(f"[REPORT] {summary['report_dir']}: {len(summary['rendered'])} rendered, "
+              f"{len(summary['skipped'])} unchanged"
+              + (f", no input for {', '.join(summary['missing'])}" if summary["missing"] else ""))
+    return summaries
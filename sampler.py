@@ -0,0 +1,147 @@
+import os
+import math
+import heapq
+import hashlib
+import pandas as pd
+from config import sample_size, __RANDOM_SEED__
+from case_index import CaseIndex, INDEX_NAME
+
+# Case attributes kept for each sampled case, as in the manual review sheet
+REVIEW_COLUMNS = ["case_id", "final_status", "issues", "first_delta", "cancelled", "last_state", "trace"]
+STRATA = ("final_status", "issues", "first_delta")
+
+
+def issue_kind(issues):
+    """Group the issues of a case, e.g. every "Missing events: {...}" is one stratum."""
+    if not isinstance(issues, str) or not issues:
+        return "None"
+    return "Missing events" if issues.startswith("Missing events") else issues
+
+
+class StratifiedSampler:
+    """
+    Reproducible stratified sample of cases drawn in a single pass with fixed memory.
+
+    Every case gets a pseudo-random key from the seed and its case id. Each stratum keeps only the
+    `sample_size` cases with the smallest keys (a bottom-k reservoir), which is a uniform sample of
+    the stratum. At the end the sample size is split over the strata in proportion to their number
+    of cases. Because the keys do not depend on the order of the cases, sampling inside
+    `ProcessManager` and over a saved case output gives the same cases.
+    """
+
+    def __init__(self, size=sample_size, seed=__RANDOM_SEED__, strata=STRATA):
+        """
+        :param size: Number of cases in the sample.
+        :param seed: Random seed; the same seed and cases always give the same sample.
+        :param strata: Case attributes the sample is stratified by.
+        """
+        self.size = size
+        self.seed = seed
+        self.strata = strata
+        self.reservoirs = {}
+        self.counts = {}
+        self.cases_seen = 0
+
+    def key(self, case_id):
+        digest = hashlib.blake2b(f"{self.seed}:{case_id}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def stratum(self, row):
+        return tuple(issue_kind(row[name]) if name == "issues" else str(row[name]) for name in self.strata)
+
+    def offer(self, row: dict):
+        """Consider one case, given as a dictionary with at least `case_id` and the strata columns."""
+        stratum = self.stratum(row)
+        self.counts[stratum] = self.counts.get(stratum, 0) + 1
+        self.cases_seen += 1
+
+        # Max-heap on the key (stored negated) of the cases kept for the stratum
+        reservoir = self.reservoirs.setdefault(stratum, [])
+        entry = (-self.key(row["case_id"]), str(row["case_id"]), row)
+        if len(reservoir) < self.size:
+            heapq.heappush(reservoir, entry)
+        elif entry[0] > reservoir[0][0]:
+            heapq.heapreplace(reservoir, entry)
+
+    def offer_case(self, case, variants=None):
+        """Consider a `Case` object, e.g. while iterating over `ProcessManager.cases`."""
+        row = {column: getattr(case, column) for column in REVIEW_COLUMNS if column != "trace"}
+        row["trace"] = variants.trace(case.trace_node) if variants is not None else None
+        self.offer(row)
+
+    def allocation(self):
+        """
+        Cases drawn per stratum, proportional to the stratum sizes.
+
+        With more strata than sampled cases most strata get a fraction of a case, so the counts are
+        rounded systematically: the strata are laid out in sorted order (final status, then issue,
+        then first delta) and every case is drawn at a fixed step from a seeded offset. Each stratum
+        gets its share in expectation, and the final status and issue shares are kept within one case.
+        """
+        if not self.cases_seen:
+            return {}
+        total = min(self.size, self.cases_seen)
+        offset = self.key("allocation") / 2 ** 64
+        allocation, cumulative = {}, 0.0
+        for stratum in sorted(self.counts):
+            share = total * self.counts[stratum] / self.cases_seen
+            allocation[stratum] = math.floor(cumulative + share + offset) - math.floor(cumulative + offset)
+            cumulative += share
+        return allocation
+
+    def sample(self) -> pd.DataFrame:
+        """The sampled cases with their stratum and an empty `manual_label` column for the review."""
+        rows = []
+        for stratum, n in self.allocation().items():
+            for _, _, row in heapq.nlargest(n, self.reservoirs[stratum]):
+                rows.append(dict(row, stratum=" | ".join(stratum), stratum_cases=self.counts[stratum]))
+        sample = pd.DataFrame(rows, columns=REVIEW_COLUMNS + ["stratum", "stratum_cases"])
+        sample["manual_label"] = None
+        return sample.sort_values(["stratum", "case_id"]).reset_index(drop=True)
+
+
+def sample_case_output(case_output_path, sampler: StratifiedSampler, chunk_size=100_000):
+    """Draw the sample from a saved case output, reading `chunk_size` cases at a time."""
+    for chunk in pd.read_csv(case_output_path, usecols=lambda column: column in REVIEW_COLUMNS,
+                             dtype={"case_id": str}, chunksize=chunk_size):
+        for row in chunk.to_dict("records"):
+            row.setdefault("trace", None)
+            sampler.offer(row)
+    return sampler.sample()
+
+
+def export_sample(sample: pd.DataFrame, event_log_path, output_dir, run_name, chunk_size=200_000,
+                  delta_log_dir=None):
+    """
+    Save the sampled cases and every event row of those cases.
+
+    When `delta_log_dir` holds a case index (`case_index.py`), the rows of the sampled cases are
+    read from the delta logs by their byte offsets, so only those rows are touched. Otherwise the
+    event log is read once, `chunk_size` rows at a time, keeping the rows of sampled cases.
+
+    :return: Paths of the sampled cases and sampled events CSV files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cases_path = os.path.join(output_dir, f"sampled_cases_{run_name}.csv")
+    events_path = os.path.join(output_dir, f"sampled_events_{run_name}.csv")
+    sample.to_csv(cases_path, index=False)
+
+    case_ids = list(sample["case_id"].astype(str))
+    if delta_log_dir is not None and os.path.exists(os.path.join(delta_log_dir, INDEX_NAME)):
+        case_index = CaseIndex(delta_log_dir)
+        case_index.refresh()
+        columns = case_index.columns()
+        events = case_index.events_of(case_ids)
+        case_index.close()
+        events.reindex(columns=columns).to_csv(events_path, index=False)
+    else:
+        case_ids, first = set(case_ids), True
+        for chunk in pd.read_csv(event_log_path, dtype={"case": str}, keep_default_na=False,
+                                 na_values=['NaN', "", " "], chunksize=chunk_size):
+            events = chunk[chunk["case"].isin(case_ids)]
+            events.to_csv(events_path, mode="w" if first else "a", header=first, index=False)
+            first = False
+
+    print(f"Sample of {len(sample)} cases saved to: {cases_path}")
+    print(f"Their events saved to: {events_path}")
+    return cases_path, events_path
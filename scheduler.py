@@ -0,0 +1,150 @@
+import os
+import time
+import hashlib
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import RunConfig
+
+
+def config_for_log(event_log_path, base: RunConfig, output_root) -> RunConfig:
+    """
+    Per-log configuration: same parameters as `base`, with every output isolated under
+    `output_root/<log name>_<path hash>/`. The hash of the absolute path keeps logs with the same
+    file name in different directories apart, and gives a log the same directory on every run.
+    """
+    log_name = os.path.splitext(os.path.basename(event_log_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(event_log_path).encode()).hexdigest()[:8]
+    output_dir = os.path.join(output_root, f"{log_name}_{path_hash}")
+    return dataclasses.replace(
+        base,
+        event_log_path=event_log_path,
+        output_dir=output_dir,
+        delta_log_dir=None,
+        cases_output_path=None,
+        delta_output_path=None,
+        evaluation_output_path=None,
+        confusion_matrix_path=None if base.confusion_matrix_path is None else os.path.join(output_dir, "confusion_matrix.png"),
+        case_store_path=None,
+        case_db_path=None if base.case_db_path is None else os.path.join(output_dir, "cases.sqlite"),
+    )
+
+
+def log_size(config: RunConfig):
+    # A missing log counts as empty here; its worker reports the error when it tries to read it.
+    return os.path.getsize(config.event_log_path) if os.path.isfile(config.event_log_path) else 0
+
+
+def assign_logs(configs, n_workers):
+    """Spread the logs over the workers, largest event log first onto the least loaded worker."""
+    groups = [[] for _ in range(min(n_workers, len(configs)))]
+    loads = [0] * len(groups)
+    for config in sorted(configs, key=log_size, reverse=True):
+        worker = loads.index(min(loads))
+        groups[worker].append(config)
+        loads[worker] += log_size(config)
+    return groups
+
+
+def failed_run(event_log_path, error):
+    return {"event_log_path": event_log_path, "error": repr(error)}
+
+
+def run_log_group(configs):
+    """
+    Worker task: process several logs in one process, advancing them one delta at a time in
+    round-robin order. Each log has its own `ProcessManager`, so case state and outputs stay isolated.
+    A log that raises is reported with its error and dropped from the rotation; the others go on.
+    """
+    from process import ProcessManager
+
+    runs, results = {}, []
+    for config in configs:
+        try:
+            process_manager = ProcessManager(config=config)
+            runs[config.event_log_path] = {
+                "manager": process_manager,
+                "deltas": process_manager.iter_process_logs(),
+                "start_time": time.time(),
+                "deltas_processed": 0,
+            }
+        except Exception as error:
+            results.append(failed_run(config.event_log_path, error))
+
+    active = list(runs)
+    while active:
+        for event_log_path in list(active):
+            run = runs[event_log_path]
+            try:
+                if next(run["deltas"], None) is not None:
+                    run["deltas_processed"] += 1
+                    continue
+                active.remove(event_log_path)
+                run["manager"].finalise(run["start_time"])
+            except Exception as error:
+                if event_log_path in active:
+                    active.remove(event_log_path)
+                run["manager"].cases.close()
+                results.append(failed_run(event_log_path, error))
+                continue
+            results.append({
+                "event_log_path": event_log_path,
+                "deltas_processed": run["deltas_processed"],
+                "cases": len(run["manager"].cases),
+                "seconds": time.time() - run["start_time"],
+                "cases_output_path": run["manager"].cases_output_path,
+                "delta_output_path": run["manager"].delta_output_path,
+            })
+    return results
+
+
+class MultiLogScheduler:
+    """Run the completeness classification for several event logs over a shared pool of worker processes."""
+
+    def __init__(self, event_log_paths, base_config: RunConfig = None, output_root="Dataset/Multi Log Outputs",
+                 n_workers=None):
+        """
+        :param event_log_paths: CSV event logs to process; each path may only be given once.
+        :param base_config: Parameters shared by all logs (frequency, initial months, max_days, ...).
+        :param output_root: Directory under which each log gets its own output directory.
+        :param n_workers: Number of worker processes; defaults to the number of CPU cores.
+        """
+        absolute_paths = [os.path.abspath(path) for path in event_log_paths]
+        duplicates = sorted({path for path in absolute_paths if absolute_paths.count(path) > 1})
+        if duplicates:
+            raise ValueError(f"Event logs given more than once: {', '.join(duplicates)}")
+        base_config = base_config or RunConfig()
+        self.configs = [config_for_log(path, base_config, output_root) for path in event_log_paths]
+        self.n_workers = n_workers or os.cpu_count()
+
+    def run(self):
+        """
+        Process all logs and return one summary dictionary per log.
+
+        The logs are spread over the workers by size, and every worker advances its logs one delta
+        at a time in turn, so a small log is not held up until a large one has finished. A log that
+        fails is reported with its `error` and does not affect the others, not even those of its
+        worker; if a worker process dies, each of its logs is reported with that error.
+        """
+        start_time = time.time()
+        groups = assign_logs(self.configs, self.n_workers)
+        n_workers = len(groups)
+        results = []
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(run_log_group, group): group for group in groups}
+            for future in as_completed(futures):
+                try:
+                    results.extend(future.result())
+                except Exception as error:
+                    results.extend(failed_run(config.event_log_path, error) for config in futures[future])
+
+        total_seconds = time.time() - start_time
+        failed = [result for result in results if "error" in result]
+        print(f"[SCHEDULER] Processed {len(results) - len(failed)} of {len(results)} event logs with "
+              f"{n_workers} workers in {total_seconds:.2f} seconds")
+        for result in results:
+            if "error" in result:
+                print(f"[SCHEDULER] {result['event_log_path']}: failed with {result['error']}")
+            else:
+                print(f"[SCHEDULER] {result['event_log_path']}: {result['deltas_processed']} logs, "
+                      f"{result['cases']} cases, {result['seconds']:.2f} seconds")
+        return results
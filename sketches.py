@@ -0,0 +1,492 @@
+import math
+import base64
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative error guarantees (logarithmic buckets, as in DDSketch).
+
+    Values are mapped to buckets whose bounds grow by a factor of (1 + alpha) / (1 - alpha), so any
+    quantile is returned within a relative error of `alpha`. Two sketches with the same `alpha`
+    can be merged by adding their bucket counts.
+    """
+
+    def __init__(self, alpha=0.01, min_value=1e-3):
+        """
+        :param alpha: Relative accuracy of the returned quantiles.
+        :param min_value: Absolute values below this are counted in the zero bucket.
+        """
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def bucket_value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        """Add a value (e.g. a waiting time in seconds) to the sketch."""
+        if value > self.min_value:
+            index = self.bucket(value)
+            self.positive[index] = self.positive.get(index, 0) + count
+        elif value < -self.min_value:
+            index = self.bucket(-value)
+            self.negative[index] = self.negative.get(index, 0) + count
+        else:
+            self.zero_count += count
+
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def add_array(self, values):
+        """Add a NumPy array of values at once; NaN entries are ignored."""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        for store, selected in ((self.positive, values[values > self.min_value]),
+                                (self.negative, -values[values < -self.min_value])):
+            indices, counts = np.unique(np.ceil(np.log(selected) / self.log_gamma).astype(np.int64),
+                                        return_counts=True)
+            for index, count in zip(indices.tolist(), counts.tolist()):
+                store[index] = store.get(index, 0) + count
+        self.zero_count += int((np.abs(values) <= self.min_value).sum())
+
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = float(values.min()) if self.min is None else min(self.min, float(values.min()))
+        self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+
+    def merge(self, other):
+        """Add the counts of another sketch built with the same accuracy into this one."""
+        if other.alpha != self.alpha:
+            raise ValueError("Only sketches with the same alpha can be merged.")
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def subtract(self, other):
+        """
+        Remove the counts of another sketch whose values were all added to this one.
+
+        Used to take back the contribution of a replayed case; `min` and `max` are kept,
+        so they remain bounds of the remaining values rather than exact extremes. Callers that
+        need exact extremes track them separately (`Delta.track_extremes`).
+        """
+        if other.alpha != self.alpha:
+            raise ValueError("Only sketches with the same alpha can be subtracted.")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_store.items():
+                remaining = store.get(index, 0) - count
+                if remaining > 0:
+                    store[index] = remaining
+                else:
+                    store.pop(index, None)
+        self.zero_count -= other.zero_count
+        self.count -= other.count
+        self.sum -= other.sum
+        if not self.count:
+            self.min = self.max = None
+        return self
+
+    def quantile(self, q):
+        """
+        Approximate q-quantile of the added values.
+
+        :param q: Quantile in [0, 1].
+        :return: The quantile estimate, or None if the sketch is empty.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(-self.bucket_value(index), self.min)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        """Count, mean, extremes and the requested quantiles as a flat dictionary."""
+        summary = {"count": self.count, "mean": self.mean(), "min": self.min, "max": self.max}
+        for q in quantiles:
+            summary[f"p{round(q * 100)}"] = self.quantile(q)
+        return summary
+
+    def to_dict(self):
+        """Serialise the sketch, e.g. for storing it next to the delta statistics."""
+        return {
+            "alpha": self.alpha, "min_value": self.min_value,
+            "positive": self.positive, "negative": self.negative, "zero_count": self.zero_count,
+            "count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["alpha"], data["min_value"])
+        sketch.positive = {int(index): count for index, count in data["positive"].items()}
+        sketch.negative = {int(index): count for index, count in data["negative"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
+
+
+def hash_values(values):
+    """
+    Stable 64-bit hashes of an array of values (e.g. case ids or event names).
+
+    The hashes do not depend on the process (unlike `hash`), so sketches built by different runs,
+    workers or shards can be merged. Strings are hashed as they are; pandas hashes other values
+    by their string form.
+    """
+    return pd.util.hash_array(np.asarray(values, dtype=object), categorize=False)
+
+
+def bit_length(values):
+    """Number of bits of every unsigned 64-bit value (0 for 0), computed exactly with shifts."""
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        large = values >= (np.uint64(1) << np.uint64(shift))
+        length[large] += shift
+        values[large] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct count sketch (HyperLogLog with linear counting for small counts).
+
+    Each value is hashed to one of 2^precision registers, which keeps the longest run of leading
+    zero bits seen in the rest of the hash. The count has a relative standard error of
+    1.04 / sqrt(2^precision); two sketches with the same precision merge by taking the maximum of
+    every register.
+    """
+
+    def __init__(self, precision=12):
+        """
+        :param precision: Number of hash bits choosing the register (4 to 18); 12 gives 4096 registers.
+        """
+        if not 4 <= precision <= 18:
+            raise ValueError("The precision of a HyperLogLog sketch must be between 4 and 18.")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add_array(self, values):
+        """Add a NumPy array or Series of values at once."""
+        if len(values):
+            self.add_hashes(hash_values(values))
+
+    def add_hashes(self, hashes):
+        """Add values by their `hash_values`."""
+        rest_bits = 64 - self.precision
+        index = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        rank = (rest_bits - bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        """Combine another sketch with the same precision into this one."""
+        if other.precision != self.precision:
+            raise ValueError("Only HyperLogLog sketches with the same precision can be merged.")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        """Estimated number of distinct values added."""
+        m = len(self.registers)
+        zeros = int((self.registers == 0).sum())
+        if zeros == m:
+            return 0
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum()
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_dict(self):
+        """Serialise the registers; a sketch of few values only lists its non-zero registers."""
+        indices = np.flatnonzero(self.registers)
+        if len(indices) < len(self.registers) // 8:
+            return {"precision": self.precision, "indices": indices.tolist(),
+                    "values": self.registers[indices].tolist()}
+        return {"precision": self.precision, "registers": base64.b64encode(self.registers.tobytes()).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["precision"])
+        if "registers" in data:
+            sketch.registers = np.frombuffer(base64.b64decode(data["registers"]), dtype=np.uint8).copy()
+        else:
+            sketch.registers[data["indices"]] = data["values"]
+        return sketch
+
+
+class CountMinSketch:
+    """
+    Mergeable frequency sketch (count-min).
+
+    Every key is counted in one cell of each of `depth` rows of `width` counters; its estimate is
+    the smallest of those cells. Estimates never undercount, and with probability 1 - delta they
+    overcount by at most epsilon times the total count. Sketches of the same shape merge by adding
+    their counters.
+    """
+
+    def __init__(self, epsilon=0.001, delta=0.01):
+        """
+        :param epsilon: Overcount bound as a fraction of the total count; sets the width to e / epsilon.
+        :param delta: Probability that an estimate exceeds the bound; sets the depth to ln(1 / delta).
+        """
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+
+    @property
+    def error_bound(self):
+        """Largest overcount of any estimate, with probability 1 - delta."""
+        return self.epsilon * self.total
+
+    def cells(self, keys):
+        """Column of every key in every row (double hashing of one 64-bit hash)."""
+        hashes = hash_values(keys)
+        low, high = hashes & np.uint64(0xFFFFFFFF), hashes >> np.uint64(32)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((low[None, :] + rows * high[None, :]) % np.uint64(self.width)).astype(np.int64)
+
+    def add_array(self, keys, counts=None):
+        """Count an array of keys at once, each once or by the matching entry of `counts`."""
+        if not len(keys):
+            return
+        counts = np.ones(len(keys), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        for row, columns in enumerate(self.cells(keys)):
+            self.table[row] += np.bincount(columns, weights=counts, minlength=self.width).astype(np.int64)
+        self.total += int(counts.sum())
+
+    def estimate_array(self, keys):
+        """Estimated count of every key."""
+        if not len(keys):
+            return np.zeros(0, dtype=np.int64)
+        return self.table[np.arange(self.depth)[:, None], self.cells(keys)].min(axis=0)
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Only count-min sketches with the same epsilon and delta can be merged.")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def to_dict(self):
+        """Serialise the non-zero cells only, as most of them stay empty for small vocabularies."""
+        rows, columns = np.nonzero(self.table)
+        return {"epsilon": self.epsilon, "delta": self.delta, "total": self.total,
+                "cells": [rows.tolist(), columns.tolist(), self.table[rows, columns].tolist()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["epsilon"], data["delta"])
+        rows, columns, counts = data["cells"]
+        sketch.table[rows, columns] = counts
+        sketch.total = data["total"]
+        return sketch
+
+
+class SpaceSaving:
+    """
+    Mergeable top-k summary of the most frequent keys (SpaceSaving).
+
+    At most `capacity` keys are monitored, each with a count and the error it may overcount by:
+    the true count of a monitored key lies between count - error and count, and every key more
+    frequent than total / capacity is monitored. Merging follows the mergeable summaries of
+    Agarwal et al.: a key missing from a full summary is charged its smallest count.
+    """
+
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0
+
+    def floor(self):
+        """Count charged to keys that are not monitored: the smallest count once the summary is full."""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def add(self, key, count=1):
+        if key in self.counters:
+            self.counters[key][0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [count, 0]
+        else:
+            smallest = min(self.counters, key=lambda monitored: self.counters[monitored][0])
+            floor = self.counters.pop(smallest)[0]
+            self.counters[key] = [floor + count, floor]
+        self.total += count
+
+    def merge(self, other):
+        if other.capacity != self.capacity:
+            raise ValueError("Only SpaceSaving summaries with the same capacity can be merged.")
+        own_floor, other_floor = self.floor(), other.floor()
+        combined = {}
+        for key in self.counters.keys() | other.counters.keys():
+            own = self.counters.get(key, [own_floor, own_floor])
+            theirs = other.counters.get(key, [other_floor, other_floor])
+            combined[key] = [own[0] + theirs[0], own[1] + theirs[1]]
+        kept = sorted(combined, key=lambda key: (-combined[key][0], str(key)))[:self.capacity]
+        self.counters = {key: combined[key] for key in kept}
+        self.total += other.total
+        return self
+
+    def top(self, k=None):
+        """(key, count, error) of the `k` most frequent monitored keys, most frequent first."""
+        ranked = sorted(self.counters.items(), key=lambda item: (-item[1][0], str(item[0])))
+        return [(key, count, error) for key, (count, error) in ranked[:k]]
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "total": self.total,
+                "counters": [[key, count, error] for key, count, error in self.top()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls(data["capacity"])
+        summary.counters = {key: [count, error] for key, count, error in data["counters"]}
+        summary.total = data["total"]
+        return summary
+
+
+class DeltaSketches:
+    """
+    Approximate statistics of one or more deltas (approximate mode): the distinct cases of every
+    case set of a delta report (HyperLogLog), event frequencies (count-min) and the most frequent
+    events (SpaceSaving).
+
+    All of them merge, so the statistics of any range of deltas, or of several shards, are the
+    merge of their sketches, at a cost that depends on the sketch sizes only. Distinct counts of a
+    merge count a case once, however many of the merged deltas it appears in.
+    """
+
+    # Delta report count and the case set it estimates
+    CASE_COUNTS = {"ongoing_count": "ongoing", "cancelled_count": "cancelled", "complete_count": "complete",
+                   "incomplete_count": "incomplete", "initialised_count": "initialised", "updated_count": "updated",
+                   "cases_processed": "processed"}
+
+    def __init__(self, precision=12, epsilon=0.001, delta=0.01, capacity=32):
+        """
+        :param precision: Register bits of the distinct case counts (`HyperLogLog`).
+        :param epsilon: Overcount bound of the event counts as a fraction of the events (`CountMinSketch`).
+        :param delta: Probability that an event count exceeds its bound.
+        :param capacity: Number of most frequent events monitored (`SpaceSaving`).
+        """
+        self.cases = {name: HyperLogLog(precision) for name in self.CASE_COUNTS.values()}
+        self.event_counts = CountMinSketch(epsilon, delta)
+        self.top_events = SpaceSaving(capacity)
+
+    def add_events(self, case_ids, event_names):
+        """
+        Add the events of a delta, given as arrays of their case ids and event names.
+
+        Event names are aggregated first, so each distinct name is one weighted update.
+        """
+        self.cases["processed"].add_array(case_ids)
+        counts = pd.Series(event_names, dtype=object).value_counts(dropna=False)
+        self.event_counts.add_array(counts.index.to_numpy(), counts.to_numpy())
+        for event_name, count in counts.items():
+            self.top_events.add(event_name, int(count))
+
+    def add_case_sets(self, case_sets):
+        """
+        Add case ids to the distinct counts of the case sets, hashing them all at once.
+
+        :param case_sets: Mapping of a case set (a value of `CASE_COUNTS`) to a list of case ids.
+        """
+        names = list(case_sets)
+        case_ids = [case_id for name in names for case_id in case_sets[name]]
+        if not case_ids:
+            return
+        bounds = np.cumsum([len(case_sets[name]) for name in names])[:-1]
+        for name, hashes in zip(names, np.split(hash_values(case_ids), bounds)):
+            self.cases[name].add_hashes(hashes)
+
+    def merge(self, other):
+        for name, sketch in self.cases.items():
+            sketch.merge(other.cases[name])
+        self.event_counts.merge(other.event_counts)
+        self.top_events.merge(other.top_events)
+        return self
+
+    def summary(self):
+        """
+        Estimates with their error bounds, under the keys of the exact delta report.
+
+        `event_counts` holds the count-min estimates of the monitored events; each is at most
+        `event_count_error` too high with probability `event_count_confidence`. `top_events` lists
+        the SpaceSaving counts, whose true value lies in [count - error, count]. The case counts have
+        the relative standard error `case_count_error`; `total_events` is exact.
+        """
+        top = self.top_events.top()
+        estimates = self.event_counts.estimate_array([key for key, _, _ in top])
+        summary = {
+            "event_counts": {key: int(estimate) for (key, _, _), estimate in zip(top, estimates)},
+            "total_events": self.event_counts.total,
+        }
+        for key, name in self.CASE_COUNTS.items():
+            summary[key] = self.cases[name].count()
+        summary.update({
+            "case_count_error": self.cases["processed"].relative_error,
+            "event_count_error": self.event_counts.error_bound,
+            "event_count_confidence": 1 - self.event_counts.delta,
+            "top_events": [{"event": key, "count": count, "error": error} for key, count, error in top],
+        })
+        return summary
+
+    def to_dict(self):
+        return {"cases": {name: sketch.to_dict() for name, sketch in self.cases.items()},
+                "event_counts": self.event_counts.to_dict(), "top_events": self.top_events.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketches = cls.__new__(cls)
+        sketches.cases = {name: HyperLogLog.from_dict(sketch) for name, sketch in data["cases"].items()}
+        sketches.event_counts = CountMinSketch.from_dict(data["event_counts"])
+        sketches.top_events = SpaceSaving.from_dict(data["top_events"])
+        return sketches
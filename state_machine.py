@@ -0,0 +1,475 @@
+import numpy as np
+import pandas as pd
+from delta import delta_label
+
+# Encoded case statuses
+ONGOING, COMPLETE, INCOMPLETE = 0, 1, 2
+STATUS_NAMES = np.array(["ONGOING", "COMPLETE", "INCOMPLETE"], dtype=object)
+
+# Encoded state classes; every state other than Billed/Unbillable behaves the same
+OTHER_STATE, BILLED_STATE, UNBILLABLE_STATE = 0, 1, 2
+
+# Per-case flag bits mirroring the boolean attributes of `Case`
+F_CANCELLED = 1     # case.cancelled
+F_COMPLETE = 2      # case.complete
+F_ONGOING = 4       # case.ongoing
+F_SLEPT = 8         # case.sleep / case.incomplete == True
+F_UPDATED = 16      # at least one update after initialisation
+F_UNFINALISED = 32  # last update left the trace without a logical final state (kept through sleep)
+
+CRITICAL_EVENTS = ("BILLED", "FIN", "RELEASE", "CODE OK")
+REJECTED_EVENTS = ("STORNO", "REJECT", "SET STATUS")
+TRACKED_EVENTS = CRITICAL_EVENTS + REJECTED_EVENTS
+
+CRITICAL_MASK = sum(1 << i for i in range(len(CRITICAL_EVENTS)))
+REJECTED_MASK = sum(1 << (i + len(CRITICAL_EVENTS)) for i in range(len(REJECTED_EVENTS)))
+
+# Events a case must cover to be complete, indexed by state class
+REQUIRED_MASKS = np.array([CRITICAL_MASK, CRITICAL_MASK, CRITICAL_MASK | REJECTED_MASK], dtype=np.uint8)
+
+# Keys of the `Delta` reports written by `ProcessManager` that the state machine does not compute:
+# the position and revision of the report, the variants (variant_trie.py) and the wait and completion
+# time distributions (sketches.py). Every other key of either report is compared by `compare_reports`.
+UNMODELLED_REPORT_KEYS = [
+    "delta_index", "revision", "distinct_variants", "top_variants", "wait_time_by_event", "wait_time_by_event_sketch",
+    "wait_time_count", "wait_time_mean", "wait_time_min", "wait_time_max", "wait_time_p50", "wait_time_p90",
+    "wait_time_p99", "wait_time_sketch",
+    "completion_time_count", "completion_time_mean", "completion_time_min", "completion_time_max",
+    "completion_time_p50", "completion_time_p90", "completion_time_p99", "completion_time_sketch",
+]
+
+
+def build_transition_tables():
+    """
+    Compile the branching of `Case.update` into lookup tables.
+
+    :return: (next_status, next_flags) where next_status is indexed by
+             [status, state class, cancelled, covered] and next_flags by
+             [state class, cancelled, covered].
+    """
+    next_status = np.empty((3, 3, 2, 2), dtype=np.int8)
+    next_flags = np.empty((3, 2, 2), dtype=np.uint8)
+
+    for state in (OTHER_STATE, BILLED_STATE, UNBILLABLE_STATE):
+        for cancelled in (0, 1):
+            for covered in (0, 1):
+                # check_ongoing
+                ongoing = not (cancelled or state != OTHER_STATE)
+                # check_completeness
+                complete = bool(cancelled) or (not ongoing and bool(covered))
+
+                flags = F_UPDATED
+                flags |= F_CANCELLED if cancelled else 0
+                flags |= F_COMPLETE if complete else 0
+                flags |= F_ONGOING | F_UNFINALISED if ongoing else 0
+                next_flags[state, cancelled, covered] = flags
+
+                for status in (ONGOING, COMPLETE, INCOMPLETE):
+                    if complete:
+                        new_status = COMPLETE
+                    elif ongoing:
+                        new_status = ONGOING
+                    else:
+                        # Finalised state with missing events keeps the previous status
+                        new_status = status
+                    next_status[status, state, cancelled, covered] = new_status
+
+    return next_status, next_flags
+
+
+NEXT_STATUS, NEXT_FLAGS = build_transition_tables()
+
+
+def cancelled_flags(event_log: pd.DataFrame):
+    """`isCancelled` of every event as 0/1, read as `Case` reads it."""
+    if "isCancelled" not in event_log:
+        return np.zeros(len(event_log), dtype=np.int8)
+    return event_log["isCancelled"].to_numpy().astype(bool).astype(np.int8)
+
+
+def event_counts(event_names, events):
+    """Number of events of every event name, from their vocabulary ids."""
+    counts = pd.Series(event_names, dtype=object).iloc[events].value_counts(sort=False)
+    return {name: int(count) for name, count in counts.items()}
+
+
+def delta_report(delta_name, counts, names, touched, touched_status, is_cancelled, initialised, incomplete):
+    """
+    Delta report with the keys of `Delta.generate_report` that the state machine computes.
+
+    :param counts: `event_counts` of the delta; its total is the number of events.
+    :param names: Case ids by case position.
+    :param touched: Positions of the cases with events in the delta, with their status after those
+                    events (before the sleep check), whether their last event was cancelled and
+                    whether the delta initialised them.
+    :param incomplete: Positions flagged incomplete by the sleep check of the delta.
+    """
+    complete = (touched_status == COMPLETE) & ~is_cancelled
+    return {
+        "delta_file_name": delta_label(delta_name),
+        "event_counts": counts,
+        "total_events": sum(counts.values()),
+        "ongoing_count": int((touched_status == ONGOING).sum()),
+        "cancelled_count": int(is_cancelled.sum()),
+        "complete_count": int(complete.sum()),
+        "incomplete_count": len(incomplete),
+        "initialised_count": int(initialised.sum()),
+        "updated_count": int((~initialised).sum()),
+        "cases_processed": len(touched),
+        "initialised_cases": set(names[touched[initialised]]),
+        "updated_cases": set(names[touched[~initialised]]),
+        "complete_cases": set(names[touched[complete]]),
+        "incomplete_cases": set(names[incomplete]),
+        "cancelled_cases": set(names[touched[is_cancelled]]),
+        "ongoing_cases": set(names[touched[touched_status == ONGOING]]),
+    }
+
+
+def event_times(event_log: pd.DataFrame):
+    """`completeTime` of every event in nanoseconds, for the sleep check."""
+    return pd.to_datetime(event_log["completeTime"]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def event_ranks(case_codes):
+    """Number of earlier events of the same case in the delta, for each event."""
+    return pd.Series(case_codes).groupby(case_codes).cumcount().to_numpy()
+
+
+class BatchStateMachine:
+    """
+    Table-driven counterpart of `Case` that advances all cases of a delta with NumPy operations.
+
+    Case state is kept in parallel arrays (status, flags, event coverage bitmask, last state,
+    last event, last event time) indexed by an internal case position.
+    """
+
+    def __init__(self, max_days, capacity=1024):
+        """
+        :param max_days: Longest time without events before a case is flagged incomplete, as in `ProcessManager`.
+        :param capacity: Number of cases the state arrays hold before they grow.
+        """
+        self.max_idle = pd.Timedelta(days=max_days).value
+        # Latest event time processed so far, in nanoseconds
+        self.reference_time = None
+        self.case_index = pd.Index([], dtype=object)
+        self.n_cases = 0
+
+        self.event_names = []
+        self.event_ids = {}
+        self.event_bits = np.zeros(0, dtype=np.uint8)
+        self.state_names = []
+        self.state_ids = {}
+        self.state_classes = np.zeros(0, dtype=np.int8)
+
+        self.status = np.zeros(capacity, dtype=np.int8)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.coverage = np.zeros(capacity, dtype=np.uint8)
+        self.last_state = np.zeros(capacity, dtype=np.int32)
+        self.last_event = np.zeros(capacity, dtype=np.int32)
+        self.last_time = np.zeros(capacity, dtype=np.int64)
+        self.first_delta = np.zeros(capacity, dtype=np.int32)
+        self.last_delta = np.zeros(capacity, dtype=np.int32)
+
+        self.delta_names = []
+        self.transitions = []
+
+    # ===================== Encoding ===================== #
+    def encode(self, values, names, ids):
+        """Map a column of labels onto integer ids, extending the vocabulary as needed."""
+        labels = pd.Series(values, dtype=object).fillna("nan").astype(str)
+        for label in labels.unique():
+            if label not in ids:
+                ids[label] = len(names)
+                names.append(label)
+        return labels.map(ids).to_numpy(dtype=np.int32)
+
+    def encode_events(self, events):
+        codes = self.encode(events, self.event_names, self.event_ids)
+        if len(self.event_bits) < len(self.event_names):
+            self.event_bits = np.array(
+                [1 << TRACKED_EVENTS.index(name) if name in TRACKED_EVENTS else 0 for name in self.event_names],
+                dtype=np.uint8)
+        return codes
+
+    def encode_states(self, states):
+        codes = self.encode(states, self.state_names, self.state_ids)
+        if len(self.state_classes) < len(self.state_names):
+            state_class = {"Billed": BILLED_STATE, "Unbillable": UNBILLABLE_STATE}
+            self.state_classes = np.array(
+                [state_class.get(name, OTHER_STATE) for name in self.state_names], dtype=np.int8)
+        return codes
+
+    def encode_cases(self, case_ids):
+        """Return case positions, registering unseen case ids at the end of the arrays."""
+        positions = self.case_index.get_indexer(case_ids)
+        unseen = pd.unique(case_ids[positions == -1])
+        if len(unseen):
+            self.add_cases(unseen)
+            positions = self.case_index.get_indexer(case_ids)
+        return positions
+
+    def add_cases(self, case_ids):
+        """Register case ids known to be unseen; returns their positions."""
+        start = self.n_cases
+        self.case_index = self.case_index.append(pd.Index(case_ids, dtype=object))
+        self.reserve(start + len(case_ids))
+        self.n_cases += len(case_ids)
+        return np.arange(start, self.n_cases)
+
+    def reserve(self, size):
+        """Grow the state arrays geometrically to hold at least `size` cases."""
+        capacity = len(self.status)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ("status", "flags", "coverage", "last_state", "last_event", "last_time", "first_delta", "last_delta"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    # ===================== Transitions ===================== #
+    def record_transitions(self, positions, previous, new, delta_id, sleep=False):
+        changed = previous != new
+        if changed.any():
+            self.transitions.append((positions[changed], previous[changed], new[changed],
+                                     np.full(changed.sum(), delta_id, dtype=np.int32),
+                                     np.full(changed.sum(), sleep, dtype=bool)))
+
+    def initialise(self, positions, events, states, cancelled, times, delta_id):
+        """Equivalent of `Case.__init__` for a batch of new cases."""
+        self.status[positions] = np.where(cancelled, COMPLETE, ONGOING)
+        self.flags[positions] = np.where(cancelled, F_CANCELLED, 0) | F_ONGOING
+        self.coverage[positions] = self.event_bits[events]
+        self.last_state[positions] = states
+        self.last_event[positions] = events
+        self.last_time[positions] = times
+        self.first_delta[positions] = delta_id
+        self.last_delta[positions] = delta_id
+
+    def advance(self, positions, events, states, cancelled, times, delta_id):
+        """Equivalent of `Case.update` for a batch of distinct existing cases."""
+        state_class = self.state_classes[states]
+        coverage = self.coverage[positions] | self.event_bits[events]
+        required = REQUIRED_MASKS[state_class]
+        covered = ((coverage & required) == required).astype(np.int8)
+
+        previous = self.status[positions]
+        new = NEXT_STATUS[previous, state_class, cancelled, covered]
+        self.record_transitions(positions, previous, new, delta_id)
+
+        self.status[positions] = new
+        self.flags[positions] = NEXT_FLAGS[state_class, cancelled, covered]
+        self.coverage[positions] = coverage
+        self.last_state[positions] = states
+        self.last_event[positions] = events
+        self.last_time[positions] = times
+        self.last_delta[positions] = delta_id
+
+    def sleep_check(self, delta_id):
+        """Equivalent of `ProcessManager.perform_sleep_check`; returns positions flagged incomplete."""
+        n = self.n_cases
+        if self.reference_time is None:
+            return np.zeros(0, dtype=np.int64)
+        settled = (self.flags[:n] & (F_COMPLETE | F_CANCELLED | F_SLEPT)) != 0
+        positions = np.flatnonzero((self.reference_time - self.last_time[:n] > self.max_idle) & ~settled)
+
+        previous = self.status[positions]
+        new = np.full(len(positions), INCOMPLETE, dtype=np.int8)
+        self.record_transitions(positions, previous, new, delta_id, sleep=True)
+
+        self.status[positions] = INCOMPLETE
+        self.flags[positions] = (self.flags[positions] & ~np.uint8(F_ONGOING)) | F_SLEPT
+        return positions
+
+    # ===================== Delta Processing ===================== #
+    def process_delta(self, event_log: pd.DataFrame, delta_name: str):
+        """
+        Advance every case touched by one delta log and run the sleep check.
+
+        :param event_log: Events of the delta in processing order.
+        :param delta_name: File name of the delta log.
+        :return: A dictionary with the same keys as `Delta.generate_report`.
+        """
+        n_before = self.n_cases
+        positions = self.encode_cases(event_log["case"].to_numpy(dtype=object))
+        events = self.encode_events(event_log["event"])
+        states = self.encode_states(event_log["state"])
+        return self.apply_delta(delta_name, n_before, positions, events, states, cancelled_flags(event_log),
+                                event_ranks(positions), event_times(event_log))
+
+    def apply_delta(self, delta_name, n_before, positions, events, states, cancelled, rank, times):
+        """
+        Advance the cases of one delta whose events are already encoded (see `process_delta`).
+
+        :param n_before: Number of cases registered before this delta; higher positions are new cases.
+        :param positions: Case position of every event; events, states: their vocabulary ids.
+        :param cancelled: `isCancelled` of every event as 0/1; rank: the `event_ranks` of the positions.
+        :param times: `event_times` of the events.
+        """
+        delta_id = len(self.delta_names)
+        self.delta_names.append(delta_name)
+        if len(times):
+            latest = int(times.max())
+            self.reference_time = latest if self.reference_time is None else max(self.reference_time, latest)
+
+        # The k-th event of every case is applied in round k, so each round touches distinct cases
+        for r in range(int(rank.max()) + 1 if len(rank) else 0):
+            rows = np.flatnonzero(rank == r)
+            new_case = positions[rows] >= n_before if r == 0 else np.zeros(len(rows), dtype=bool)
+
+            init_rows = rows[new_case]
+            self.initialise(positions[init_rows], events[init_rows], states[init_rows],
+                            cancelled[init_rows], times[init_rows], delta_id)
+
+            update_rows = rows[~new_case]
+            self.advance(positions[update_rows], events[update_rows], states[update_rows],
+                         cancelled[update_rows], times[update_rows], delta_id)
+
+        touched = pd.unique(positions)
+        is_cancelled = (self.flags[touched] & F_CANCELLED) != 0
+        return delta_report(delta_name, event_counts(self.event_names, events), self.case_index, touched,
+                            self.status[touched], is_cancelled, touched >= n_before, self.sleep_check(delta_id))
+
+    def process_file(self, path, delta_name):
+        """Read a delta log the way `ProcessManager.process_logs` does and process it."""
+        event_log = pd.read_csv(path, keep_default_na=False, na_values=['NaN', "", " "])
+        return self.process_delta(event_log, delta_name)
+
+    # ===================== Results ===================== #
+    def transition_log(self) -> pd.DataFrame:
+        """
+        All recorded status transitions in processing order.
+
+        As in `Case`, updates are labelled with the delta label and sleep checks with the full delta name.
+        """
+        if self.transitions:
+            positions, previous, new, delta_ids, sleep = (np.concatenate(parts) for parts in zip(*self.transitions))
+        else:
+            positions = previous = new = delta_ids = np.zeros(0, dtype=np.int32)
+            sleep = np.zeros(0, dtype=bool)
+        full_names = np.array(self.delta_names, dtype=object)
+        short_names = np.array([delta_label(name) for name in self.delta_names], dtype=object)
+        return pd.DataFrame({
+            "case_id": self.case_index[positions],
+            "previous": STATUS_NAMES[previous],
+            "new": STATUS_NAMES[new],
+            "delta_name": np.where(sleep, full_names[delta_ids] if len(full_names) else [],
+                                   short_names[delta_ids] if len(short_names) else []),
+        })
+
+    def missing_events(self, position):
+        """Reconstruct `Case.missing_events` for one case position."""
+        if not self.flags[position] & F_UPDATED:
+            return set(CRITICAL_EVENTS)
+        required = REQUIRED_MASKS[self.state_classes[self.last_state[position]]]
+        missing = required & ~self.coverage[position]
+        return {name for i, name in enumerate(TRACKED_EVENTS) if missing & (1 << i)}
+
+    def to_frame(self) -> pd.DataFrame:
+        """Case-level classification results, indexed by case id."""
+        n = self.n_cases
+        flags = self.flags[:n]
+        state_class = self.state_classes[self.last_state[:n]] if n else np.zeros(0, dtype=np.int8)
+        required = REQUIRED_MASKS[state_class]
+        updated = (flags & F_UPDATED) != 0
+        complete = (flags & F_COMPLETE) != 0
+        ongoing = (flags & F_ONGOING) != 0
+        slept = (flags & F_SLEPT) != 0
+
+        transitions = self.transition_log()
+        counts = transitions["case_id"].value_counts()
+        first_transition = transitions.drop_duplicates("case_id").set_index("case_id")["new"]
+
+        unfinalised = (flags & F_UNFINALISED) != 0
+        issues = np.where(complete, "", np.where(unfinalised, "Trace is not finalised", "Missing events"))
+        issues = np.where(updated, issues, "No updates received")
+        delta_names = np.array(self.delta_names, dtype=object)
+        short_names = np.array([delta_label(name) for name in self.delta_names], dtype=object)
+
+        frame = pd.DataFrame({
+            "final_status": STATUS_NAMES[self.status[:n]],
+            "cancelled": (flags & F_CANCELLED) != 0,
+            "complete": complete,
+            "incomplete": np.where(slept, True, np.where(complete, False, None)),
+            "ongoing": ongoing,
+            "sleep": slept,
+            "isBilled": state_class == BILLED_STATE,
+            "isUnbillable": state_class == UNBILLABLE_STATE,
+            "have_crit_events": updated & ((self.coverage[:n] & required) == required),
+            "issues": issues,
+            "missing_events": [self.missing_events(position) for position in range(n)],
+            "last_state": np.array(self.state_names, dtype=object)[self.last_state[:n]] if n else [],
+            "last_event": np.array(self.event_names, dtype=object)[self.last_event[:n]] if n else [],
+            "transition_count": counts.reindex(self.case_index, fill_value=0).to_numpy(),
+            "first_transition_to": first_transition.reindex(self.case_index).to_numpy(),
+            "first_delta": delta_names[self.first_delta[:n]] if n else [],
+            "last_delta_update": short_names[self.last_delta[:n]] if n else [],
+        }, index=self.case_index)
+        frame.index.name = "case_id"
+        return frame
+
+
+def compare_with_cases(machine: BatchStateMachine, cases: dict) -> list:
+    """
+    Differential check of the state machine against `Case` objects.
+
+    :param machine: A `BatchStateMachine` that processed the same deltas.
+    :param cases: Mapping of case id to `Case`, as in `ProcessManager.cases`.
+    :return: List of (case_id, attribute, case value, machine value) mismatches.
+    """
+    frame = machine.to_frame()
+    transitions = machine.transition_log().groupby("case_id", sort=False)
+    mismatches = []
+    if set(frame.index) != set(cases):
+        mismatches.append((None, "case_ids", len(cases), len(frame)))
+
+    for case_id, case in cases.items():
+        if case_id not in frame.index:
+            continue
+        row = frame.loc[case_id]
+        expected = {
+            "final_status": case.final_status,
+            "cancelled": bool(case.cancelled),
+            "complete": case.complete,
+            "incomplete": case.incomplete,
+            "ongoing": case.ongoing,
+            "sleep": case.sleep,
+            "isBilled": case.isBilled,
+            "isUnbillable": case.isUnbillable,
+            "have_crit_events": case.have_crit_events,
+            "issues": "Missing events" if case.issues.startswith("Missing events") else case.issues,
+            "missing_events": case.missing_events,
+            "last_state": str(case.last_state),
+            "last_event": str(case.last_event),
+            "transition_count": case.transition_count,
+            "first_transition_to": case.first_transition_to,
+            "first_delta": case.first_delta,
+            "last_delta_update": case.last_delta_update,
+        }
+        for attribute, value in expected.items():
+            actual = row[attribute]
+            if isinstance(actual, np.generic):
+                actual = actual.item()
+            if value != actual and not (value is None and pd.isna(actual)):
+                mismatches.append((case_id, attribute, value, actual))
+
+        if case.transition_count:
+            history = transitions.get_group(case_id)[["previous", "new", "delta_name"]].to_dict("records")
+            if history != case.status_transitions:
+                mismatches.append((case_id, "status_transitions", case.status_transitions, history))
+
+    return mismatches
+
+
+def compare_reports(case_report: dict, machine_report: dict) -> list:
+    """
+    Return the keys on which two delta reports disagree.
+
+    Keys of either report are compared, so a key missing from one of them is a mismatch; only
+    `UNMODELLED_REPORT_KEYS` are skipped.
+    """
+    keys = [key for key in {**case_report, **machine_report} if key not in UNMODELLED_REPORT_KEYS]
+    return [key for key in keys if key not in case_report or key not in machine_report
+            or case_report[key] != machine_report[key]]
@@ -0,0 +1,125 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from process import ProcessManager
+from delta_log_formation import list_delta_logs, MANIFEST_NAME
+from config import RunConfig, event_log_path, __RANDOM_SEED__
+
+# Differential test: late events applied within the watermark must give the run of the in-place delta logs.
+# Usage: python test_late_events.py [event log CSV]
+
+WATERMARK = 3
+MOVED_SHARE = 0.1
+# Report keys that describe the arrival of the events, not the classification; every other key is compared
+ARRIVAL_REPORT_KEYS = {"delta_index", "revision", "late_events_applied", "late_events_dropped"}
+
+
+def comparable(report):
+    return {key: value for key, value in report.items() if key not in ARRIVAL_REPORT_KEYS}
+
+
+def move_rows_later(delta_logs, rng, n_source_logs=6):
+    """
+    Move a share of the rows of delta logs spread over the run, sorted by time, into one of the next
+    `WATERMARK` delta logs. Later in the run more cases are near `max_days` without events, so the
+    moved latest rows also shift the sleep checks of cases without late events.
+    """
+    originals = {path: pd.read_csv(path, dtype=str, keep_default_na=False) for path, _ in delta_logs}
+    frames = dict(originals)
+    moved = 0
+    for position in np.linspace(0, len(delta_logs) - WATERMARK - 1, n_source_logs).astype(int):
+        path = delta_logs[position][0]
+        frame = originals[path]
+        selected = rng.random(len(frame)) < MOVED_SHARE
+        # The latest event of a log is always moved, so it is later than every event left in its own log
+        selected[-1] = True
+        lags = rng.integers(1, WATERMARK + 1, size=len(frame))
+        for lag in range(1, WATERMARK + 1):
+            later_path = delta_logs[position + lag][0]
+            frames[later_path] = pd.concat([frames[later_path], frame[selected & (lags == lag)]])
+        # Rows moved in from earlier logs follow the original rows
+        frames[path] = pd.concat([frame[~selected], frames[path].iloc[len(frame):]])
+        moved += int(selected.sum())
+    for path, frame in frames.items():
+        frame.to_csv(path, index=False)
+    return moved
+
+
+def run(config):
+    process_manager = ProcessManager(config=config)
+    process_manager.keep_results = True
+    for _ in process_manager.iter_process_logs():
+        pass
+    process_manager.merge_run_sketches(process_manager.late_events.close_window())
+    return process_manager
+
+
+def case_state(process_manager, case):
+    state = {key: value for key, value in vars(case).items() if key not in ("variants", "trace_node")}
+    state["trace"] = process_manager.variants.trace(case.trace_node)
+    return state
+
+
+if __name__ == "__main__":
+    base = RunConfig(event_log_path=sys.argv[1] if len(sys.argv) > 1 else event_log_path, frequency="weekly",
+                     max_delta_events=None, late_event_watermark=WATERMARK, case_memory_budget=None, case_db_path=None,
+                     sample_output_dir=None, case_index=False, saved_outputs=[])
+    ProcessManager(config=base).check_or_split_logs()
+
+    with tempfile.TemporaryDirectory() as directory:
+        late_dir = os.path.join(directory, os.path.basename(base.delta_log_dir))
+        shutil.copytree(base.delta_log_dir, late_dir)
+        _, delta_logs = list_delta_logs(late_dir)
+        moved = move_rows_later(delta_logs, np.random.default_rng(__RANDOM_SEED__))
+        # The moved delta logs arrive on their own: no event log and no split manifest
+        os.remove(os.path.join(late_dir, MANIFEST_NAME))
+
+        in_place = run(base)
+        late = run(RunConfig(**{**vars(base), "delta_log_dir": late_dir,
+                                "event_log_path": os.path.join(directory, "missing_event_log.csv")}))
+
+    applied = sum(report["late_events_applied"] for report in late.delta_reports.values())
+    dropped = sum(report["late_events_dropped"] for report in late.delta_reports.values())
+    report_mismatches = {}
+    for position, report in in_place.delta_reports.items():
+        report, late_report = comparable(report), comparable(late.delta_reports[position])
+        keys = sorted(key for key in {**report, **late_report} if report.get(key) != late_report.get(key))
+        if keys:
+            report_mismatches[report["delta_file_name"]] = keys
+
+    case_mismatches = []
+    for case_id, case in in_place.cases.items():
+        expected, actual = case_state(in_place, case), case_state(late, late.cases.get(case_id))
+        keys = sorted(key for key in expected if expected[key] != actual[key])
+        if keys:
+            case_mismatches.append((case_id, keys))
+    sketch_mismatches = [name for name in ("wait_time_sketch", "completion_time_sketch")
+                         if getattr(in_place, name).to_dict() != getattr(late, name).to_dict()]
+
+    # The index only keeps what the deltas still in the window can need
+    index = late.late_events
+    frozen = len(index.delta_paths) - 1 - WATERMARK
+    stale_entries = [case_id for case_id, entries in index.case_events.items()
+                     if min(entry[0] for entry in entries) <= frozen]
+    stale_states = [case_id for case_id, states in index.states.items()
+                    if sum(position <= frozen for position in states) != 1 or max(states) <= frozen]
+
+    print(f"Rows moved: {moved}, late events applied: {applied}, dropped: {dropped}")
+    print(f"Deltas compared: {len(in_place.delta_reports)}, cases compared: {len(in_place.cases)}")
+    print(f"Delta report mismatches: {len(report_mismatches)}")
+    print(f"Case mismatches: {len(case_mismatches)}")
+    print(f"Run sketch mismatches: {sketch_mismatches}")
+    print(f"Indexed cases at the end: {len(index.case_events)} with events, {len(index.states)} with states, "
+          f"stale: {len(stale_entries) + len(stale_states)}")
+    for mismatch in list(report_mismatches.items())[:10] + case_mismatches[:10]:
+        print(mismatch)
+
+    assert applied == moved and not dropped
+    assert len(late.delta_reports) == len(in_place.delta_reports)
+    assert not report_mismatches, report_mismatches
+    assert not case_mismatches, case_mismatches[:10]
+    assert not sketch_mismatches, sketch_mismatches
+    assert not stale_entries and not stale_states, (stale_entries[:10], stale_states[:10])
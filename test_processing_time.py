@@ -1,26 +1,42 @@
+import os
 import pandas as pd
 import time
 from process import ProcessManager
+from partitioned_replay import PartitionedReplay
+from report import sweep_configs
+from config import RunConfig
 
 tests = {"initial_months": [1, 6, 12],
          "freq": ["daily", "weekly", "monthly"]}
 
-results = {"month": [],
-           "freq" : [],
-           "duration": [],
-           "total_seconds": []}
 
+def measure_processing_times(tests, results_path=None, strategy="cases", n_workers=None, base_config: RunConfig = None):
+    """
+    Run the full pipeline for every combination of initial months and frequency and time it.
 
+    :param results_path: CSV file of the timings; defaults to `evaluation/run_time_results.csv` in the output directory.
+    :param strategy: "cases" runs `ProcessManager` with `Case` objects; "partitioned" runs the
+                     time-partitioned parallel replay of `partitioned_replay.py` over `n_workers` processes.
+    :param base_config: Parameters shared by all combinations (event log, output directory, max_days, ...);
+                        defaults to `config.py`.
+    """
+    base_config = base_config or RunConfig()
+    results_path = results_path or os.path.join(base_config.output_dir, "evaluation", "run_time_results.csv")
+    results = {"month": [],
+               "freq" : [],
+               "strategy": [],
+               "duration": [],
+               "total_seconds": []}
 
-for month in tests["initial_months"]:
-    for freq in tests["freq"]:
+    for config in sweep_configs(base_config, tests["initial_months"], tests["freq"]):
+        month, freq = config.initial_months, config.frequency
         print(f"Measuring time for the {month} months initial log and {freq} splitting frequency\n")
 
-        output_dir = f'Dataset/Hospital Billing Delta Logs/Hospital Billing - Event Log_{freq}_({month})'
-        process_manager = ProcessManager(month, freq, output_dir)
-
         start_time = time.time()
-        process_manager.run()
+        if strategy == "partitioned":
+            PartitionedReplay(config, n_workers=n_workers).run()
+        else:
+            ProcessManager(config=config).run()
         end_time = time.time()
         total_seconds = end_time - start_time
         m,s = divmod((total_seconds), 60)
@@ -28,17 +44,21 @@ for month in tests["initial_months"]:
         print(f"Measuring time for {month}_{freq} is {m} minutes {"%.1f" %s} seconds")
         results["month"].append(f"{month}")
         results["freq"].append(freq)
+        results["strategy"].append(strategy)
         results["duration"].append(f"{m} minutes {"%.2f" %s} seconds")
         results["total_seconds"].append(total_seconds)
 
-df_results = pd.DataFrame(results)
-print(df_results)
-df_results.to_csv('Dataset/Hospital Billing Delta Logs/evaluation/run_time_results.csv')
+    df_results = pd.DataFrame(results)
+    print(df_results)
+    df_results.to_csv(results_path)
 
 
-month_grouped_avg = df_results.groupby("month").agg({"total_seconds":"mean"})
-freq_grouped_avg = df_results.groupby("freq").agg({"total_seconds":"mean"})
-print(month_grouped_avg)
-print(freq_grouped_avg)
+    month_grouped_avg = df_results.groupby("month").agg({"total_seconds":"mean"})
+    freq_grouped_avg = df_results.groupby("freq").agg({"total_seconds":"mean"})
+    print(month_grouped_avg)
+    print(freq_grouped_avg)
+    return df_results
 
 
+if __name__ == "__main__":
+    measure_processing_times(tests)
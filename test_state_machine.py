@@ -0,0 +1,56 @@
+import time
+from process import ProcessManager
+from delta_log_formation import list_delta_logs
+from state_machine import BatchStateMachine, compare_with_cases, compare_reports
+from partitioned_replay import PartitionedReplay
+from config import initial_months, frequency, delta_log_dir
+
+# Differential test: the table-driven state machine must reproduce the `Case` classification exactly
+
+if __name__ == "__main__":
+    process_manager = ProcessManager(initial_months, frequency, delta_log_dir)
+    process_manager.check_or_split_logs()
+    machine = BatchStateMachine(process_manager.max_days)
+
+    initial_log_path, delta_logs = list_delta_logs(delta_log_dir)
+    report_mismatches = {}
+    machine_reports = []
+    case_seconds, machine_seconds = 0.0, 0.0
+
+    for path, delta_name in [(initial_log_path, "initial_log")] + delta_logs:
+        start_time = time.time()
+        process_manager.process_logs(path, delta_name)
+        case_seconds += time.time() - start_time
+
+        start_time = time.time()
+        machine_report = machine.process_file(path, delta_name)
+        machine_seconds += time.time() - start_time
+        machine_reports.append(machine_report)
+
+        keys = compare_reports(process_manager.last_delta_report, machine_report)
+        if keys:
+            report_mismatches[delta_name] = keys
+
+    case_mismatches = compare_with_cases(machine, process_manager.cases)
+
+    # The time-partitioned replay must reproduce the sequential state machine
+    replay = PartitionedReplay(process_manager.config, n_partitions=8)
+    partitioned_reports, partitioned_cases = replay.run()
+    partitioned_mismatches = [position for position, (report, machine_report)
+                              in enumerate(zip(partitioned_reports, machine_reports)) if report != machine_report]
+    partitioned_frame = partitioned_cases[machine.to_frame().columns]
+    partitioned_frame_equal = partitioned_frame.astype(str).equals(machine.to_frame().astype(str))
+
+    print(f"Deltas compared: {len(delta_logs) + 1}, cases compared: {len(process_manager.cases)}")
+    print(f"Case objects: {case_seconds:.2f} seconds, state machine: {machine_seconds:.2f} seconds")
+    print(f"Delta report mismatches: {len(report_mismatches)}")
+    print(f"Case mismatches: {len(case_mismatches)}")
+    print(f"Partitioned replay delta mismatches: {len(partitioned_mismatches)}, "
+          f"cases equal: {partitioned_frame_equal}")
+    for mismatch in case_mismatches[:10]:
+        print(mismatch)
+
+    assert not report_mismatches, report_mismatches
+    assert not case_mismatches, case_mismatches[:10]
+    assert len(partitioned_reports) == len(machine_reports) and not partitioned_mismatches, partitioned_mismatches
+    assert partitioned_frame_equal
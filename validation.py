@@ -0,0 +1,150 @@
+import os
+import time
+import pandas as pd
+
+# Reason codes written to the quarantine file
+REQUIRED_COLUMNS = {"case": "MISSING_CASE", "event": "MISSING_EVENT", "state": "MISSING_STATE",
+                    "completeTime": "MISSING_TIME"}
+BAD_TIME = "BAD_TIME"
+SENTINEL_CASE_ID = "SENTINEL_CASE_ID"
+UNKNOWN_EVENT = "UNKNOWN_EVENT"
+DUPLICATE_EVENT = "DUPLICATE_EVENT"
+REASONS = list(REQUIRED_COLUMNS.values()) + [BAD_TIME, SENTINEL_CASE_ID, UNKNOWN_EVENT, DUPLICATE_EVENT]
+
+# Case ids that stand for a missing value, compared case-insensitively (e.g. "NA" and "NAN" in Hospital Billing)
+SENTINEL_CASE_IDS = {"NA", "NAN", "NULL", "NONE", ""}
+
+# Rows with a missing or unparseable completeTime cannot be assigned to a delta
+UNASSIGNED = "unassigned"
+
+QUARANTINE_NAME = "quarantine.csv"
+REPORT_NAME = "validation_report.csv"
+REPORT_COLUMNS = ["delta_name", "rows", "rejected", "reject_rate"] + REASONS + ["rows_per_second"]
+
+
+def parse_complete_times(dataframe):
+    """
+    Parse `completeTime` without failing on bad values.
+
+    :return: (times, raw) where unparseable or missing values are NaT in `times`; `raw` keeps the
+             original values so that the quarantine file shows what was read.
+    """
+    raw = dataframe["completeTime"]
+    times = pd.to_datetime(raw, errors="coerce").dt.tz_localize(None)
+    return times, raw
+
+
+class EventValidator:
+    """
+    Validation stage of the splitter: checks all event rows at once with column masks.
+
+    Rows with a missing case, event, state or completeTime, an unparseable completeTime, a
+    sentinel case id ("NA", "NAN", ...), an event name outside `known_events` or that repeat an
+    earlier row exactly are rejected. Rejected rows are appended to the quarantine file with the
+    delta they belong to and their reason codes (";"-separated when several apply). The report
+    has the rows, rejects and reject rate of every delta, rejects per reason and the throughput
+    of the validation pass.
+    """
+
+    def __init__(self, output_dir, known_events=None, append=False):
+        """
+        :param output_dir: Directory of the split logs; the quarantine file and report are written there.
+                           None keeps the rejected rows in memory (`quarantine`) and writes nothing.
+        :param known_events: Valid event names; None skips the check.
+        :param append: Keep the rows and report of earlier validations (incremental splits).
+        """
+        self.quarantine_path = None if output_dir is None else os.path.join(output_dir, QUARANTINE_NAME)
+        self.report_path = None if output_dir is None else os.path.join(output_dir, REPORT_NAME)
+        self.known_events = None if known_events is None else set(known_events)
+        self.stats = []
+        self.quarantined = []
+        self.rows = 0
+        self.seconds = 0.0
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            if not append:
+                for path in (self.quarantine_path, self.report_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def reasons(self, events, raw_times):
+        """Reason codes of every row, "" for valid rows."""
+        reasons = pd.Series("", index=events.index, dtype=object)
+
+        def flag(mask, code):
+            reasons[mask] += code + ";"
+
+        for column, code in REQUIRED_COLUMNS.items():
+            flag(raw_times.isna() if column == "completeTime" else events[column].isna(), code)
+        flag(raw_times.notna() & events["completeTime"].isna(), BAD_TIME)
+        flag(events["case"].notna() & events["case"].astype(str).str.strip().str.upper().isin(SENTINEL_CASE_IDS),
+             SENTINEL_CASE_ID)
+        if self.known_events is not None:
+            flag(events["event"].notna() & ~events["event"].isin(self.known_events), UNKNOWN_EVENT)
+        source_columns = [column for column in events.columns if column != "delta_period"]
+        flag(events.duplicated(subset=source_columns, keep="first"), DUPLICATE_EVENT)
+        return reasons.str.rstrip(";")
+
+    def validate(self, events, raw_times, delta_names):
+        """
+        Check event rows and quarantine the rejected ones.
+
+        :param events: Event rows with `completeTime` parsed by `parse_complete_times`.
+        :param raw_times: The unparsed `completeTime` values of the rows.
+        :param delta_names: Name of the delta each row belongs to (`UNASSIGNED` without a valid time).
+        :return: The valid rows.
+        """
+        start = time.perf_counter()
+        reasons = self.reasons(events, raw_times)
+        rejected = reasons != ""
+        self.seconds += time.perf_counter() - start
+        self.rows += len(events)
+
+        if rejected.any():
+            quarantined = events[rejected].assign(completeTime=raw_times[rejected], delta_name=delta_names[rejected],
+                                                  reason=reasons[rejected])
+            if self.quarantine_path is None:
+                self.quarantined.append(quarantined)
+            else:
+                quarantined.to_csv(self.quarantine_path, mode="a", header=not os.path.exists(self.quarantine_path),
+                                   index=False)
+
+        counts = pd.DataFrame({"delta_name": delta_names, "rows": 1, "rejected": rejected.astype(int)})
+        for code in REASONS:
+            counts[code] = reasons.str.contains(code, regex=False).astype(int) if rejected.any() else 0
+        self.stats.append(counts.groupby("delta_name", sort=False).sum())
+        return events[~rejected]
+
+    def quarantine(self):
+        """Rejected rows kept in memory, with their delta and reasons."""
+        return pd.concat(self.quarantined, ignore_index=True) if self.quarantined else pd.DataFrame()
+
+    def report(self):
+        """Validation statistics per delta."""
+        if self.stats:
+            report = pd.concat(self.stats).groupby(level=0, sort=False).sum().reset_index()
+        else:
+            report = pd.DataFrame(columns=REPORT_COLUMNS[:2] + ["rejected"] + REASONS)
+        report["reject_rate"] = report["rejected"] / report["rows"]
+        throughput = self.rows / self.seconds if self.seconds else 0.0
+        report["rows_per_second"] = throughput
+        return report[REPORT_COLUMNS]
+
+    def save_report(self):
+        """Write the validation statistics per delta and print a summary."""
+        report = self.report()
+        # Incremental splits append the deltas they validated; rows of the same delta add up
+        report.to_csv(self.report_path, mode="a", header=not os.path.exists(self.report_path), index=False)
+
+        throughput = self.rows / self.seconds if self.seconds else 0.0
+        rejected = report["rejected"].sum()
+        print(f"Validated {self.rows} events in {self.seconds:.3f} s ({throughput:,.0f} rows/s); "
+              f"{rejected} rejected ({rejected / self.rows if self.rows else 0:.2%}).")
+        if rejected:
+            by_reason = ", ".join(f"{code}: {report[code].sum()}" for code in REASONS if report[code].sum())
+            print(f"Rejected events ({by_reason}) saved to: {self.quarantine_path}")
+            worst = report.nlargest(3, "reject_rate")
+            print("Highest reject rates: " + ", ".join(f"{row.delta_name} ({row.reject_rate:.2%})"
+                                                      for row in worst.itertuples()))
+        print(f"Validation report saved to: {self.report_path}")
+        return report
@@ -0,0 +1,83 @@
+from array import array
+from collections import Counter
+
+
+class VariantTrie:
+    """
+    Shared prefix tree of traces.
+
+    Every node stands for one trace prefix (variant). Cases only keep the id of the node
+    of their current trace and advance it on each event, so identical prefixes are stored once.
+    """
+    ROOT = 0
+
+    def __init__(self):
+        self.event_names = []
+        self.event_ids = {}
+        self.children = {}
+        self.parents = array("l", [-1])
+        self.events = array("l", [-1])
+        self.depths = array("l", [0])
+
+    def __len__(self):
+        """Number of distinct variants (nodes without the root)."""
+        return len(self.parents) - 1
+
+    def event_id(self, event_name):
+        event_id = self.event_ids.get(event_name)
+        if event_id is None:
+            event_id = len(self.event_names)
+            self.event_ids[event_name] = event_id
+            self.event_names.append(event_name)
+        return event_id
+
+    def advance(self, node: int, event_name) -> int:
+        """
+        Return the node reached by appending an event to the trace of `node`.
+
+        :param node: Current node id of the case (ROOT for an empty trace).
+        :param event_name: Name of the new event.
+        :return: Node id of the extended trace.
+        """
+        key = (node, self.event_id(event_name))
+        child = self.children.get(key)
+        if child is None:
+            child = len(self.parents)
+            self.children[key] = child
+            self.parents.append(node)
+            self.events.append(key[1])
+            self.depths.append(self.depths[node] + 1)
+        return child
+
+    def depth(self, node: int) -> int:
+        """Length of the trace ending at `node`."""
+        return self.depths[node]
+
+    def trace(self, node: int) -> list:
+        """Rebuild the full list of event names for the trace ending at `node`."""
+        trace = []
+        while node != self.ROOT:
+            trace.append(self.event_names[self.events[node]])
+            node = self.parents[node]
+        trace.reverse()
+        return trace
+
+    def top_variants(self, nodes, n=10) -> list:
+        """
+        Most frequent variants among a collection of cases.
+
+        :param nodes: Iterable of node ids, e.g. the `trace_node` of the cases of interest.
+        :param n: Number of variants to return.
+        :return: List of (trace, count) tuples in descending frequency.
+        """
+        return [(self.trace(node), count) for node, count in Counter(nodes).most_common(n)]
+
+    def format_variants(self, variant_counter: Counter, n=5) -> dict:
+        """
+        Render the `n` most frequent node ids of a counter as readable trace strings.
+
+        Ties are broken by the trace string rather than by the order the cases were counted in, so
+        a delta revised by late events reports the same variants as one processed in order.
+        """
+        rendered = [(" > ".join(map(str, self.trace(node))), count) for node, count in variant_counter.items()]
+        return dict(sorted(rendered, key=lambda item: (-item[1], item[0]))[:n])
@@ -4,11 +4,22 @@ from plotly.subplots import make_subplots
 import pandas as pd
 from collections import Counter
 from config import cases_output_path, delta_output_path, focus_deltas
+from delta_stats import load_delta_stats
+
+# Delta statistics used by the plots; the per-delta case id sets are never loaded
+PLOT_COLUMNS = ["delta_file_name", "event_counts", "complete_count", "incomplete_count", "ongoing_count"]
 
 
 class VisualizationManager:
+    """
+    Interactive plots of the delta statistics and case output of a run.
+
+    Every `plot_*` method returns its Plotly figure; `show=False` skips opening it, which is
+    how `report.py` renders the plots headlessly.
+    """
+
     def __init__(self, delta_stats_path, case_output_path, focus_deltas = []):
-        self.delta_stats = pd.read_csv(delta_stats_path)
+        self.delta_stats = load_delta_stats(delta_stats_path, PLOT_COLUMNS)
         self.case_stats = pd.read_csv(case_output_path)
 
         if focus_deltas:
@@ -20,7 +31,7 @@ class VisualizationManager:
         self.incomplete_cases = self.case_stats[self.case_stats['final_status'] == "INCOMPLETE"]
         self.ongoing_cases = self.case_stats[self.case_stats['final_status'] == "ONGOING"]
 
-    def plot_event_counts_line_chart(self):
+    def plot_event_counts_line_chart(self, show=True):
         """
         Plot a line chart showing the event counts for each delta file.
         """
@@ -28,7 +39,7 @@ class VisualizationManager:
         event_counts_df = self.delta_stats[["delta_file_name", "event_counts"]]
 
         # Transform event counts into a structured DataFrame
-        event_counts_expanded = pd.json_normalize(event_counts_df["event_counts"].apply(eval))
+        event_counts_expanded = pd.json_normalize(event_counts_df["event_counts"].tolist())
         event_counts_expanded["delta_file_name"] = event_counts_df["delta_file_name"]
 
         # Melt the DataFrame for Plotly
@@ -49,9 +60,11 @@ class VisualizationManager:
             xaxis_tickangle=45,
             font_size=16
         )
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
-    def plot_case_status_pie_chart(self):
+    def plot_case_status_pie_chart(self, show=True):
         """
         Plot a pie chart showing the proportion of cancelled, complete, and incomplete cases.
         """
@@ -69,9 +82,11 @@ class VisualizationManager:
         )
         fig.update_traces(textinfo="percent+label")
         fig.update_layout(font_size=20, width=800, height=600)
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
-    def plot_incompleteness_reasons(self):
+    def plot_incompleteness_reasons(self, show=True):
         """
         Incompleteness Reasons
         """
@@ -100,9 +115,11 @@ class VisualizationManager:
         )
         fig.update_traces(textinfo="percent+label")
         fig.update_layout(font_size=18, width=1000, height=800)
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
-    def plot_missing_events(self):
+    def plot_missing_events(self, show=True):
         """
         Most common missing events in incomplete cases.
         """
@@ -129,9 +146,11 @@ class VisualizationManager:
             width=1000,
             height=600
         )
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
-    def plot_complete_cases_pie_chart(self):
+    def plot_complete_cases_pie_chart(self, show=True):
         """
         Pie chart of Billed, Cancelled, and Unbillable complete cases.
         """
@@ -153,9 +172,11 @@ class VisualizationManager:
         )
         fig.update_traces(textinfo="percent+label")
         fig.update_layout(font_size=20, width=800, height=600)
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
-    def plot_incomplete_trace_last_states(self):
+    def plot_incomplete_trace_last_states(self, show=True):
         """
         Create subplots for the frequency of last states and last events for incomplete traces.
         One set of subplots is for cases with the issue "missing events",
@@ -238,9 +259,11 @@ class VisualizationManager:
         # Adjust tick labels for readability
         fig.update_xaxes(tickangle=45)
 
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
-    def plot_trace_classifications_across_deltas(self):
+    def plot_trace_classifications_across_deltas(self, show=True):
         """
         Plot a stacked bar chart showing the counts of traces classified as COMPLETE, INCOMPLETE, CANCELLED,
         and ONGOING across deltas.
@@ -280,30 +303,36 @@ class VisualizationManager:
             legend_title="Trace Classifications"
         )
 
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
 
-########################################################################################################################
-viz_manager = VisualizationManager(delta_output_path, cases_output_path, focus_deltas)
+    def plot_all(self):
+        """Render every plot in turn."""
+        print("Generating Event Counts Line Chart...")
+        self.plot_event_counts_line_chart()
 
+        print("Generating Trace Classifications Across Delta...s")
+        self.plot_trace_classifications_across_deltas()
 
-print("Generating Event Counts Line Chart...")
-viz_manager.plot_event_counts_line_chart()
+        print("Generating Case Status Donut Chart...")
+        self.plot_case_status_pie_chart()
 
-print("Generating Trace Classifications Across Delta...s")
-viz_manager.plot_trace_classifications_across_deltas()
+        print("Generating Reasons for Incompleteness Donut Chart...")
+        self.plot_incompleteness_reasons()
 
-print("Generating Case Status Donut Chart...")
-viz_manager.plot_case_status_pie_chart()
+        print("Generating Most Common Missing Events Bar Chart...")
+        self.plot_missing_events()
 
-print("Generating Reasons for Incompleteness Donut Chart...")
-viz_manager.plot_incompleteness_reasons()
+        print("Generating Complete Cases Breakdown Donut Chart...")
+        self.plot_complete_cases_pie_chart()
 
-print("Generating Most Common Missing Events Bar Chart...")
-viz_manager.plot_missing_events()
+        print("Generating Last States and Events for Incomplete Traces Subplots...")
+        self.plot_incomplete_trace_last_states()
 
-print("Generating Complete Cases Breakdown Donut Chart...")
-viz_manager.plot_complete_cases_pie_chart()
 
-print("Generating Last States and Events for Incomplete Traces Subplots...")
-viz_manager.plot_incomplete_trace_last_states()
+########################################################################################################################
+if __name__ == "__main__":
+    viz_manager = VisualizationManager(delta_output_path, cases_output_path, focus_deltas)
+    viz_manager.plot_all()